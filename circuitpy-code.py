@@ -2,6 +2,12 @@
 # BrickMaster2 Executor for CircuitPython Boards
 
 import brickmaster2
+# Import the parts we use directly. The package only loads submodules on first use.
+import brickmaster2.controls
+import brickmaster2.core
+import brickmaster2.exceptions
+import brickmaster2.network
+import brickmaster2.util
 import microcontroller
 import os
 import time
@@ -58,8 +64,8 @@ wifi_obj = brickmaster2.network.BM2WiFi(
 )
 
 # Create the BrickMaster2 Object.
-bm2 = brickmaster2.BrickMaster2(config_json=config_json, mac_id=wifi_obj.wifi_mac, wifi_obj=wifi_obj,
-                                sysrun=sysrun_ctrl)
+bm2 = brickmaster2.core.BrickMaster2(config_json=config_json, mac_id=wifi_obj.wifi_mac, wifi_obj=wifi_obj,
+                                     sysrun=sysrun_ctrl)
 
 try:
     # Run it.
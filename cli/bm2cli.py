@@ -1,6 +1,12 @@
 #!/usr/bin/python3
 # Brickmaster2 Command Executor.
+import time
+# Time the imports, for startup profiling.
+import_start = time.monotonic()
 import brickmaster2
+import brickmaster2.core
+import brickmaster2.util
+import_time = time.monotonic() - import_start
 import pid
 import argparse
 from pathlib import Path
@@ -10,11 +16,25 @@ import os
 import sys
 from pprint import pprint
 
-import brickmaster2.util
-
 # Do some argument parsing here.
 cmd_opts = None
 
+def print_startup_profile(profile):
+    """
+    Print the per-phase startup breakdown.
+
+    :param profile: Startup phases from the core, as (phase, seconds) tuples.
+    :type profile: list
+    :return: None
+    """
+    phases = [('imports', import_time)] + profile
+    total = sum(phase[1] for phase in phases)
+    print("Startup profile:")
+    for phase, seconds in phases:
+        print("  {:<12}{:>10.1f}ms{:>7.1f}%".format(phase, seconds * 1000, seconds / total * 100))
+    print("  {:<12}{:>10.1f}ms".format('total', total * 1000))
+
+
 def main():
     print("Brickmaster2 - {}".format(brickmaster2.__version__))
     print("Running as '{}'".format(pwd.getpwuid(os.getuid()).pw_name))
@@ -29,8 +49,46 @@ def main():
     config_group.add_argument("-nc", "--netconfig", action="store", help="NetConfig URL")
     parser.add_argument("-dc", "--dumpconfig", action="store_true", help="Dump config once loaded")
     parser.add_argument("-r", "--rundir", action="store", default="/tmp", help="Run directory, for the PID file.")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Use the asyncio runtime instead of the polling loop.")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Report how long each startup phase took, then exit.")
+    parser.add_argument("--bench-logging", action="store_true",
+                        help="Measure per-poll logging overhead at WARNING and DEBUG, then exit.")
+    parser.add_argument("--bench-publish", action="store_true",
+                        help="Measure per-poll publish cost at 10, 100 and 1000 controls, then exit.")
+    parser.add_argument("--bench-flight", action="store_true",
+                        help="Measure flight plan build time with and without NumPy, then exit.")
     args = parser.parse_args()
 
+    if args.bench_logging:
+        import brickmaster2.log
+        results = brickmaster2.log.benchmark()
+        print("Logging overhead per poll:")
+        for level_name in results:
+            print("  {:<12}{:>10.2f}us".format(level_name, results[level_name]))
+        return
+
+    if args.bench_publish:
+        import brickmaster2.network.mqtt
+        results = brickmaster2.network.mqtt.benchmark_plan()
+        print("Publish cost per poll:")
+        print("  {:<12}{:>12}{:>12}{:>12}".format('controls', 'idle', 'changed', 'forced'))
+        for count in results:
+            print("  {:<12}{:>10.2f}us{:>10.2f}us{:>10.2f}us".format(count, *results[count]))
+        return
+
+    if args.bench_flight:
+        import brickmaster2.scripts
+        results = brickmaster2.scripts.benchmark_flight()
+        print("Flight plan build time:")
+        print("  {:<8}{:<8}{:>12}{:>12}".format('profile', 'hours', 'python', 'numpy'))
+        for profile, hours in results:
+            python_ms, numpy_ms = results[(profile, hours)]
+            print("  {:<8}{:<8}{:>10.2f}ms{:>12}".format(
+                profile, hours, python_ms, 'n/a' if numpy_ms is None else "{:.2f}ms".format(numpy_ms)))
+        return
+
     # Start the main operating loop.
     try:
         with PidFile('CobraBay', piddir=args.rundir) as p:
@@ -41,6 +99,7 @@ def main():
             if args.netconfig:
                 print("Loading network config from: {}".format(args.netconfig))
                 config_json = brickmaster2.util.fetch_config(args.netconfig)
+                config_loader = lambda: brickmaster2.util.fetch_config(args.netconfig)
             else:
                 if args.config is None:
                     print("No config path given. Trying './config.json'")
@@ -55,6 +114,7 @@ def main():
                     sys.exit(1)
                 else:
                     config_json = brickmaster2.util.load_config(config_path)
+                    config_loader = lambda: brickmaster2.util.load_config(config_path)
 
             if args.dumpconfig:
                 print("Config read. Dump requested. Here it comes!")
@@ -65,10 +125,18 @@ def main():
 
             # Initialize the system
             print("CLI - Initializing...")
-            bm2 = brickmaster2.BrickMaster2(config_json, sys_mac_id)
+            # The config loader lets SIGHUP re-read the config.
+            bm2 = brickmaster2.core.BrickMaster2(config_json, sys_mac_id, config_loader=config_loader)
+            if args.profile_startup:
+                print_startup_profile(bm2.startup_profile)
+                bm2.cleanup_and_exit(message="Startup profile complete.")
             # Start.
             print("CLI - Initialization complete. Operation start.")
-            bm2.run()
+            if args.use_async:
+                print("CLI - Using asyncio runtime.")
+                bm2.run_async()
+            else:
+                bm2.run()
 
     except pid.base.PidFileAlreadyLockedError:
         print("Cannot start, already running!")
@@ -2,23 +2,34 @@
 Brickmaster2
 """
 
-# Controls
-from . import controls
-# Network
-from . import network
-# Scripts
-from . import scripts
-# # Utility methods.
-from . import util
-
-# Unitary Classes from files
-
-from .core import BrickMaster2
-from .config import BM2Config
-from .display import Display
+# Submodules and classes are imported on first use, so a setup without displays never loads the display drivers and
+# validating a config doesn't pull in the network stack. Code that has to run where module __getattr__ isn't
+# available should import the submodule it needs directly, ie: 'import brickmaster2.controls'.
 from . import exceptions
 from .version import __version__
 
+# Submodules that can be reached as attributes of the package.
+_SUBMODULES = ('config', 'controls', 'core', 'display', 'i2c', 'log', 'network', 'perf', 'scripts', 'util')
+# Unitary classes, and the submodule each one lives in.
+_CLASSES = {
+    'BrickMaster2': 'core',
+    'BM2Config': 'config',
+    'Display': 'display'
+}
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        # Importing a submodule sets it as an attribute of the package, so this only runs once per submodule.
+        __import__('brickmaster2.' + name)
+        return globals()[name]
+    if name in _CLASSES:
+        value = getattr(__getattr__(_CLASSES[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module 'brickmaster2' has no attribute '{}'".format(name))
+
+
 # Constants
 # These mirror the errors from adafruit_minimqtt.
 
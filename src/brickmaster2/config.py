@@ -5,16 +5,334 @@ import sys
 import json
 import os
 import gc
+import time
+import brickmaster2.log
+
+# Validation schemas.
+#
+# Each section of the config is described by a schema, which is compiled once at import into a validator function.
+# A validator walks its section a single time, checking, converting and filling in defaults as it goes. Sections are
+# normalized in place, so no second copy of the config is built.
+#
+# A schema is a dict with these keys:
+#   'rules' - Tuple of (key, default, check, strict) rules, in the order to process them.
+#       default - Value to use if the key is missing. _REQUIRED if the key must be present. A function is called with
+#           the section to build the default, for defaults that are mutable or come from other keys.
+#       check - None, or a function taking (value, label, errors) that returns the normalized value and raises
+#           ValueError or TypeError if the value can't be used.
+#       strict - If True, an invalid value invalidates the whole section. Otherwise the default is used and the
+#           problem noted.
+#   'skip' - Optional. Key which, if true, marks the section as disabled. The key is removed either way.
+#   'variants' - Optional. Tuple of a key and a dict mapping that key's values to the further keys they require.
+#       Values not in the dict aren't supported.
+#   'finish' - Optional. Function taking (section, label, errors) for anything that spans several keys.
+#
+# Validators share the same contract as checks, so compiled sections can be nested as checks of other sections.
+
+_REQUIRED = object()
+
+_LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'critical': logging.CRITICAL
+}
+
+
+class _Disabled(Exception):
+    """
+    Raised by a validator when its section is marked as disabled.
+    """
+    pass
+
+
+def _compile(schema):
+    """
+    Compile a schema into a validator.
+
+    :param schema: Section schema.
+    :type schema: dict
+    :return: function
+    """
+    rules = schema['rules']
+    skip_key = schema.get('skip')
+    variant_key, variants = schema.get('variants', (None, None))
+    finish = schema.get('finish')
+
+    def validate(section, label, errors):
+        if not isinstance(section, dict):
+            raise TypeError("must be a dictionary")
+        if skip_key is not None and skip_key in section and section.pop(skip_key):
+            raise _Disabled()
+        for key, default, check, strict in rules:
+            if key in section:
+                if check is None:
+                    continue
+                try:
+                    section[key] = check(section[key], label + '.' + key, errors)
+                except (ValueError, TypeError) as e:
+                    if strict:
+                        raise ValueError("'{}': {}".format(key, e))
+                    section[key] = default(section) if callable(default) else default
+                    errors.append("{}: '{}' {}, using default '{}'".format(label, key, e, section[key]))
+            elif default is _REQUIRED:
+                raise ValueError("'{}' is required".format(key))
+            else:
+                section[key] = default(section) if callable(default) else default
+        if variant_key is not None:
+            try:
+                needs = variants[section[variant_key]]
+            except KeyError:
+                raise ValueError("{} '{}' is not supported".format(variant_key, section[variant_key]))
+            for key in needs:
+                if key not in section:
+                    raise ValueError("'{}' is required for {} '{}'".format(key, variant_key, section[variant_key]))
+        if finish is not None:
+            finish(section, label, errors)
+        return section
+
+    return validate
+
+
+def _list_of(validate):
+    """
+    Make a check for a list of sections. Invalid sections are noted and dropped, disabled sections are dropped.
+
+    :param validate: Validator for each item in the list.
+    :type validate: function
+    :return: function
+    """
+    def check(value, label, errors):
+        if not isinstance(value, list):
+            raise TypeError("must be a list of dictionaries")
+        valid = []
+        for i, item in enumerate(value):
+            item_label = "{}[{}]".format(label, i)
+            try:
+                valid.append(validate(item, item_label, errors))
+            except _Disabled:
+                brickmaster2.log.getLogger('BrickMaster2').info("Config: {} '{}' marked as disabled. Skipping.".
+                                                       format(item_label, item.get('id')))
+            except (ValueError, TypeError) as e:
+                errors.append("{}: {}. Discarding.".format(item_label, e))
+        return valid
+    return check
+
+
+def _choice(choices):
+    """
+    Make a check that a string, compared case-insensitively, is one of the given choices.
+
+    :param choices: Allowed values, lowercase.
+    :type choices: tuple
+    :return: function
+    """
+    def check(value, label, errors):
+        if not isinstance(value, str) or value.lower() not in choices:
+            raise ValueError("'{}' is not one of {}".format(value, choices))
+        return value.lower()
+    return check
+
+
+def _str(value, label, errors):
+    if not isinstance(value, str):
+        raise TypeError("must be a string")
+    return value
+
+
+def _lower(value, label, errors):
+    return _str(value, label, errors).lower()
+
+
+def _int(value, label, errors):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError("must be an integer")
+    return value
+
+
+def _float(value, label, errors):
+    return float(value)
+
+
+def _list(value, label, errors):
+    if not isinstance(value, list):
+        raise TypeError("must be a list")
+    return value
+
+
+def _hex(value, label, errors):
+    # Addresses are given as strings in "0xXX" format.
+    if not isinstance(value, str):
+        raise TypeError("must be a string in \"0xXX\" format")
+    return int(value, 16)
+
+
+def _flag(value, label, errors):
+    # Flags may be given as JSON booleans or as 'true'/'false' strings.
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    raise TypeError("must be true or false")
+
+
+def _indicators(value, label, errors):
+    if not isinstance(value, dict):
+        raise TypeError("must be a dictionary")
+    if 'sysrun' not in value:
+        value['sysrun'] = None
+    # Neton and netoff must be paired.
+    if not ('neton' in value and 'netoff' in value):
+        errors.append("{}: When network indicator provided, both 'neton' and 'netoff' must be defined!".format(label))
+        value['neton'] = None
+        value['netoff'] = None
+    return value
+
+
+def _idle(value, label, errors):
+    # Idle may be given as just the thing to show.
+    if isinstance(value, str):
+        value = {'show': value}
+    return _IDLE(value, label, errors)
+
+
+def _finish_system(section, label, errors):
+    # Map the log level to an actual Logging entity.
+    section['log_level_name'] = section['log_level']
+    section['log_level'] = _LOG_LEVELS[section['log_level']]
+    # Flatten the Home Assistant options. If 'ha' is defined, turn discovery on.
+    ha = section.pop('ha')
+    section['ha_discover'] = ha is not None
+    if ha is None:
+        ha = {'area': None, 'base': 'homeassistant', 'meminfo': 'unified'}
+    section['ha_area'] = ha['area']
+    section['ha_base'] = ha['base']
+    section['ha_meminfo'] = ha['meminfo']
+
+
+def _finish_scripts(section, label, errors):
+    # CircuitPython doesn't support Pathlib and scanning. Scripts must be individually enumerated.
+    if section['scan_dir'] and sys.implementation.name != 'cpython':
+        errors.append("{}: Cannot scan scripts directory on {}. Scripts must be individually enumerated.".
+                      format(label, sys.implementation.name))
+        section['scan_dir'] = False
+
+
+_MQTT = _compile({
+    'rules': (
+        ('broker', _REQUIRED, None, True),
+        ('user', _REQUIRED, None, True),
+        ('key', _REQUIRED, None, True),
+        ('log', False, None, False),
+        ('queue_bytes', 4096, _int, False)
+    )
+})
+
+_HA = _compile({
+    'rules': (
+        ('area', None, _str, False),
+        ('base', 'homeassistant', _str, False),
+        ('meminfo', 'unified', _choice(('unified', 'unified-used', 'split-pct', 'split-all')), False)
+    )
+})
+
+_SYSTEM = _compile({
+    'rules': (
+        ('id', _REQUIRED, None, True),
+        ('mqtt', _REQUIRED, _MQTT, True),
+        ('name', lambda section: section['id'], None, False),
+        ('log_level', 'warning', _choice(tuple(_LOG_LEVELS)), False),
+        ('i2c', None, None, False),
+        ('wifihw', None, None, False),
+        ('indicators', lambda section: {'sysrun': None, 'neton': None, 'netoff': None}, _indicators, False),
+        ('publish_time', 15, _int, False),
+        ('ha', None, _HA, False)
+    ),
+    'finish': _finish_system
+})
+
+_CONTROL = _compile({
+    'rules': (
+        ('id', _REQUIRED, None, True),
+        ('type', _REQUIRED, _lower, True),
+        ('name', lambda section: section['id'], None, False),
+        ('icon', 'mdi:toy-brick', _str, False)
+    ),
+    'skip': 'disable',
+    'variants': ('type', {
+        'gpio': ('pin',),
+        'aw9523': ('addr', 'pin')
+    })
+})
+
+_IDLE = _compile({
+    'rules': (
+        ('show', 'blank', _choice(('time', 'date', 'blank')), False),
+        ('brightness', 1, _float, False)
+    )
+})
+
+_DISPLAY = _compile({
+    'rules': (
+        ('id', _REQUIRED, None, True),
+        ('type', _REQUIRED, _choice(('seg7x4', 'bigseg7x4')), True),
+        ('address', _REQUIRED, _hex, True),
+        ('name', lambda section: section['id'], None, False),
+        ('idle', lambda section: {'show': 'blank', 'brightness': 1}, _idle, False)
+    )
+})
+
+_SCRIPTS = _compile({
+    'rules': (
+        ('dir', 'scripts', _str, True),
+        ('scan_dir', sys.implementation.name == 'cpython', _flag, False),
+        ('files', lambda section: [], _list, False)
+    ),
+    'finish': _finish_scripts
+})
+
+_CONFIG = _compile({
+    'rules': (
+        ('system', _REQUIRED, _SYSTEM, True),
+        ('controls', _REQUIRED, _list_of(_CONTROL), True),
+        ('displays', lambda section: [], _list_of(_DISPLAY), True),
+        ('scripts', _REQUIRED, _SCRIPTS, True)
+    )
+})
+
+
+def validate_config(config_json):
+    """
+    Validate and normalize a config in a single walk.
+
+    :param config_json: Config, as loaded from JSON. Normalized in place.
+    :type config_json: dict
+    :return: tuple of the normalized config, or None if the config can't be used, and a list of the problems found.
+    """
+    errors = []
+    try:
+        config = _CONFIG(config_json, 'config', errors)
+    except (ValueError, TypeError) as e:
+        errors.append("config: {}".format(e))
+        return None, errors
+    return config, errors
 
 
 class BM2Config:
     def __init__(self, config_json):
-        self._config = config_json
-        self._logger = logging.getLogger("BrickMaster2")
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
         self._logger.setLevel(logging.INFO)
 
-        if not self._validate():
-            raise ValueError("File is not a valid Brickmaster configuration.")
+        validate_start = time.monotonic()
+        self._config, self._errors = validate_config(config_json)
+        for error in self._errors:
+            self._logger.warning("Config: {}".format(error))
+        if self._config is None:
+            raise ValueError("File is not a valid Brickmaster configuration. {}".format(self._errors[-1]))
+        self._logger.info("Config: Validated {} controls and {} displays in {}ms, {} problems found.".format(
+            len(self._config['controls']), len(self._config['displays']),
+            round((time.monotonic() - validate_start) * 1000, 3), len(self._errors)))
 
         self._logger.info("Config: Setting log level to: {}".format(self._config['system']['log_level_name']))
         self._logger.setLevel(self._config['system']['log_level'])
@@ -25,380 +343,13 @@ class BM2Config:
         '''
         return json.dumps(self._config)
 
-    # Validation methods.
-
-    # Master validator
-    def _validate(self):
-        # Check for the required config sections.
-        required_keys = ['system', 'controls', 'scripts']
-        print(self._config)
-        for key in required_keys:
-            self._logger.debug("Checking for section '{}'".format(key))
-            if key not in self._config:
-                self._logger.critical("Required configuration section '{}' not present. Cannot continue!".format(key))
-                sys.exit(1)
-        # Change the logging level.
-        self._validate_logging()
-        self._logger.info("Config: Adjusting log level to '{}'".format(self._config['system']['log_level_name']))
-        self._logger.setLevel(self._config['system']['log_level'])
-        # Make sure the right sections exist.
-        self._validate_system()
-        # Validate the controls.
-        self._validate_controls()
-        # Validate the displays.
-        self._validate_displays()
-        # Validate the scripts.
-        self._validate_scripts()
-        return True
-
-    # Validate system settings
-    def _validate_system(self):
-        self._logger.debug("Config: Validating system section")
-        required_params = ['id', 'mqtt']
-        optional_params = ['name', 'i2c', 'log_level', 'wifihw']
-        optional_defaults = {
-            'i2c': None,
-            'log_level': 'info',
-            'wifihw': None
-        }
-        # Check for presence of required options.
-        for param in required_params:
-            self._logger.debug("Config: Checking for required key '{}'".format(param))
-            if param not in self._config['system']:
-                self._logger.critical("Config: Required config option '{}' missing. Cannot continue!".format(param))
-                sys.exit(0)
-
-        # Check for optional settings, assign the defaults if need be.
-        for param in optional_params:
-            self._logger.debug("Config: Checking for optional parameter '{}'".format(param))
-            if param not in self._config['system']:
-                self._logger.warning("Option '{}' not found, using default '{}'".
-                                     format(param, optional_defaults[param]))
-                self._config['system'][param] = optional_defaults[param]
-        if 'name' not in self._config['system']:
-            self._logger.info("Config: Name not set, defaulting to ID.")
-            self._config['system']['name'] = self._config['system']['id']
-
-        # Confirm all MQTT sub-keys are defined.
-        mqtt_keys = {'broker','user','key'}
-        if not mqtt_keys <= set(self._config['system']['mqtt'].keys()):
-            self._logger.error("Config: All MQTT keys not defined. Cannot continue!")
-            sys.exit(1)
-        # Optional MQTT parameter.
-        if 'log' not in self._config['system']['mqtt']:
-            self._config['system']['mqtt']['log'] = False
-
-        # Check for network indicator definition.
-        if 'indicators' in self._config['system']:
-            # Make sure 'sysrun' is defined, even if not in the config.
-            if 'sysrun' not in self._config['system']['indicators']:
-                self._config['system']['indicators']['sysrun'] = None
-
-            # Neton and netoff must be paired.
-            if not ('neton' in self._config['system']['indicators'] and 'netoff' in self._config['system']['indicators']):
-                self._logger.warning("Config: When network indicator provided, both 'neton' and 'netoff' "
-                                     "must be defined!")
-                self._config['system']['indicators']['neton'] = None
-                self._config['system']['indicators']['netoff'] = None
-
-        else:
-            self._config['system']['indicators'] = { 'sysrun': None, 'neton': None, 'netoff': None }
-
-        # Check for a modified publish time.
-        try:
-            if isinstance(self._config['system']['publish_time'], int):
-                self._logger.info("Config: Using Publish Time {}s".format(self._config['system']['publish_time']))
-            else:
-                self._logger.warning("Config: Provided Publish Time is not an integer, defaulting to 15s.")
-                self._config['system']['publish_time'] = 15
-        except KeyError:
-            self._logger.info("Config: Using default Publish Time of 15s")
-            self._config['system']['publish_time'] = 15
-
-        # Check for Home Assistant configuration
-        if 'ha' in self._config['system']:
-            # If 'ha' is defined, turn home assistant discovery on.
-            self._config['system']['ha_discover'] = True
-            # Check for a default area.
-            try:
-                if isinstance(self._config['system']['ha']['area'], str):
-                    self._logger.info("Config: Using HA Area '{}'".format(self._config['system']['ha']['area']))
-                    self._config['system']['ha_area'] = self._config['system']['ha']['area']
-                    del self._config['system']['ha']['area']
-            except KeyError:
-                pass
-            # Check for a base discovery prefix.
-            try:
-                if isinstance(self._config['system']['ha']['base'], str):
-                    self._logger.info("Config: Using HA Base '{}'".format(self._config['system']['ha']['base']))
-                    self._config['system']['ha_base'] = self._config['system']['ha']['base']
-                    del self._config['system']['ha']['base']
-            except KeyError:
-                pass
-
-            # Check for how to set up Meminfo.
-            try:
-                if isinstance(self._config['system']['ha']['meminfo'], str):
-                    if self._config['system']['ha']['meminfo'] in ('unified', 'unified-used', 'split-pct', 'split-all'):
-                        self._logger.debug("Config: Memory info topics will be discovered as '{}'".
-                                           format(self._config['system']['ha']['meminfo']))
-                        self._config['system']['ha_meminfo'] = self._config['system']['ha']['meminfo']
-                        del self._config['system']['ha']['meminfo']
-                    else:
-                        self._logger.warning("Config: Memory info option '{}' not valid. Defaulting to 'unified'".
-                                             format(self._config['system']['ha']['meminfo']))
-                        self._config['system']['ha_meminfo'] = 'unified'
-                        del self._config['system']['ha']['meminfo']
-            except KeyError:
-                self._config['system']['ha_meminfo'] = 'unified'
-
-            # Remove the base HA item.
-            del self._config['system']['ha']
-        else:
-            self._config['system']['ha_discover'] = False
-
-    def _validate_logging(self):
-        try:
-            # Map the log level to an actual Logging entity.
-            if self._config['system']['log_level'].lower() == 'debug':
-                self._config['system']['log_level_name'] = 'debug'
-                self._config['system']['log_level'] = logging.DEBUG
-            elif self._config['system']['log_level'].lower() == 'info':
-                self._config['system']['log_level_name'] = 'info'
-                self._config['system']['log_level'] = logging.INFO
-            elif self._config['system']['log_level'].lower() == 'warning':
-                self._config['system']['log_level_name'] = 'warning'
-                self._config['system']['log_level'] = logging.WARNING
-            elif self._config['system']['log_level'].lower() == 'error':
-                self._config['system']['log_level_name'] = 'error'
-                self._config['system']['log_level'] = logging.ERROR
-            elif self._config['system']['log_level'].lower() == 'critical':
-                self._config['system']['log_level_name'] = 'critical'
-                self._config['system']['log_level'] = logging.CRITICAL
-            else:
-                self._config['system']['log_level_name'] = 'warning'
-                self._config['system']['log_level'] = logging.WARNING
-        except KeyError:
-            self._config['system']['log_level_name'] = 'warning'
-            self._config['system']['log_level'] = logging.WARNING
-
-    #No longer needed, don't use separate secrets file.
-    # def _validate_secrets(self):
-    #     self._logger.debug("Integrating secrets.")
-    #     self._config['secrets'] = {}
-    #     required_keys = ['broker', 'mqtt_username', 'mqtt_password']
-    #     # Systems with a full OS handle their own networking. CircuitPython boards need us to handle the network.
-    #     # In the latter case, SSID and passphrase are required
-    #     if os.uname().sysname.lower() != "linux":
-    #         required_keys.append("SSID")
-    #         required_keys.append("password")
-    #     optional_keys = ['port']
-    #     optional_defaults = {'port': 1883}
-    #
-    #     # Open the secrets file.
-    #     self._logger.info("Secrets on CL: {}".format(self._secrets_file))
-    #     if self._secrets_file is not None:
-    #         secrets = self._open_json(self._secrets_file)
-    #     else:
-    #         secrets = self._open_json(self._config['system']['secrets'])
-    #     self._logger.debug("Got secrets: {}".format(json.dumps(secrets)))
-    #     # Check for presence of required options.
-    #     for key in required_keys:
-    #         self._logger.debug("Checking for required key '{}'".format(key))
-    #         if key not in secrets:
-    #             self._logger.critical("Required config option '{}' missing. Cannot continue!".format(key))
-    #             sys.exit(0)
-    #         else:
-    #             self._config['secrets'][key.lower()] = secrets[key]
-    #     # Check for optional settings, assign the defaults if need be.
-    #     for key in optional_keys:
-    #         self._logger.debug("Checking for optional key '{}'".format(key))
-    #         if key not in secrets:
-    #             self._logger.warning("Option '{}' not found, using default '{}'".format(key, optional_defaults[key]))
-    #             self._config['secrets'][key] = optional_defaults[key]
-
-    def _validate_controls(self):
-        if not isinstance(self._config['controls'], list):
-            self._logger.critical('Config: Controls not correctly defined. Must be a list of dictionaries.')
-            return
-        i = 0
-        to_delete = []
-        while i < len(self._config['controls']):
-            self._logger.debug("Config: Validating control definition '{}'".format(self._config['controls'][i]))
-            # Check to see if required items are defined.
-            required_keys = ['id', 'type']
-            for key in required_keys:
-                if key not in self._config['controls'][i]:
-                    self._logger.critical("Config: Required control config option '{}' missing in control {}. Cannot configure!".
-                                          format(key, i+1))
-                    to_delete.append(i)
-
-            # Check to see if name is defined.
-            if 'name' not in self._config['controls'][i]:
-                self._config['controls'][i]['name'] = self._config['controls'][i]['id']
-
-            # Check to see if the control is disabled. This allows items to be left in the config file but skipped
-            try:
-                if self._config['controls'][i]['disable']:
-                    self._logger.info("Config: Control {} marked as disabled. Skipping.".
-                                      format(self._config['controls'][i]['name']))
-                    to_delete.append(i)
-                    i += 1
-                    continue
-                else:
-                    # If the 'disable' setting for the control is anything other than true,
-                    # enable and ignore the setting.
-                    del self._config['controls'][i]['disable']
-            except KeyError:
-                pass
-
-            # Pull out control type, this just make it easier.
-            ctrltype = self._config['controls'][i]['type']
-            if ctrltype == 'gpio':
-                required_parameters = ['pin']
-            elif ctrltype == 'aw9523':
-                required_parameters = ['addr', 'pin']
-            else:
-                self._logger.error("Config: Cannot set up control '{}', type '{}' is not supported.".format(i, ctrltype))
-                to_delete.append(i)
-                i += 1
-                continue
-
-            for req_param in required_parameters:
-                if req_param not in self._config['controls'][i]:
-                    self._logger.error("Config: Cannot set up control '{}', no '{}' directive.".format(
-                        self._config['controls'][i]['name'], req_param))
-                    to_delete.append(i)
-                    i += 1
-                    continue
-
-            optional_params = ['icon']
-            optional_defaults = {
-                'icon': 'mdi:toy-brick'
-            }
-            for param in optional_params:
-                self._logger.debug("Config: Checking for optional parameter '{}'".format(param))
-                if param not in self._config['controls'][i]:
-                    self._logger.warning("Config: Option '{}' not found, using default '{}'".
-                                         format(param, optional_defaults[param]))
-                    self._config['controls'][i][param] = optional_defaults[param]
-                else:
-                    self._logger.debug("Config: Optional parameter '{}' set to '{}'".format(
-                        param, self._config['controls'][i][param]
-                    ))
-
-            i += 1
-        # Make the to_delete list unique.
-        to_delete = list(set(to_delete))
-        self._logger.debug("Controls to remove: {}".format(to_delete))
-        # Delete any controls that have been invalidated
-        for d in sorted(to_delete, reverse=True):
-            del self._config['controls'][d]
-        self._logger.debug("Config proceeding with successful controls: {}".format(self._config['controls']))
-
-    # Validate the displays on loading.
-    def _validate_displays(self):
-        if not isinstance(self._config['displays'], list):
-            self._logger.critical('Displays not correctly defined. Must be a list of dictionaries.')
-            return
-        i = 0
-        to_delete = []
-        while i < len(self._config['displays']):
-            self._logger.debug("Checking display {}. Has raw config {}".format(i, self._config['displays'][i]))
-            required_keys = ['id', 'type', 'address']
-            for key in required_keys:
-                self._logger.debug("Checking for required display key '{}'".format(key))
-                if key not in self._config['displays'][i]:
-                    self._logger.critical("Required control display option '{}' missing in display {}. "
-                                          "Discarding display.".format(key, i))
-                    to_delete.append(i)
-                    # i += 1
-                    continue
-            # Make sure type is legitimate.
-            if self._config['displays'][i]['type'].lower() not in ('seg7x4', 'bigseg7x4'):
-                self._logger.critical("Display type '{}' not known in display {}. Discarding display.".
-                                      format(self._config['displays'][i]['type'], i))
-                to_delete.append(i)
-                # i += 1
-                continue
-            # If name isn't defined, convert ID to name.
-            if 'name' not in self._config['displays'][i]:
-                self._config['displays'][i]['name'] = self._config['displays'][i]['id']
-
-            # Convert the address to a hex value.
-            try:
-                self._config['displays'][i]['address'] = int(self._config['displays'][i]['address'], 16)
-            except TypeError:
-                self._logger.critical("Address not a string for display {}. Should be in \"0xXX\" format. "
-                                      "Discarding display.".format(i))
-                # i += 1
-                to_delete.append(i)
-                continue
-            # Default when_idle to blank, if not otherwise specified.
-            if 'idle' not in self._config['displays'][i]:
-                self._config['displays'][i]['idle'] = {'show': 'blank'}
-            else:
-                # If the idle was put in as a string, convert it into a dict and default to full brightness.
-                if isinstance(self._config['displays'][i]['idle'], str):
-                    self._config['displays'][i]['idle'] = {
-                        'show': self._config['displays'][i]['idle'],
-                        'brightness': 1
-                         }
-                else:
-                    # Check the show option.
-                    if self._config['displays'][i]['idle']['show'] not in ('time', 'date', 'blank'):
-                        self._logger.warning("Specified idle value for display {} ('{}') not valid. Defaulting to "
-                                             "blank.".format(i, self._config['displays'][i]['idle']['show']))
-                        self._config['displays'][i]['idle']['show'] = 'blank'
-                        self._config['displays'][i]['idle']['brightness'] = 1
-
-                    # Convert the brightness setting to a float.
-                    try:
-                        self._config['displays'][i]['idle']['brightness'] = (
-                            float(self._config['displays'][i]['idle']['brightness']))
-                    except KeyError:
-                        self._config['displays'][i]['idle']['brightness'] = 1
-                    except ValueError:
-                        self._config['displays'][i]['idle']['brightness'] = 1
-            i += 1
-
-        # Delete any invalidated displays
-        self._logger.debug("Displays to delete: {}".format(to_delete))
-        for d in sorted(to_delete, reverse=True):
-            self._logger.debug("Deleting display '{}'".format(d))
-            del self._config['displays'][d]
-
-    # Validate the scripts.
-    def _validate_scripts(self):
-        if not isinstance(self._config['scripts'], dict):
-            self._logger.critical('Scripts not correctly defined. Must be a dictionary.')
-            return
-        # Can we scan the scripts directory?
-        # If we're not on linux, absolutely not! CircuitPython doesn't support Pathlib and scanning.
-
-        if sys.implementation.name != 'cpython':
-            self._logger.warning("Cannot scan scripts directory. Scripts must be individually enumerated.")
-            self._config['scripts']['scan_dir'] = False
-        else:
-            try:
-                # Scan_dir setting, use that, convert it to a proper bool.
-                if self._config['scripts']['scan_dir'].lower() == 'true':
-                    self._config['scripts']['scan_dir'] = True
-                else:
-                    self._config['scripts']['scan_dir'] = False
-            except KeyError:
-                self._logger.warning("Config: scripts/scan_dir setting not found. Defaulting based on platform.")
-                if sys.implementation.name == 'cpython':
-                    # Scan_dir not included, default it to True since we're on linux.
-                    self._config['scripts']['scan_dir'] = True
-                    self._logger.warning("Config: cpython, this is likely linux/posix, enabling.")
-                else:
-                    self._logger.warning("Config: circuitpython, disabling, not supported.")
-                    self._config['scripts']['scan_dir'] = False
-
-        # If files isn't explicitly defined, make it an empty list.
-        if 'files' not in self._config['scripts']:
-            self._config['scripts']['files'] = []
+    @property
+    def errors(self):
+        """
+        Problems found while validating the config. Each is a message naming where in the config it was found.
+        :return: list
+        """
+        return self._errors
 
     # Get the complete network config.
     @property
@@ -1,14 +1,17 @@
 # Brickmaster2 Controls
 import adafruit_logging
-import board
-import digitalio
+# board and digitalio are imported where pins get set up. On Linux they bring in Blinka's board detection, which isn't
+# needed just to use the control classes, ie: the network's null indicators.
 import sys
+import time
+import brickmaster2.log
+from .i2c import BM2I2CBus, PRIORITY_CONTROL
 
 
 class Control:
     def __init__(self, id, name, icon="mdi:toy-brick", publish_time=15, log_level=adafruit_logging.WARNING):
         # Create a logger.
-        self._logger = adafruit_logging.getLogger('BrickMaster2')
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
         self._logger.setLevel(log_level)
         # Set the ID.
         self._control_id = id
@@ -18,6 +21,10 @@ class Control:
         self._status = None
         self._icon = icon
         self._publish_time = publish_time
+        # Shared output port the control writes through, if any. See AW9523Port.
+        self._port = None
+        # Set to add ourselves to when our state changes, if something is tracking changes.
+        self._dirty_set = None
         # Create topics for the control. This must be implemented per subclass.
 
     # This method creates a list of topics to subscribe to for this control.
@@ -45,10 +52,49 @@ class Control:
     def id(self):
         return self._control_id
 
+    @property
+    def publish_time(self):
+        """
+        How often, in seconds, the control's state should be republished even if it hasn't changed.
+        """
+        return self._publish_time
+
+    def track_changes(self, dirty_set):
+        """
+        Have the control add itself to a set whenever its state changes. The network layer drains the set to publish
+        only what changed.
+
+        :param dirty_set: Set to add to, or None to stop tracking.
+        :type dirty_set: set
+        :return: None
+        """
+        self._dirty_set = dirty_set
+
+    def _changed(self, status):
+        # Record a new state, and flag the change if it is one.
+        if status != self._status:
+            self._status = status
+            if self._dirty_set is not None:
+                self._dirty_set.add(self)
+
+    @property
+    def port(self):
+        """
+        Shared output port the control writes through, if any. Controls on the same port can be batched with a
+        ControlBatch.
+        """
+        return self._port
+
     # Callback the network will access to get messages to this control.
     def callback(self, client, topic, message):
         raise NotImplemented("Control callbacks must be implemented in a control subclass.")
 
+    def deinit(self):
+        """
+        Release any hardware the control holds, so it can be reused. Nothing to do by default.
+        """
+        pass
+
 
 # Control class for GPIO
 class CtrlGPIO(Control):
@@ -70,6 +116,8 @@ class CtrlGPIO(Control):
 
     # Method to set up an onboard GPIO pin.
     def _setup_pin_onboard(self, pin):
+        import board
+        import digitalio
         # Have the import. Now create the pin.
         try:
             self._pin = digitalio.DigitalInOut(getattr(board, str(pin)))
@@ -85,10 +133,22 @@ class CtrlGPIO(Control):
         # Set the pin to an output
         self._pin.direction = digitalio.Direction.OUTPUT
 
+    def deinit(self):
+        """
+        Release the pin. Onboard pins are freed for reuse. Expander pins don't hold anything.
+        """
+        import digitalio
+        if isinstance(self._pin, digitalio.DigitalInOut):
+            self._pin.deinit()
+
     # Method to set up GPIO via an AW9523 on I2C.
     def _setup_pin_aw9523(self, awboard, pin):
+        import digitalio
         try:
             self._pin = awboard.get_pin(pin)
+            # If the board is a shadowed port, remember it so our writes can be batched.
+            if isinstance(awboard, AW9523Port):
+                self._port = awboard
         except AssertionError as ae:
             self._logger.critical("Control: Control '{}' asserted pin '{}', not valid.".format(self.name, pin))
             raise ae
@@ -96,22 +156,23 @@ class CtrlGPIO(Control):
         self._pin.direction = digitalio.Direction.OUTPUT
 
     def set(self, value):
-        self._logger.info("Control: Setting control '{}' to '{}'".format(self.name, value))
+        self._logger.info("Control: Setting control '{}' to '{}'", self._control_name, value)
         if value.lower() == 'on':
             if self._invert:
                 self._logger.debug("Control: Control is inverted, 'On' state sets low.")
                 self._pin.value = False
             else:
                 self._pin.value = True
+            self._changed('ON')
         elif value.lower() == 'off':
             if self._invert:
                 self._logger.debug("Control: Control is inverted, 'Off' state sets high.")
                 self._pin.value = True
             else:
                 self._pin.value = False
+            self._changed('OFF')
         else:
-            self._logger.warning(f"Control: ID '{self.name}' received unknown set value '{value}'")
-            print(f"Control: ID '{self.name}' received unknown set value '{value}'")
+            self._logger.warning("Control: ID '{}' received unknown set value '{}'", self._control_name, value)
 
     @property
     def icon(self):
@@ -141,7 +202,6 @@ class CtrlGPIO(Control):
         :param message: Message.
         :return: None
         """
-        print("Control: Incoming message is '{}' ({})".format(message, type(message)))
         if isinstance(message, str):
             # MiniMQTT (Circuitpython) outputs a straight string.
             message_text = message.lower()
@@ -149,13 +209,13 @@ class CtrlGPIO(Control):
             # Paho MQTT (linux) delivers a message object from which we need to extract the payload.
             # Convert the message payload (which is binary) to a string.
             message_text = str(message.payload, 'utf-8').lower()
-        self._logger.debug("Control: Control '{}' ({}) received message '{}'".format(self.name, self.id,
-                                                                                     message_text))
+        self._logger.debug("Control: Control '{}' ({}) received message '{}'", self._control_name, self._control_id,
+                           message_text)
         valid_values = ['on', 'off']
         # If it's not a valid option, just ignore it.
         if message_text not in valid_values:
-            self._logger.info("Control: Control '{}' ({}) received invalid command '{}'. Ignoring.".
-                              format(self.name, self.id, message_text))
+            self._logger.info("Control: Control '{}' ({}) received invalid command '{}'. Ignoring.",
+                              self._control_name, self._control_id, message_text)
         else:
             self.set(message_text)
 
@@ -167,7 +227,7 @@ class CtrlNull(Control):
         super().__init__(id, name)
 
     def set(self, value):
-        self._logger.debug(f"Null control set to '{value}'")
+        self._logger.debug("Null control set to '{}'", value)
 
     def icon(self):
         return self._icon
@@ -180,3 +240,197 @@ class CtrlNull(Control):
         Callback does nothing.
         """
         pass
+
+
+class AW9523Port:
+    """
+    Shadowed output port for an AW9523 expander. Pin writes update a shadow of the 16-bit output register, which is then
+    written to the board in a single transaction. While the port is held, writes accumulate and go out together when
+    it's released. Writes go through the bus manager's queue ahead of display frames, so whoever sets a control doesn't
+    wait on the bus.
+    """
+    def __init__(self, awboard, address, bus=None):
+        """
+        :param awboard: AW9523 driver object.
+        :type awboard: adafruit_aw9523.AW9523
+        :param address: I2C address of the board.
+        :type address: int
+        :param bus: Bus manager to queue writes with. If not a BM2I2CBus, writes are made directly.
+        :type bus: brickmaster2.i2c.BM2I2CBus
+        """
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
+        self._board = awboard
+        self._address = address
+        self._bus = bus if isinstance(bus, BM2I2CBus) else None
+        # Start the shadow from what the board actually has.
+        self._outputs = self._board.outputs
+        self._dirty = False
+        # Is a write queued? A queued write sends whatever the shadow holds when it runs, so one is enough.
+        self._queued = False
+        self._hold_depth = 0
+        # Write tracking.
+        self._writes = 0
+        self._bus_time = 0
+        self._last_write_time = 0
+
+    @property
+    def address(self):
+        return self._address
+
+    @property
+    def board(self):
+        """ The underlying AW9523 driver object. """
+        return self._board
+
+    @property
+    def outputs(self):
+        """ Shadowed output register. """
+        return self._outputs
+
+    @property
+    def writes(self):
+        """ Number of port writes sent. """
+        return self._writes
+
+    @property
+    def bus_time(self):
+        """ Total time spent writing the port, in seconds. """
+        return self._bus_time
+
+    @property
+    def last_write_time(self):
+        """ Duration of the most recent port write, in seconds. """
+        return self._last_write_time
+
+    def get_pin(self, pin):
+        """
+        Get a pin on the port. Works like the driver's get_pin(), but values are written through the shadow register.
+
+        :param pin: Pin number, 0-15
+        :type pin: int
+        :return: AW9523ShadowPin
+        """
+        import digitalio
+        # Have the driver validate the pin. Setting the direction here is a one-time write at setup.
+        self._board.get_pin(pin).direction = digitalio.Direction.OUTPUT
+        return AW9523ShadowPin(self, pin)
+
+    def get_bit(self, pin):
+        return (self._outputs >> pin) & 1 == 1
+
+    def set_bit(self, pin, value):
+        if value:
+            new_outputs = self._outputs | (1 << pin)
+        else:
+            new_outputs = self._outputs & ~(1 << pin)
+        if new_outputs == self._outputs:
+            return
+        self._outputs = new_outputs
+        self._dirty = True
+        if self._hold_depth == 0:
+            self.flush()
+
+    def hold(self):
+        """
+        Hold writes until release() is called. Holds nest.
+        """
+        self._hold_depth += 1
+
+    def release(self):
+        """
+        Release a hold. When the last hold is released, any changed outputs are written.
+        """
+        if self._hold_depth > 0:
+            self._hold_depth -= 1
+        if self._hold_depth == 0 and self._dirty:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the shadow register to the board. Both output ports go in one transaction.
+        """
+        self._dirty = False
+        if self._bus is None:
+            self._write()
+        elif not self._queued:
+            self._queued = True
+            self._bus.submit(self._address, self._write, priority=PRIORITY_CONTROL)
+
+    def _write(self):
+        # Clear the queued flag before reading the shadow. A change made after this gets its own write.
+        self._queued = False
+        start = time.monotonic()
+        self._board.outputs = self._outputs
+        self._last_write_time = time.monotonic() - start
+        self._bus_time += self._last_write_time
+        self._writes += 1
+
+
+class AW9523ShadowPin:
+    """
+    Pin on an AW9523Port. Stands in for the driver's DigitalInOut.
+    """
+    def __init__(self, port, pin):
+        self._port = port
+        self._pin = pin
+
+    @property
+    def direction(self):
+        import digitalio
+        return digitalio.Direction.OUTPUT
+
+    @direction.setter
+    def direction(self, value):
+        import digitalio
+        # Shadowed pins are always outputs, set up by the port.
+        if value != digitalio.Direction.OUTPUT:
+            raise ValueError("AW9523 shadowed pins only support output.")
+
+    @property
+    def value(self):
+        return self._port.get_bit(self._pin)
+
+    @value.setter
+    def value(self, value):
+        self._port.set_bit(self._pin, value)
+
+
+class ControlBatch:
+    """
+    Batch writes to a group of controls. Shared ports used by the controls are held on entry and released on exit, so
+    each port gets written once no matter how many of its controls were set. Create once and reuse.
+
+    with batch:
+        control_a.set('on')
+        control_b.set('off')
+    """
+    def __init__(self, controls):
+        """
+        :param controls: Controls that may be set within the batch.
+        :type controls: list
+        """
+        self._ports = []
+        for control in controls:
+            port = control.port
+            if port is not None and port not in self._ports:
+                self._ports.append(port)
+        self._last_flush_time = 0
+
+    @property
+    def last_flush_time(self):
+        """
+        Time taken to release the ports at the end of the most recent batch, in seconds. With a bus worker, this is the
+        time to queue the writes rather than to send them.
+        """
+        return self._last_flush_time
+
+    def __enter__(self):
+        for port in self._ports:
+            port.hold()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        start = time.monotonic()
+        for port in self._ports:
+            port.release()
+        self._last_flush_time = time.monotonic() - start
@@ -1,22 +1,113 @@
 # BrickMaster2 Core
 
 import adafruit_logging as logging
-import board
-import busio
-import digitalio
 import gc
 import io
 import json
 import os
 import sys
+import time
 import brickmaster2
+# Only what every setup needs is imported up front. Displays, scripts and the network are imported when they're set up.
+import brickmaster2.config
+import brickmaster2.controls
+import brickmaster2.i2c
+import brickmaster2.log
+import brickmaster2.perf
+
+
+class BM2Scheduler:
+    """
+    Deadline tracker for the core run loop. Each subsystem reports when it next needs attention, and the loop sleeps
+    until the earliest of those instead of spinning.
+    """
+    def __init__(self, max_sleep=0.25, report_interval=60):
+        """
+        :param max_sleep: Longest the loop will ever sleep, in seconds. Bounds the latency for anything that can change
+        without telling us, such as commands arriving on another thread.
+        :type max_sleep: float
+        :param report_interval: How often, in seconds, to recalculate the duty cycle.
+        :type report_interval: int
+        """
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
+        self._max_sleep = max_sleep
+        self._report_interval = report_interval
+        self._deadlines = {}
+        # Duty cycle tracking.
+        self._busy_time = 0
+        self._window_start = time.monotonic()
+        self._duty_cycle = None
+
+    @property
+    def deadlines(self):
+        """
+        Currently known deadlines, by subsystem.
+
+        :return: dict
+        """
+        return self._deadlines
+
+    @property
+    def duty_cycle(self):
+        """
+        Fraction of time the run loop spent working, rather than sleeping, over the previous report interval.
+        Will be None until the first interval has completed.
+
+        :return: float
+        """
+        return self._duty_cycle
+
+    def set_deadline(self, subsystem, deadline):
+        """
+        Set when a subsystem next needs service.
+
+        :param subsystem: Name of the subsystem.
+        :type subsystem: str
+        :param deadline: Monotonic time of the next deadline, or None if the subsystem has nothing pending.
+        :type deadline: float
+        :return: None
+        """
+        self._deadlines[subsystem] = deadline
+
+    def next_deadline(self):
+        """
+        The earliest deadline of all subsystems, bounded by the maximum sleep time.
+
+        :return: float
+        """
+        next_deadline = time.monotonic() + self._max_sleep
+        for subsystem in self._deadlines:
+            if self._deadlines[subsystem] is not None and self._deadlines[subsystem] < next_deadline:
+                next_deadline = self._deadlines[subsystem]
+        return next_deadline
+
+    def sleep(self, busy_time):
+        """
+        Account for the work just done, then sleep until the next deadline.
+
+        :param busy_time: How long the loop spent working on this pass, in seconds.
+        :type busy_time: float
+        :return: None
+        """
+        self._busy_time += busy_time
+        sleep_time = self.next_deadline() - time.monotonic()
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+        # Update the duty cycle if the window has closed.
+        window = time.monotonic() - self._window_start
+        if window >= self._report_interval:
+            self._duty_cycle = self._busy_time / window
+            self._logger.debug("Core: Run loop duty cycle {}% over previous {}s".format(
+                round(self._duty_cycle * 100, 2), round(window)))
+            self._busy_time = 0
+            self._window_start = time.monotonic()
 
 
 class BrickMaster2:
     """
     Core BrickMaster2 class. Create one of these, then run it.
     """
-    def __init__(self, config_json, mac_id, wifi_obj=None, sysrun=None):
+    def __init__(self, config_json, mac_id, wifi_obj=None, sysrun=None, config_loader=None):
         """
         BrickMaster2 Core Module
 
@@ -26,9 +117,14 @@ class BrickMaster2:
         :type mac_id: str
         :param wifi_obj: Wifi Object. ONLY used for CircuitPython
         :type wifi_obj: brickmaster2.network.BM2WiFi
+        :param config_loader: Callable that re-reads the config and returns it. Needed to reload the config on SIGHUP.
+        :type config_loader: callable
         """
         # Force a garbage collection
         gc.collect()
+        # Time spent in each startup phase, as (phase, seconds) in the order they ran.
+        self._startup_profile = []
+        phase_start = time.monotonic()
 
         # Initialize variables.
         self._controls = {} # Controls
@@ -39,11 +135,34 @@ class BrickMaster2:
             self._indicators['sysrun'] = brickmaster2.controls.CtrlNull('sysrun', 'System Status Null')
 
         self._scripts = {} # Scripts
+        # Script file paths and the name of the script loaded from each, the compiled script cache and the script
+        # directory watcher. The cache and watcher are Linux only.
+        self._script_files = {}
+        self._script_cache = None
+        self._script_watcher = None
+        # Script files with changes waiting to be picked up.
+        self._script_changes = set()
+        self._script_removals = set()
+        # Config reloading. When there's a loader, the configs everything was created from are kept to diff against.
+        self._config_loader = config_loader
+        self._reload_requested = False
+        self._reload_deferred = False
+        self._control_configs = {}
+        self._display_configs = {}
+        self._scripts_config = None
         self._extgpio = {} # GPIO Expanders (ie: AW9523 boards)
         self._active_script = None
         # Lists for displays that show the time or date.
         self._clocks = []
         self._dates = []
+        # Scheduler for the run loop.
+        self._scheduler = BM2Scheduler()
+        # Wake events for asyncio tasks. Only populated when running under asyncio.
+        self._aio_events = {}
+        # Run loop latency instrumentation.
+        self._perf = brickmaster2.perf.BM2Perf()
+        # Buffered console output. Set up when the run loop starts, so startup output goes straight out.
+        self._console = None
 
         # Save the MAC/system id
         self._mac_id = mac_id
@@ -59,17 +178,23 @@ class BrickMaster2:
 
         # The Adafruit logger doesn't support child loggers. This is a small
         # enough package, everything goes through the same logger.
-        self._logger = logging.getLogger('BrickMaster2')
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
         # Start out at the DEBUG level. The Config module will load the log level
         # From the config file and adjust appropriately.
         self._logger.setLevel(logging.DEBUG)
 
         # Validate the config and process it.
-        self._bm2config = brickmaster2.BM2Config(config_json)
+        try:
+            self._bm2config = brickmaster2.config.BM2Config(config_json)
+        except ValueError as e:
+            # The individual problems have already been logged.
+            self._logger.critical("Core: Configuration is not valid, cannot continue! {}".format(e))
+            sys.exit(1)
 
         # Reset the log level based on the config.
         self._logger.debug("Core: Setting logging level to '{}'".format(self._bm2config.system['log_level']))
         self._logger.setLevel(self._bm2config.system['log_level'])
+        phase_start = self._end_phase('config', phase_start)
 
         # Set up the status indicator, if available.
         self._logger.debug("Core: System config is: {}".format(self._bm2config.system))
@@ -100,9 +225,11 @@ class BrickMaster2:
         # Set the system indicator on.
         # This should have been done earlier, but in case it wasn't, we do it again here.
         self._indicators['sysrun'].set('on')
+        phase_start = self._end_phase('indicators', phase_start)
 
         # Set up the I2C Bus.
         self._setup_i2c_bus()
+        phase_start = self._end_phase('i2c', phase_start)
 
         gc.collect()
 
@@ -110,12 +237,15 @@ class BrickMaster2:
         publish_time = self._bm2config.system['publish_time']
         self._create_controls(publish_time=publish_time)
         self._bm2config.del_controls()
+        phase_start = self._end_phase('controls', phase_start)
         # Create the displays.
         self._create_displays()
         self._bm2config.del_displays()
+        phase_start = self._end_phase('displays', phase_start)
         # Create the scripts
         self._create_scripts()
         self._bm2config.del_scripts()
+        phase_start = self._end_phase('scripts', phase_start)
 
         # Set up the network.
         self._logger.debug("Setting up network with config options: {}".format(self._bm2config.system))
@@ -131,6 +261,7 @@ class BrickMaster2:
                                             mqtt_username=self._bm2config.system['mqtt']['user'],
                                             mqtt_password=self._bm2config.system['mqtt']['key'],
                                             mqtt_log=self._bm2config.system['mqtt']['log'],
+                                            mqtt_queue=self._bm2config.system['mqtt']['queue_bytes'],
                                             neton=self._indicators['neton'],
                                             netoff=self._indicators['netoff'],
                                             ha_discover=self._bm2config.system['ha_discover'],
@@ -149,6 +280,7 @@ class BrickMaster2:
                                             mqtt_username=self._bm2config.system['mqtt']['user'],
                                             mqtt_password=self._bm2config.system['mqtt']['key'],
                                             mqtt_log=self._bm2config.system['mqtt']['log'],
+                                            mqtt_queue=self._bm2config.system['mqtt']['queue_bytes'],
                                             neton=self._indicators['neton'],
                                             netoff=self._indicators['netoff'],
                                             ha_discover=self._bm2config.system['ha_discover'],
@@ -168,6 +300,10 @@ class BrickMaster2:
         self._logger.debug("Core: Registering scripts with network module")
         for script in self._scripts:
             self._network.register_object(self._scripts[script])
+        self._end_phase('network', phase_start)
+        self._logger.info("Core: Startup took {:.1f}ms - {}".format(
+            sum(phase[1] for phase in self._startup_profile) * 1000,
+            ", ".join("{} {:.1f}ms".format(phase[0], phase[1] * 1000) for phase in self._startup_profile)))
 
         gc.collect()
 
@@ -176,23 +312,166 @@ class BrickMaster2:
 
     def run(self):
         self._logger.debug("Core: Entering run loop.")
+        self._start_console()
+        try:
+            self._run_loop()
+        finally:
+            # Get out anything still buffered, ie: the critical message logged before an unhandled exception.
+            self._console.flush()
+
+    def _run_loop(self):
+        perf = self._perf
         while True:
+            loop_start = time.monotonic()
+            loop_mark = perf.now()
             # Poll the network.
+            mark = perf.now()
             self._network.poll()
+            perf.record('network', mark)
+            self._scheduler.set_deadline('network', self._network.next_deadline)
 
             # If there's an active script, do it.
             if self._active_script is not None:
                 # self._logger.debug(f"Core: Script active, executing '{self._active_script}'")
-                self._scripts[self._active_script].execute(implicit_start=True)
+                mark = perf.now()
+                self._scripts[self._active_script].execute(implicit_start=True, displays=False)
+                perf.record('script', mark)
                 # Check to see if the script has gone back to idle.
                 if self._scripts[self._active_script].status == 'OFF':
                     self._active_script = None
+                    self._scheduler.set_deadline('script', None)
+                else:
+                    mark = perf.now()
+                    self._scripts[self._active_script].update_displays()
+                    perf.record('display', mark)
+                    self._scheduler.set_deadline('script', self._scripts[self._active_script].next_event)
+                # Displays belong to the script while it runs.
+                self._scheduler.set_deadline('display', None)
             else:
                 # Otherwise, have the displays do their idle thing.
                 # Push time and date to displays that need it.
                 # self._logger.debug("Core: Showing idle display state.")
+                mark = perf.now()
+                display_deadline = None
                 for display in self._displays:
                     self._displays[display].show_idle()
+                    next_change = self._displays[display].next_idle_change
+                    if next_change is not None and (display_deadline is None or next_change < display_deadline):
+                        display_deadline = next_change
+                perf.record('display', mark)
+                self._scheduler.set_deadline('display', display_deadline)
+            # Pick up any script file changes, or a requested config reload.
+            if self._script_watcher is not None:
+                self._check_scripts()
+            if self._reload_requested:
+                self._check_reload()
+            # Write out some console output. Keep the loop awake while there's more to go.
+            self._console.drain()
+            self._scheduler.set_deadline('console', time.monotonic() if self._console.pending > 0 else None)
+            perf.record('loop', loop_mark)
+
+            # Sleep until something needs to be done.
+            self._scheduler.sleep(time.monotonic() - loop_start)
+            perf.duty_cycle = self._scheduler.duty_cycle
+
+    def run_async(self):
+        """
+        Run under an asyncio event loop rather than the polling loop. Network I/O, scripts and displays each run as a
+        task on the same loop, so all control changes happen on a single thread. Linux only.
+        """
+        import asyncio
+        self._logger.debug("Core: Entering asyncio runtime.")
+        try:
+            asyncio.run(self._run_async())
+        finally:
+            if self._console is not None:
+                self._console.flush()
+
+    async def _run_async(self):
+        import asyncio
+        self._network.attach_loop(asyncio.get_running_loop())
+        self._start_console()
+        self._aio_events = {'script': asyncio.Event(), 'display': asyncio.Event()}
+        await asyncio.gather(self._task_network(), self._task_scripts(), self._task_displays())
+
+    async def _aio_wait(self, task, deadline):
+        """
+        Sleep a task until its deadline, or until it's woken by an event.
+
+        :param task: Name of the task, ie: 'script' or 'display'
+        :type task: str
+        :param deadline: Monotonic time to wake up at. If None, wait only for the event.
+        :type deadline: float
+        :return: None
+        """
+        import asyncio
+        timeout = None
+        if deadline is not None:
+            timeout = max(0, deadline - time.monotonic())
+        try:
+            await asyncio.wait_for(self._aio_events[task].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._aio_events[task].clear()
+
+    def _aio_wake(self):
+        """
+        Wake the script and display tasks after the active script has changed.
+        """
+        for task in self._aio_events:
+            self._aio_events[task].set()
+
+    async def _task_network(self):
+        import asyncio
+        while True:
+            mark = self._perf.now()
+            self._network.poll()
+            self._perf.record('network', mark)
+            if self._script_watcher is not None:
+                self._check_scripts()
+            if self._reload_requested:
+                self._check_reload()
+            self._console.drain()
+            if self._console.pending > 0:
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(max(0, self._network.next_deadline - time.monotonic()))
+
+    async def _task_scripts(self):
+        while True:
+            if self._active_script is None:
+                await self._aio_wait('script', None)
+                continue
+            script = self._scripts[self._active_script]
+            # Displays are handled by their own task.
+            mark = self._perf.now()
+            script.execute(implicit_start=True, displays=False)
+            self._perf.record('script', mark)
+            if script.status == 'OFF':
+                self._active_script = None
+                # Let the displays go idle.
+                self._aio_wake()
+                continue
+            await self._aio_wait('script', script.next_event)
+
+    async def _task_displays(self):
+        while True:
+            mark = self._perf.now()
+            if self._active_script is not None:
+                self._scripts[self._active_script].update_displays()
+                deadline = self._scripts[self._active_script].next_event
+                # Script selected but not yet started by the script task. Check back shortly.
+                if deadline is None:
+                    deadline = time.monotonic() + 0.1
+            else:
+                deadline = None
+                for display in self._displays:
+                    self._displays[display].show_idle()
+                    next_change = self._displays[display].next_idle_change
+                    if next_change is not None and (deadline is None or next_change < deadline):
+                        deadline = next_change
+            self._perf.record('display', mark)
+            await self._aio_wait('display', deadline)
 
     def callback_scr(self, client, topic, message):
         """
@@ -212,6 +491,7 @@ class BrickMaster2:
             self._scripts[self._active_script].set('OFF')
             # Unselect the active script. This publishes 'Inactive' on the next poll.
             self._active_script = None
+            self._aio_wake()
         else:
             # So now we presume this is the full name of a script. Try to string match it.
             for script_id in self._scripts:
@@ -219,6 +499,7 @@ class BrickMaster2:
                     if self._active_script is None:
                         self._logger.debug("Core: Activating script '{}'".format(message_text))
                         self._active_script = script_id
+                        self._aio_wake()
                     else:
                         self._logger.warning("Core: Cannot activate script '{}', script '{}' is already active.".
                                              format(message_text, self._scripts[self._active_script].name))
@@ -226,18 +507,6 @@ class BrickMaster2:
             # If we get here, something has gone wrong.
             self._logger.warning("Core: Could not match script '{}' against configured scripts.".format(message_text))
 
-    def _setup_aw9523(self, addr):
-        # Condition
-        try:
-            import adafruit_aw9523
-        except ImportError:
-            self._logger.critical("Sys: Cannot import modules for GPIO AW9523 control. Exiting!")
-            sys.exit(1)
-        if isinstance(addr, str):
-            addr = int(addr)
-        aw = adafruit_aw9523.AW9523(self._i2c_bus, addr)
-        return aw
-
     # Methods to create our objects. Called during setup, or when we're asked to reload.
     def _create_controls(self, publish_time=15):
         """
@@ -249,30 +518,43 @@ class BrickMaster2:
         # self._logger.debug("Sys: Memory free at start of control creation: {}".format(gc.mem_free()))
         self._logger.debug("Sys: Controls to create - {}".format(self._bm2config.controls))
         for control_cfg in self._bm2config.controls:
-            self._logger.debug("Setting up control '{}' as type '{}'".
-                               format(control_cfg['id'], control_cfg['type']))
-            self._logger.debug("Complete control config: {}".format(control_cfg))
-
-            awboard=None
-            if control_cfg['type'].lower() == 'gpio':
-                # Nothing special to do for on-board GPIO.
-                pass
-            elif control_cfg['type'].lower() == 'aw9523':
-                if control_cfg['addr'] not in self._extgpio.keys():
-                    self._logger.debug("No AW9523 exists at address '{}'. Creating.".format(control_cfg['addr']))
-                    self._extgpio[control_cfg['addr']] = self._setup_aw9523(control_cfg['addr'])
-                else:
-                    self._logger.debug("AW9523 already initialized at address '{}'".format(control_cfg['addr']))
-                awboard=self._extgpio[control_cfg['addr']]
-            try:
-                self._controls[control_cfg['id']] = (
-                    brickmaster2.controls.CtrlGPIO(**control_cfg, publish_time=publish_time, awboard=awboard,
-                                                   log_level=self._bm2config.system['log_level']))
-            except (AssertionError, AttributeError, ValueError):
-                self._logger.warning("Could not create control.")
-            # gc.collect()
-            # self._logger.debug("Memory free after creation of control '{}': {}".format(control_cfg['control_name'],
-            #                                                                            gc.mem_free()))
+            self._create_control(control_cfg, publish_time)
+
+    def _create_control(self, control_cfg, publish_time):
+        """
+        Create a single control.
+
+        :param control_cfg: Control config.
+        :type control_cfg: dict
+        :param publish_time:
+        :return: Control, or None if it couldn't be created.
+        """
+        self._logger.debug("Setting up control '{}' as type '{}'".
+                           format(control_cfg['id'], control_cfg['type']))
+        self._logger.debug("Complete control config: {}".format(control_cfg))
+
+        awboard=None
+        if control_cfg['type'].lower() == 'gpio':
+            # Nothing special to do for on-board GPIO.
+            pass
+        elif control_cfg['type'].lower() == 'aw9523':
+            if control_cfg['addr'] not in self._extgpio.keys():
+                self._logger.debug("No AW9523 exists at address '{}'. Creating.".format(control_cfg['addr']))
+                self._extgpio[control_cfg['addr']] = self._setup_aw9523(control_cfg['addr'])
+            else:
+                self._logger.debug("AW9523 already initialized at address '{}'".format(control_cfg['addr']))
+            awboard=self._extgpio[control_cfg['addr']]
+        try:
+            self._controls[control_cfg['id']] = (
+                brickmaster2.controls.CtrlGPIO(**control_cfg, publish_time=publish_time, awboard=awboard,
+                                               log_level=self._bm2config.system['log_level']))
+        except (AssertionError, AttributeError, ValueError):
+            self._logger.warning("Could not create control.")
+            return None
+        # Keep the config to compare against on reload.
+        if self._config_loader is not None:
+            self._control_configs[control_cfg['id']] = control_cfg
+        return self._controls[control_cfg['id']]
 
     def _create_displays(self):
         if len(self._bm2config.displays) == 0:
@@ -284,17 +566,27 @@ class BrickMaster2:
             return
         # Set up the displays.
         for display_cfg in self._bm2config.displays:
-            self._logger.info(f"Core: Setting up display '{display_cfg['name']}'")
-            self._displays[display_cfg['name']] = brickmaster2.Display(display_cfg, self._i2c_bus, )
-            if display_cfg['idle']['show'] == 'time':
-                self._clocks.append(display_cfg['name'])
-            elif display_cfg['idle']['show'] == 'date':
-                self._dates.append(display_cfg['name'])
+            self._create_display(display_cfg)
+
+    def _create_display(self, display_cfg):
+        import brickmaster2.display
+        self._logger.info(f"Core: Setting up display '{display_cfg['name']}'")
+        self._displays[display_cfg['name']] = brickmaster2.display.Display(display_cfg, self._i2c_bus, )
+        if display_cfg['idle']['show'] == 'time':
+            self._clocks.append(display_cfg['name'])
+        elif display_cfg['idle']['show'] == 'date':
+            self._dates.append(display_cfg['name'])
+        # Keep the config to compare against on reload.
+        if self._config_loader is not None:
+            self._display_configs[display_cfg['name']] = display_cfg
 
     def _create_scripts(self):
+        if self._config_loader is not None:
+            self._scripts_config = dict(self._bm2config.scripts)
         # If we're on Linux and scan files is enable, get a list of all the JSON files.
         self._logger.debug("Scan dir setting: {}".format(self._bm2config.scripts['scan_dir']))
-        if os.uname().sysname.lower() == 'linux' and self._bm2config.scripts['scan_dir']:
+        scan_dir = os.uname().sysname.lower() == 'linux' and self._bm2config.scripts['scan_dir']
+        if scan_dir:
             self._logger.debug("Script directory scan set to: {}".format(self._bm2config.scripts['scan_dir']))
             from pathlib import Path
             script_dir = Path(self._bm2config.scripts['dir'])
@@ -313,46 +605,322 @@ class BrickMaster2:
                 script_list.append(self._bm2config.scripts['dir'] + '/' + file)
         self._logger.debug("Assembled script list: {}".format(script_list))
 
-        # script_dir = Path.cwd() / "scripts"
+        # On Linux, keep compiled scripts in a cache next to the scripts directory.
+        if sys.implementation.name == 'cpython':
+            import brickmaster2.script_cache
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(self._bm2config.scripts['dir'])),
+                                     '.bm2_script_cache')
+            self._script_cache = brickmaster2.script_cache.BM2ScriptCache(cache_dir, self._controls.keys())
+
+        load_start = time.monotonic()
         for script_file in script_list:
             self._logger.info("Setting up script: {}".format(script_file))
-            try:
-                f = io.open(script_file, mode="r", encoding="utf-8")
-                with f as source:
-                    script_data = json.load(source)
-            except FileNotFoundError:
-                self._logger.warning("File '{}' specified but does not exist! Skipping.".format(script_file))
-            except json.decoder.JSONDecodeError:
-                self._logger.warning("Could not decode JSON for script '{}'. Skipping.".format(script_file))
+            script_obj = self._load_script_file(script_file)
+            if script_obj is not None:
+                self._scripts[script_obj.name] = script_obj
+                self._script_files[script_file] = script_obj.name
+
+        load_time = round((time.monotonic() - load_start) * 1000, 3)
+        cache = self._script_cache
+        if cache is None:
+            self._logger.info("Core: Set up {} scripts in {}ms.".format(len(self._scripts), load_time))
+        else:
+            if cache.hit_ratio is None:
+                hit_ratio = 0
             else:
+                hit_ratio = round(cache.hit_ratio * 100, 1)
+            self._logger.info("Core: Set up {} scripts in {}ms. Script cache hit ratio {}% ({} hits, {} misses).".
+                              format(len(self._scripts), load_time, hit_ratio, cache.hits, cache.misses))
 
-                self._logger.debug("Loaded script JSON from file {}.".format(script_file))
-                try:
-                    if script_data['disable'] == 'true':
-                        continue
-                except KeyError:
-                    self._logger.debug("Core: Script '{}' not explicitly disabled. presuming enabled.".
-                                       format(script_data['script']))
+        # When scanning a directory, watch it for scripts being added or changed.
+        if scan_dir:
+            import brickmaster2.script_watch
+            self._script_watcher = brickmaster2.script_watch.BM2ScriptWatcher(str(script_dir))
+
+    def _load_script_file(self, script_file):
+        """
+        Load a script file, from the compiled script cache if possible.
+
+        :param script_file: Path to the script file.
+        :type script_file: str
+        :return: BM2Script, BM2FlightScript, or None if the script is disabled or couldn't be loaded.
+        """
+        cache = self._script_cache
+        try:
+            if cache is None:
+                compiled = None
+                with io.open(script_file, mode="rb") as source_file:
+                    source = source_file.read()
+            else:
+                compiled, source = cache.load(script_file)
+        except OSError:
+            self._logger.warning("File '{}' specified but does not exist! Skipping.".format(script_file))
+            return None
+
+        script_obj = None
+        try:
+            if compiled is None:
+                # Not cached, or changed. Load and compile it.
                 try:
-                    if script_data['type'] == 'flight':
-                        self._logger.debug("Core: Creating flight script object '{}'".format(script_data['script']))
-                        script_obj = brickmaster2.scripts.BM2FlightScript(script_data, self._controls, self._displays)
-                    else:
-                        self._logger.debug("Creating basic script object '{}'".format(script_data['script']))
-                        script_obj = brickmaster2.scripts.BM2Script(script_data, self._controls)
-                except KeyError:
-                    self._logger.debug("Creating basic script object...")
-                    script_obj = brickmaster2.scripts.BM2Script(script_data, self._controls)
-                # Pass the script object the script data along with the controls that exist.
+                    script_data = json.loads(source.decode('utf-8'))
+                except ValueError:
+                    self._logger.warning("Could not decode JSON for script '{}'. Skipping.".format(script_file))
+                    return None
+                self._logger.debug("Loaded script JSON from file {}.".format(script_file))
+                if script_data.get('disable') == 'true':
+                    compiled = {'disable': True}
+                else:
+                    script_obj = self._new_script(script_data)
+                    compiled = script_obj.compiled
+                if cache is not None:
+                    cache.store(script_file, source, compiled)
+            elif 'disable' not in compiled:
+                self._logger.debug("Core: Loaded compiled script '{}' from cache.".format(compiled['id']))
+                script_obj = self._new_script(None, compiled)
+        except (KeyError, ValueError) as e:
+            self._logger.warning("Could not set up script '{}' - {}. Skipping.".format(script_file, repr(e)))
+            return None
+        if script_obj is None:
+            self._logger.debug("Core: Script '{}' disabled.".format(script_file))
+        return script_obj
 
-                self._scripts[script_obj.name] = script_obj
+    def _check_scripts(self):
+        """
+        Pick up changes in the scripts directory. Added or changed files are recompiled and removed files dropped,
+        then the new script set is swapped in at once. The active script is left alone until it finishes.
 
-    def _reload_config(self):
+        :return: None
         """
-        Stud to support config reloading....later?
-        :return:
+        changes = self._script_watcher.changes()
+        # Only act once per watcher interval. Deferred changes get retried then too.
+        if changes is None:
+            return
+        self._script_changes.update(changes[0])
+        self._script_removals.update(changes[1])
+        if len(self._script_changes) == 0 and len(self._script_removals) == 0:
+            return
+
+        scripts = dict(self._scripts)
+        script_files = dict(self._script_files)
+        deferred = False
+        updated = False
+        for script_file in sorted(self._script_removals | self._script_changes):
+            old_name = script_files.get(script_file)
+            if old_name is not None and old_name == self._active_script:
+                # Don't pull the script out from under a running show. Try again once it's done.
+                deferred = True
+                continue
+            self._script_removals.discard(script_file)
+            self._script_changes.discard(script_file)
+            if old_name is not None:
+                updated = True
+                self._logger.info("Core: Removing script '{}' from '{}'.".format(old_name, script_file))
+                self._network.unregister_object(scripts[old_name])
+                del scripts[old_name]
+                del script_files[script_file]
+            if not os.path.exists(script_file):
+                continue
+            self._logger.info("Core: Loading script file '{}'.".format(script_file))
+            script_obj = self._load_script_file(script_file)
+            if script_obj is None:
+                continue
+            if script_obj.name == self._active_script:
+                self._logger.warning("Core: Script '{}' from '{}' has the same name as the active script. Will load it "
+                                     "once the active script finishes.".format(script_obj.name, script_file))
+                self._script_changes.add(script_file)
+                deferred = True
+                continue
+            if script_obj.name in scripts:
+                self._logger.warning("Core: Script '{}' from '{}' replaces the script of the same name.".
+                                     format(script_obj.name, script_file))
+                self._network.unregister_object(scripts[script_obj.name])
+                for other_file in list(script_files):
+                    if script_files[other_file] == script_obj.name:
+                        del script_files[other_file]
+            scripts[script_obj.name] = script_obj
+            script_files[script_file] = script_obj.name
+            self._network.register_object(script_obj)
+            updated = True
+
+        if updated:
+            # Swap in the new set of scripts in one go.
+            self._scripts = scripts
+            self._script_files = script_files
+            self._network.update_script_discovery()
+        if deferred:
+            self._logger.debug("Core: Script changes for the active script deferred until it finishes.")
+
+    def _new_script(self, script_data, compiled=None):
         """
-        self._logger.warning("Reload configuration not currently supported.")
+        Create a script object of the right type, from either the script definition or a compiled script.
+
+        :param script_data: Script definition, as loaded from JSON. Not needed if compiled is given.
+        :type script_data: dict
+        :param compiled: Compiled script.
+        :type compiled: dict
+        :return: BM2Script or BM2FlightScript
+        """
+        import brickmaster2.scripts
+        if compiled is None:
+            script_id = script_data.get('id')
+            script_type = script_data.get('type')
+        else:
+            script_id = compiled['id']
+            script_type = compiled['type']
+        if script_type == 'flight':
+            self._logger.debug("Core: Creating flight script object '{}'".format(script_id))
+            return brickmaster2.scripts.BM2FlightScript(script_data, self._controls, self._displays,
+                                                        compiled=compiled)
+        self._logger.debug("Core: Creating basic script object '{}'".format(script_id))
+        return brickmaster2.scripts.BM2Script(script_data, self._controls, compiled=compiled)
+
+    def _reload_config(self, signalNumber=None, frame=None):
+        """
+        SIGHUP handler. Flags a config reload for the run loop to pick up, so nothing changes from inside the handler.
+
+        :param signalNumber: Signal number
+        :param frame: Frame
+        :return: None
+        """
+        self._reload_requested = True
+
+    def _check_reload(self):
+        """
+        Reload the config if a reload has been requested. Waits for any active script to finish first, since the
+        script holds references to the controls and displays that may be replaced.
+
+        :return: None
+        """
+        if self._active_script is not None:
+            if not self._reload_deferred:
+                self._logger.info("Core: Config reload requested. Will reload once script '{}' finishes.".
+                                  format(self._active_script))
+                self._reload_deferred = True
+            return
+        self._reload_requested = False
+        self._reload_deferred = False
+        self._apply_config_reload()
+
+    def _apply_config_reload(self):
+        """
+        Re-read the config and rebuild only what changed. Controls and displays are compared by ID against the configs
+        they were created from. Anything unchanged, along with the network connection, is left alone.
+
+        :return: None
+        """
+        if self._config_loader is None:
+            self._logger.warning("Core: No config source to reload from. Reload not supported.")
+            return
+        reload_start = time.monotonic()
+        self._logger.info("Core: Reloading configuration.")
+        try:
+            new_config = brickmaster2.config.BM2Config(self._config_loader())
+        except (Exception, SystemExit) as e:
+            # Config validation raises on a config it can't use. That's fine at startup, not for a running system.
+            self._logger.error("Core: Could not load new configuration, keeping current configuration. {}".
+                               format(repr(e)))
+            self._logger.setLevel(self._bm2config.system['log_level'])
+            return
+
+        # System settings are consumed at startup. Only the log level can change live.
+        old_system = self._bm2config.system
+        new_system = new_config.system
+        changed_system = []
+        for key in new_system:
+            if key not in ('log_level', 'log_level_name') and new_system[key] != old_system.get(key):
+                changed_system.append(key)
+        if len(changed_system) > 0:
+            self._logger.warning("Core: System settings {} changed. These need a restart to take effect.".
+                                 format(changed_system))
+            for key in changed_system:
+                new_system[key] = old_system.get(key)
+        self._bm2config = new_config
+        self._logger.setLevel(new_system['log_level'])
+
+        # Controls.
+        new_controls = {}
+        for control_cfg in new_config.controls:
+            new_controls[control_cfg['id']] = control_cfg
+        removed, changed, added = self._diff_configs(self._control_configs, new_controls)
+        for control_id in removed + changed:
+            self._logger.info("Core: Removing control '{}'.".format(control_id))
+            control = self._controls.pop(control_id, None)
+            del self._control_configs[control_id]
+            if control is None:
+                continue
+            control.set('off')
+            control.deinit()
+            self._network.remove_control(control)
+        for control_id in changed + added:
+            self._logger.info("Core: Creating control '{}'.".format(control_id))
+            control = self._create_control(new_controls[control_id], new_system['publish_time'])
+            if control is not None:
+                self._network.add_control(control)
+        controls_changed = len(removed) + len(changed) + len(added)
+
+        # Displays.
+        new_displays = {}
+        for display_cfg in new_config.displays:
+            new_displays[display_cfg['name']] = display_cfg
+        d_removed, d_changed, d_added = self._diff_configs(self._display_configs, new_displays)
+        for display_name in d_removed + d_changed:
+            self._logger.info("Core: Removing display '{}'.".format(display_name))
+            del self._display_configs[display_name]
+            display = self._displays.pop(display_name, None)
+            if display is not None:
+                display.off()
+            for idle_list in (self._clocks, self._dates):
+                if display_name in idle_list:
+                    idle_list.remove(display_name)
+        if len(d_changed) + len(d_added) > 0 and self._i2c_bus is None:
+            self._logger.error("Core: Cannot set up I2C displays without working I2C bus!")
+        else:
+            for display_name in d_changed + d_added:
+                self._create_display(new_displays[display_name])
+        displays_changed = len(d_removed) + len(d_changed) + len(d_added)
+
+        # Scripts reference controls and displays, so rebuild them if either changed, or if the script settings did.
+        # Unchanged scripts come straight out of the compiled script cache.
+        if controls_changed > 0 or displays_changed > 0 or new_config.scripts != self._scripts_config:
+            self._logger.info("Core: Rebuilding scripts.")
+            for script_name in self._scripts:
+                self._network.unregister_object(self._scripts[script_name])
+            self._scripts = {}
+            self._script_files = {}
+            self._script_changes = set()
+            self._script_removals = set()
+            self._script_watcher = None
+            self._create_scripts()
+            for script_name in self._scripts:
+                self._network.register_object(self._scripts[script_name])
+            self._network.update_script_discovery()
+
+        self._bm2config.del_controls()
+        self._bm2config.del_displays()
+        self._bm2config.del_scripts()
+        self._logger.info("Core: Configuration reloaded in {}ms. {} control and {} display changes.".
+                          format(round((time.monotonic() - reload_start) * 1000, 3), controls_changed,
+                                 displays_changed))
+
+    @staticmethod
+    def _diff_configs(old_configs, new_configs):
+        """
+        Compare two sets of configs, keyed by ID.
+
+        :return: tuple of lists of IDs, (removed, changed, added)
+        """
+        removed = []
+        changed = []
+        added = []
+        for item_id in old_configs:
+            if item_id not in new_configs:
+                removed.append(item_id)
+            elif new_configs[item_id] != old_configs[item_id]:
+                changed.append(item_id)
+        for item_id in new_configs:
+            if item_id not in old_configs:
+                added.append(item_id)
+        return removed, changed, added
 
     def _print_or_log(self, level, message):
         try:
@@ -371,12 +939,39 @@ class BrickMaster2:
         if isinstance(addr, str):
             addr = int(addr)
         aw = adafruit_aw9523.AW9523(self._i2c_bus, addr)
-        return aw
+        # Wrap the board in a shadowed port so writes to its pins can be batched.
+        return brickmaster2.controls.AW9523Port(aw, addr, bus=self._i2c_bus)
+
+    def _start_console(self):
+        """
+        Send log output to the buffered console, which the run loop drains.
+        """
+        if self._console is None:
+            self._console = brickmaster2.log.BM2ConsoleHandler()
+            self._logger.addHandler(self._console)
+
+    def _end_phase(self, phase, start):
+        """
+        Record how long a startup phase took.
+
+        :param phase: Name of the phase.
+        :type phase: str
+        :param start: When the phase started, from time.monotonic().
+        :type start: float
+        :return: float, the time now, to start the next phase from.
+        """
+        now = time.monotonic()
+        self._startup_profile.append((phase, now - start))
+        return now
 
     def _setup_i2c_bus(self):
+        self._i2c_bus = None
         if self._bm2config.system['i2c'] is not None:
             try:
-                self._i2c_bus = busio.I2C(board.SCL, board.SDA)
+                import board
+                import busio
+                # All I2C devices go through the bus manager.
+                self._i2c_bus = brickmaster2.i2c.BM2I2CBus(busio.I2C(board.SCL, board.SDA))
             except RuntimeError as e:
                 self._logger.error("Received Runtime Error while setting up I2C")
                 self._logger.error(str(e))
@@ -402,6 +997,42 @@ class BrickMaster2:
         else:
             return self._scripts[self._active_script].name
 
+    @property
+    def startup_profile(self):
+        """
+        Time spent in each startup phase, in the order they ran.
+
+        :return: list of (phase, seconds) tuples
+        """
+        return list(self._startup_profile)
+
+    @property
+    def i2c_bus(self):
+        """
+        The I2C bus manager, if an I2C bus is configured.
+
+        :return: brickmaster2.i2c.BM2I2CBus
+        """
+        return self._i2c_bus
+
+    @property
+    def perf(self):
+        """
+        Run loop latency instrumentation.
+
+        :return: brickmaster2.perf.BM2Perf
+        """
+        return self._perf
+
+    @property
+    def duty_cycle(self):
+        """
+        Fraction of time the run loop is busy rather than sleeping.
+
+        :return: float
+        """
+        return self._scheduler.duty_cycle
+
     # Private Properties
 
 
@@ -451,9 +1082,10 @@ class BrickMaster2:
         self._print_or_log("critical", "Core: Setting controls off....")
         # Turn off all the controls
         try:
-            for control in self._controls:
-                self._print_or_log("info", "Core: \t{}".format(control))
-                self._controls[control].set("off")
+            with brickmaster2.controls.ControlBatch(self._controls.values()):
+                for control in self._controls:
+                    self._print_or_log("info", "Core: \t{}".format(control))
+                    self._controls[control].set("off")
         except AttributeError:
             self._print_or_log("critical", "Core: Controls not defined, nothing to do.")
         # Turn off all the displays
@@ -464,6 +1096,12 @@ class BrickMaster2:
                 self._displays[display].off()
         except AttributeError:
             self._print_or_log("critical", "Core: Displays not defined, nothing to do.")
+        # Make sure queued I2C writes get out before we go.
+        try:
+            if self._i2c_bus is not None:
+                self._i2c_bus.drain()
+        except AttributeError:
+            pass
         # Poll the network one more time to ensure the new control status is sent.
         # try:
         #     self._network.poll()
@@ -481,6 +1119,9 @@ class BrickMaster2:
         except AttributeError:
             pass
         self._print_or_log("critical", "Core: Cleanup complete.")
+        # Write out anything still waiting for the console.
+        if self._console is not None:
+            self._console.flush()
         # Return a signal. We consider some exits clean, others we throw back the signal number that called us.
         if signalNumber in (None, 15):
             sys.exit(0)
@@ -1,13 +1,16 @@
 # BrickMaster2 Display Control
 
-import adafruit_logging as logger
+import brickmaster2.log
 # from .segment_format import number_7s, time_7s
 from adafruit_ht16k33.segments import BigSeg7x4, Seg7x4
 import time
+from .i2c import BM2I2CBus, PRIORITY_DISPLAY
+
+
 class Display:
     def __init__(self, config, i2c_bus):
         # Create a logger
-        self._logger = logger.getLogger('BrickMaster2')
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
         # Save the config.
         self._config = config
 
@@ -16,50 +19,124 @@ class Display:
 
         # Save our name for easy reference.
         self.name = self._config['name']
+        # What's currently on the display. Used to skip writes that wouldn't change anything.
+        self._on_glass = None
+        # When the idle display next needs re-rendering.
+        self._idle_next_render = None
+        # Count of display writes skipped because nothing changed.
+        self._writes_avoided = 0
+        # Shadow of the 16 bytes of HT16K33 display RAM, as last written to the chip. Frames are composed in the
+        # driver's buffer with auto-write off, then only the bytes that differ from the shadow get sent.
+        self._shadow = bytearray(16)
+        self._shadow_valid = False
+        # Transmit buffer. First byte is the RAM address to start writing at.
+        self._txbuf = bytearray(17)
+        # Counters for I2C traffic.
+        self._frames = 0
+        self._transactions = 0
         # Create a display object.
         self._display_obj = self._create_object(disptype=self._config['type'], address=self._config['address'])
         # test it!
         self._test()
 
+    @property
+    def writes_avoided(self):
+        """
+        Number of display writes skipped because the display already showed the requested content.
+        """
+        return self._writes_avoided
+
+    @property
+    def frames(self):
+        """
+        Number of frames flushed to the display, including frames that turned out to need no write.
+        """
+        return self._frames
+
+    @property
+    def transactions(self):
+        """
+        Number of I2C transactions sent to the display.
+        """
+        return self._transactions
+
     def show(self, the_input):
+        if self._on_glass == the_input:
+            self._writes_avoided += 1
+            return
         try:
             self._display_obj.print(the_input)
         except ValueError:
             self._logger.warning("Could not send input to display. Not a valid type.")
+            self._on_glass = None
+        else:
+            self._on_glass = the_input
+        self._flush()
 
-    def show_dt(self, dtelement='time', clkhr=12):
+    def show_dt(self, dtelement='time', clkhr=12, now=None):
+        if now is None:
+            now = time.localtime()
         if dtelement == 'date':
-            self._display_obj.print(self._format_dt(field='date'))
-            # Make sure AM/PM is off, if we're a big segment.
-            if isinstance(self._display_obj, BigSeg7x4):
-                self._display_obj.ampm = False
+            rendered = ('date', self._format_dt(field='date', now=now), False)
         else:
             if clkhr not in (12, 24):
                 # Clock must be either 12 or 24 hours.
                 raise ValueError(
                     "Clock hours must be either '12' or 24'. Instead got {}. Are you on Mars?".format(clkhr))
             # Default is time, so assume any other input wants it to be time.
-            # Print the string.
-            self._display_obj.print(self._format_dt(field='time', clkhr=clkhr))
-            # If we're a big display, we can set an AM/PM indicator.
-            if isinstance(self._display_obj, BigSeg7x4):
-                self._display_obj.ampm = self._format_dt('pm')
+            rendered = ('time', self._format_dt(field='time', clkhr=clkhr, now=now),
+                        self._format_dt(field='pm', now=now))
+        # If that's already on the display, nothing to do.
+        if self._on_glass == rendered:
+            self._writes_avoided += 1
+            return
+        # Print the string.
+        self._display_obj.print(rendered[1])
+        # If we're a big display, we can set an AM/PM indicator. Dates always have it off.
+        if isinstance(self._display_obj, BigSeg7x4):
+            self._display_obj.ampm = rendered[2]
+        self._on_glass = rendered
+        self._flush()
 
     # Method to show whatever the displays idle state is.
     def show_idle(self):
         # Known idle states!
-        if self._config['idle']['show'] == 'time':
-            self.show_dt(dtelement='time')
-            self._display_obj.brightness = self._config['idle']['brightness']
-        elif self._config['idle']['show'] == 'date':
-            self.show_dt(dtelement='date')
-            self._display_obj.brightness = self._config['idle']['brightness']
+        if self._config['idle']['show'] in ('time', 'date'):
+            # Rendered idle content is stored as a tuple, anything else means something else has used the display.
+            showing_idle = isinstance(self._on_glass, tuple) and self._on_glass[0] == self._config['idle']['show']
+            # Only re-render on the minute boundary, unless something else has been put on the display since.
+            if showing_idle and time.monotonic() < self._idle_next_render:
+                self._writes_avoided += 1
+                return
+            now = time.localtime()
+            self._idle_next_render = time.monotonic() + 60 - now.tm_sec
+            if not showing_idle:
+                # Coming back to idle, reset brightness.
+                self._display_obj.brightness = self._config['idle']['brightness']
+                self._transactions += 1
+            self.show_dt(dtelement=self._config['idle']['show'], now=now)
         else:
-            # There's probably a more elegant way to do this that's faster. Look to optimize later.
+            # Blank display only needs to be turned off once.
+            if self._on_glass == 'off':
+                self._writes_avoided += 1
+                return
             self.off()
 
+    # When the idle display next needs to change. Used by the core scheduler.
+    @property
+    def next_idle_change(self):
+        """
+        Monotonic time of the next minute boundary for displays showing time or date. None for blank displays.
+        """
+        if self._config['idle']['show'] in ('time', 'date'):
+            if self._idle_next_render is None:
+                return time.monotonic()
+            return self._idle_next_render
+        return None
+
     # Method to turn the display off. Clears all values and indicators.
     def off(self):
+        self._on_glass = 'off'
         self._display_obj.fill(False)
         if isinstance(self._display_obj, Seg7x4):
             # self._logger.debug("Display: Setting colon off.")
@@ -75,6 +152,8 @@ class Display:
             self._display_obj.colons[0] = False
             # self._logger.debug("Display: Setting second colon off.")
             self._display_obj.colons[1] = False
+        # Send all of that as one frame.
+        self._flush()
 
     def _create_object(self, disptype, address):
         if disptype == 'bigseg7x4':
@@ -84,31 +163,88 @@ class Display:
         else:
             raise ValueError("{} is not a valid display type.".format(disptype))
 
-        # Create the object.
-        display_obj = display_class(i2c=self._i2c_bus, address=address)
+        # Create the object. Auto-write is off, we send frames ourselves with _flush().
+        display_obj = display_class(i2c=self._i2c_bus, address=address, auto_write=False)
         return display_obj
 
+    def _flush(self):
+        """
+        Send the driver's frame buffer to the display. Only the span of bytes that differ from what is already on the
+        chip gets written, in a single transaction.
+        """
+        self._frames += 1
+        # The driver's buffer has the RAM address in byte 0, then the 16 bytes of display RAM.
+        buffer = self._display_obj._buffer
+        if self._shadow_valid:
+            first = 0
+            while first < 16 and buffer[first + 1] == self._shadow[first]:
+                first += 1
+            if first == 16:
+                # Nothing changed.
+                return
+            last = 15
+            while buffer[last + 1] == self._shadow[last]:
+                last -= 1
+        else:
+            first = 0
+            last = 15
+        # Assemble the transaction. HT16K33 auto-increments the RAM address, so we can start mid-buffer.
+        self._txbuf[0] = first
+        i = first
+        while i <= last:
+            self._txbuf[i - first + 1] = buffer[i + 1]
+            self._shadow[i] = buffer[i + 1]
+            i += 1
+        if isinstance(self._i2c_bus, BM2I2CBus):
+            # Hand the write to the bus manager. The transmit buffer gets reused, so send a copy.
+            self._i2c_bus.submit(self._config['address'], self._write_frame, bytes(self._txbuf[:last - first + 2]),
+                                 priority=PRIORITY_DISPLAY)
+        else:
+            self._write_frame(self._txbuf, last - first + 2)
+        self._shadow_valid = True
+        self._transactions += 1
+
+    def _write_frame(self, buffer, end=None):
+        """
+        Write a frame transaction to the display.
+
+        :param buffer: Buffer to write. RAM address, then data.
+        :type buffer: bytes
+        :param end: Write up to this index of the buffer. Whole buffer if None.
+        :type end: int
+        :return: None
+        """
+        # Newer versions of the driver support chained displays and keep a list of devices. We only ever use one.
+        i2c_device = self._display_obj.i2c_device
+        if isinstance(i2c_device, list):
+            i2c_device = i2c_device[0]
+        with i2c_device:
+            i2c_device.write(buffer, end=end)
+
     # Create a formatted string to send to displays from localtime.
     # This is a simple implementation since CircuitPython doesn't support datetime with strftime.
+    # Pass in 'now' from time.localtime() to format several fields from a single time reading.
     @staticmethod
-    def _format_dt(field=None, clkhr=12):
+    def _format_dt(field=None, clkhr=12, now=None):
         if field not in ('date', 'time', 'pm'):
             raise ValueError("{} not a valid formatting field.")
         if clkhr not in (12, 24):
             raise ValueError("Clock can only 12 or 24 hours.")
+        if now is None:
+            now = time.localtime()
 
         # Return date in format "mm.dd"
         if field == 'date':
-            date_val = str(time.localtime().tm_mon).rjust(2, ' ') + "." + str(time.localtime().tm_mday).rjust(2, ' ')
+            date_val = str(now.tm_mon).rjust(2, ' ') + "." + str(now.tm_mday).rjust(2, ' ')
             return date_val
         if field == 'time':
-            hour = time.localtime().tm_hour
+            hour = now.tm_hour
             if clkhr == 12 and hour > 12:
                 hour = hour - 12
-            time_val = str(hour).rjust(2, ' ') + ":" + str(time.localtime().tm_min).rjust(2, '0')
+            time_val = str(hour).rjust(2, ' ') + ":" + str(now.tm_min).rjust(2, '0')
             return time_val
         if field == 'pm':
-            if time.localtime().tm_hour >= 12:
+            if now.tm_hour >= 12:
                 ampm_val = True
             else:
                 ampm_val = False
@@ -133,5 +269,8 @@ class Display:
             else:
                 self._logger.critical("Display has unknown type {}. This should never happen!".
                                       format(type(self._display_obj)))
+            self._flush()
             time.sleep(delay)
         self._display_obj.fill(False)
+        self._flush()
+        self._on_glass = None
@@ -0,0 +1,228 @@
+"""
+BrickMaster2 I2C Bus Manager
+
+All devices on the I2C bus (AW9523 expanders, HT16K33 displays) share one busio.I2C object. The manager stands in for
+that object, so drivers can use it directly, and adds a prioritized queue for writes that don't need to happen
+immediately. Control port writes go ahead of display frames. On Linux a worker thread owns the queue, so neither the
+main loop nor the MQTT thread waits on the bus. CircuitPython has no threads, so submitted writes run immediately.
+"""
+
+import brickmaster2.log
+import sys
+import time
+
+# Transaction priorities. Lower numbers go first.
+PRIORITY_CONTROL = 0
+PRIORITY_DISPLAY = 10
+
+
+class BM2I2CBus:
+    """
+    Manager for a shared I2C bus.
+    """
+    def __init__(self, bus, threaded=None):
+        """
+        :param bus: The underlying I2C bus object.
+        :type bus: busio.I2C
+        :param threaded: Should a worker thread process the queue? Defaults to True on CPython, False otherwise.
+        :type threaded: bool
+        """
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
+        self._bus = bus
+        # Queue of pending transactions. Each entry is [priority, sequence, address, transaction, args, submit time].
+        self._queue = []
+        self._sequence = 0
+        # Per-device latency stats. Address -> [count, total seconds, max seconds]. Bus stats are time spent on the
+        # wire for every access, queue stats are submission to completion for queued transactions.
+        self._latency = {'bus': {}, 'queue': {}}
+
+        if threaded is None:
+            threaded = sys.implementation.name == 'cpython'
+        self._threaded = threaded
+        # Is the worker running a transaction?
+        self._busy = False
+        if self._threaded:
+            import threading
+            # Bus lock, taken by drivers through try_lock(). Separate from the queue lock, so submitting never waits on
+            # the bus.
+            self._lock = threading.Lock()
+            # Queue lock. Also guards the latency stats, which are recorded from both the worker and the main thread.
+            self._queue_lock = threading.Lock()
+            self._pending = threading.Condition(self._queue_lock)
+            self._idle = threading.Condition(self._queue_lock)
+            self._worker = threading.Thread(target=self._work, name='BM2I2C', daemon=True)
+            self._worker.start()
+            self._logger.info("I2C: Started bus worker thread.")
+        else:
+            self._lock = None
+            self._queue_lock = None
+
+    # busio.I2C interface. Drivers lock the bus before any access, which keeps them out while a queued transaction runs.
+    def try_lock(self):
+        if self._lock is not None:
+            if not self._lock.acquire(False):
+                return False
+            if not self._bus.try_lock():
+                self._lock.release()
+                return False
+            return True
+        return self._bus.try_lock()
+
+    def unlock(self):
+        self._bus.unlock()
+        if self._lock is not None:
+            self._lock.release()
+
+    def scan(self):
+        return self._bus.scan()
+
+    def writeto(self, address, buffer, **kwargs):
+        start = time.monotonic()
+        self._bus.writeto(address, buffer, **kwargs)
+        self._record('bus', address, time.monotonic() - start)
+
+    def readfrom_into(self, address, buffer, **kwargs):
+        start = time.monotonic()
+        self._bus.readfrom_into(address, buffer, **kwargs)
+        self._record('bus', address, time.monotonic() - start)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, **kwargs):
+        start = time.monotonic()
+        self._bus.writeto_then_readfrom(address, buffer_out, buffer_in, **kwargs)
+        self._record('bus', address, time.monotonic() - start)
+
+    def deinit(self):
+        self._bus.deinit()
+
+    # Queue interface.
+    @property
+    def queue_depth(self):
+        """
+        Number of transactions waiting to run.
+
+        :return: int
+        """
+        return len(self._queue)
+
+    @property
+    def latency(self):
+        """
+        Transaction latency per device address, in milliseconds. 'bus' is time on the wire for each access, 'queue' is
+        submission to completion for queued transactions, including time spent waiting.
+
+        :return: dict
+        """
+        if self._queue_lock is not None:
+            with self._queue_lock:
+                return self._summarize_latency()
+        return self._summarize_latency()
+
+    def _summarize_latency(self):
+        latency = {'bus': {}, 'queue': {}}
+        for kind in self._latency:
+            for address in self._latency[kind]:
+                stats = self._latency[kind][address]
+                latency[kind][address] = {
+                    'count': stats[0],
+                    'avg': round(stats[1] / stats[0] * 1000, 3),
+                    'max': round(stats[2] * 1000, 3)
+                }
+        return latency
+
+    def submit(self, address, transaction, *args, priority=PRIORITY_DISPLAY):
+        """
+        Queue a transaction. The transaction is a callable that does its own bus access, normally through an
+        I2CDevice, and will be run with the given arguments. Without a worker thread, it's run immediately.
+
+        :param address: Address of the device the transaction is for. Used for latency tracking.
+        :type address: int
+        :param transaction: Callable to run.
+        :param args: Arguments to pass to the callable. Buffers must not be modified after submission.
+        :param priority: Priority. Lower values run first.
+        :type priority: int
+        :return: None
+        """
+        entry = [priority, self._sequence, address, transaction, args, time.monotonic()]
+        if not self._threaded:
+            # Nothing else to run it, so do it now.
+            self._run(entry)
+            return
+        with self._pending:
+            entry[1] = self._sequence
+            self._sequence += 1
+            self._enqueue(entry)
+            self._pending.notify()
+
+    @property
+    def threaded(self):
+        """
+        Is a worker thread processing the queue?
+
+        :return: bool
+        """
+        return self._threaded
+
+    def drain(self, timeout=1):
+        """
+        Wait for the queue to empty. Used before exiting so final writes, ie: turning displays off, get sent.
+
+        :param timeout: Longest to wait, in seconds.
+        :type timeout: float
+        :return: None
+        """
+        if not self._threaded:
+            return
+        with self._idle:
+            deadline = time.monotonic() + timeout
+            while (len(self._queue) > 0 or self._busy) and time.monotonic() < deadline:
+                self._idle.wait(deadline - time.monotonic())
+
+    def _enqueue(self, entry):
+        # Insert in priority order, preserving submission order within a priority. Queues are short, so a linear scan
+        # is fine and avoids needing heapq on CircuitPython.
+        i = len(self._queue)
+        while i > 0 and self._queue[i - 1][0] > entry[0]:
+            i -= 1
+        self._queue.insert(i, entry)
+
+    def _run(self, entry):
+        try:
+            entry[3](*entry[4])
+        except OSError as e:
+            self._logger.error("I2C: Transaction for device {} failed - {}".format(hex(entry[2]), e))
+        self._record('queue', entry[2], time.monotonic() - entry[5])
+
+    def _record(self, kind, address, elapsed):
+        # The queue lock is safe to take here. Nothing holding it ever waits on the bus lock, which callers of this may
+        # hold.
+        if self._queue_lock is not None:
+            with self._queue_lock:
+                self._update_latency(kind, address, elapsed)
+        else:
+            self._update_latency(kind, address, elapsed)
+
+    def _update_latency(self, kind, address, elapsed):
+        try:
+            stats = self._latency[kind][address]
+        except KeyError:
+            self._latency[kind][address] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+    def _work(self):
+        """
+        Worker thread. Takes the highest priority transaction and runs it.
+        """
+        while True:
+            with self._pending:
+                while len(self._queue) == 0:
+                    self._busy = False
+                    self._idle.notify_all()
+                    self._pending.wait()
+                entry = self._queue.pop(0)
+                self._busy = True
+            # Run outside the queue lock. The transaction takes the bus lock itself.
+            self._run(entry)
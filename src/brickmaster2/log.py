@@ -0,0 +1,271 @@
+"""
+BrickMaster2 Logging
+
+Thin facade over adafruit_logging. adafruit_logging formats the message and builds a record before it checks the level,
+so a disabled debug call in a hot path still costs a format and an allocation. Here the level methods are rebound when
+the level changes, and a disabled level is a no-op. Messages take str.format() style arguments, which are only
+formatted when the level is enabled:
+
+    self._logger.debug("Network: Publishing to '{}'", topic)
+
+On CircuitPython, console output goes through a buffered sink. Records are queued and written out a few lines at a
+time by drain(), which the run loop calls when it has time. A serial write blocks while the host isn't reading, so
+nothing is written when no host is connected. On CPython, output is written straight through.
+"""
+
+import adafruit_logging
+import sys
+import time
+
+try:
+    import supervisor
+except ImportError:
+    # Not on CircuitPython.
+    supervisor = None
+
+try:
+    from threading import Lock
+except ImportError:
+    # No threads on CircuitPython, so nothing to lock against.
+    Lock = None
+
+DEBUG = adafruit_logging.DEBUG
+INFO = adafruit_logging.INFO
+WARNING = adafruit_logging.WARNING
+ERROR = adafruit_logging.ERROR
+CRITICAL = adafruit_logging.CRITICAL
+
+# Facades, by logger name. Every module shares the one for its name, so a level set anywhere applies everywhere.
+_loggers = {}
+
+
+def _noop(msg, *args):
+    pass
+
+
+class _NullLock:
+    # Stands in for a lock where there are no threads.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class BM2Logger:
+    """
+    Logger facade. Get one with getLogger() rather than creating it directly.
+    """
+    def __init__(self, name):
+        """
+        :param name: Name of the underlying adafruit_logging logger.
+        :type name: str
+        """
+        self._logger = adafruit_logging.getLogger(name)
+        self.setLevel(self._logger.getEffectiveLevel())
+
+    def setLevel(self, level):
+        """
+        Set the log level, and rebind the level methods so disabled levels do nothing.
+
+        :param level: Lowest level to output.
+        :type level: int
+        :return: None
+        """
+        self._logger.setLevel(level)
+        self._level = level
+        self.debug = self._debug if level <= DEBUG else _noop
+        self.info = self._info if level <= INFO else _noop
+        self.warning = self._warning if level <= WARNING else _noop
+        self.error = self._error if level <= ERROR else _noop
+        self.critical = self._critical if level <= CRITICAL else _noop
+
+    def getEffectiveLevel(self):
+        return self._level
+
+    def isEnabledFor(self, level):
+        """
+        Check a level before building something expensive to log.
+
+        :param level: Level to check.
+        :type level: int
+        :return: bool
+        """
+        return level >= self._level
+
+    def addHandler(self, handler):
+        self._logger.addHandler(handler)
+
+    def removeHandler(self, handler):
+        self._logger.removeHandler(handler)
+
+    def _debug(self, msg, *args):
+        self._logger.debug(msg.format(*args) if args else msg)
+
+    def _info(self, msg, *args):
+        self._logger.info(msg.format(*args) if args else msg)
+
+    def _warning(self, msg, *args):
+        self._logger.warning(msg.format(*args) if args else msg)
+
+    def _error(self, msg, *args):
+        self._logger.error(msg.format(*args) if args else msg)
+
+    def _critical(self, msg, *args):
+        self._logger.critical(msg.format(*args) if args else msg)
+
+    def log(self, level, msg, *args):
+        """
+        Log at a given level. Arguments are %-style, as used by the MQTT client libraries that log through us.
+        """
+        if level >= self._level:
+            self._logger.log(level, msg, *args)
+
+    def exception(self, err):
+        self._logger.exception(err)
+
+
+def getLogger(name='BrickMaster2'):
+    """
+    Get the shared logger facade for a name.
+
+    :param name: Logger name.
+    :type name: str
+    :return: BM2Logger
+    """
+    try:
+        return _loggers[name]
+    except KeyError:
+        _loggers[name] = BM2Logger(name)
+        return _loggers[name]
+
+
+class BM2ConsoleHandler(adafruit_logging.Handler):
+    """
+    Console sink. On CircuitPython, records are formatted into a bounded queue when logged and written out by drain().
+    When the queue is full, the oldest line below WARNING is dropped to make room. Warnings and above are never pushed
+    out by chattier levels, and are only discarded when no console is connected to see them. Records can be logged from
+    the MQTT and I2C threads while the main loop drains, so the queue is locked.
+
+    On CPython stdout doesn't block, so lines are written straight through.
+    """
+    def __init__(self, max_lines=64, stream=None, buffered=None):
+        """
+        :param max_lines: Most lines to hold before dropping lower-level lines.
+        :type max_lines: int
+        :param stream: Stream to write to. Defaults to sys.stdout.
+        :param buffered: Queue lines for drain()? Defaults to False on CPython, True otherwise.
+        :type buffered: bool
+        """
+        super().__init__()
+        # Queued lines, oldest first. Each is [level, line].
+        self._lines = []
+        self._max_lines = max_lines
+        self._dropped = 0
+        self._stream = sys.stdout if stream is None else stream
+        if buffered is None:
+            buffered = sys.implementation.name != 'cpython'
+        self._buffered = buffered
+        self._queue_lock = _NullLock() if Lock is None else Lock()
+
+    @property
+    def pending(self):
+        """ Number of lines waiting to be written. """
+        return len(self._lines)
+
+    @property
+    def dropped(self):
+        """ Number of lines dropped because the queue was full or no console was connected. """
+        return self._dropped
+
+    def clear(self):
+        """
+        Discard everything queued.
+        """
+        with self._queue_lock:
+            self._lines = []
+
+    def format(self, record):
+        return "{:.3f}: {} - {}".format(record.created, record.levelname, record.msg)
+
+    def emit(self, record):
+        line = self.format(record)
+        if not self._buffered:
+            self._stream.write(line + "\n")
+            return
+        with self._queue_lock:
+            if len(self._lines) >= self._max_lines and not self._evict() and record.levelno < WARNING:
+                # Full of warnings and worse. Drop this line rather than one of those.
+                self._dropped += 1
+                return
+            self._lines.append([record.levelno, line])
+
+    def _evict(self):
+        # Drop the oldest line below WARNING. Called with the lock held.
+        i = 0
+        while i < len(self._lines):
+            if self._lines[i][0] < WARNING:
+                del self._lines[i]
+                self._dropped += 1
+                return True
+            i += 1
+        return False
+
+    def drain(self, max_lines=8):
+        """
+        Write out queued lines.
+
+        :param max_lines: Most lines to write in this call.
+        :type max_lines: int
+        :return: None
+        """
+        if len(self._lines) == 0:
+            return
+        if supervisor is not None and not supervisor.runtime.serial_connected:
+            # Nobody is listening, and writing would block until someone does.
+            with self._queue_lock:
+                self._dropped += len(self._lines)
+                self._lines = []
+            return
+        # Take the lines under the lock, but write them outside it, so a slow console doesn't hold up other threads.
+        with self._queue_lock:
+            lines = self._lines[:max_lines]
+            del self._lines[:max_lines]
+        for entry in lines:
+            self._stream.write(entry[1] + "\n")
+
+    def flush(self):
+        """
+        Write out everything queued.
+        """
+        self.drain(len(self._lines))
+
+
+def benchmark(iterations=2000):
+    """
+    Measure the logging overhead of a poll at WARNING and at DEBUG. Each simulated poll makes the log calls of the hot
+    paths: publishing unchanged state for a control, and a control receiving and applying a command. Output goes to a
+    console handler that is cleared rather than drained, so console speed isn't measured.
+
+    :param iterations: Number of polls to time at each level.
+    :type iterations: int
+    :return: dict of microseconds per poll, by level name.
+    """
+    logger = BM2Logger('BrickMaster2.benchmark')
+    handler = BM2ConsoleHandler(buffered=True)
+    logger.addHandler(handler)
+    topic = 'brickmaster2/benchmark/controls/test/state'
+    results = {}
+    for level_name, level in (('warning', WARNING), ('debug', DEBUG)):
+        logger.setLevel(level)
+        start = time.monotonic()
+        for i in range(iterations):
+            logger.debug("Network: Processing message publication on topic '{}'", topic)
+            logger.debug("Network: Message has not changed, will not publish")
+            logger.debug("Control: Control '{}' ({}) received message '{}'", 'Test', 'test', 'on')
+            logger.info("Control: Setting control '{}' to '{}'", 'Test', 'on')
+            logger.debug("Executing control actions for block {} at run time {}", i, 0.5)
+            handler.clear()
+        results[level_name] = (time.monotonic() - start) / iterations * 1000000
+    logger.removeHandler(handler)
+    return results
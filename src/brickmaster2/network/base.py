@@ -6,18 +6,60 @@ BrickMaster2 Network Base Class
 import adafruit_logging
 from json import dumps as json_dumps
 import time
+try:
+    from binascii import crc32
+except ImportError:
+    # Some CircuitPython builds lack crc32. The history then keeps whole payloads.
+    crc32 = None
 # Import only the parts of Brickmaster2 we need, to prevent circular imports.
 from . import mqtt
+import brickmaster2.controls
+import brickmaster2.log
 import brickmaster2.util
 import brickmaster2.version
 
+# Payloads up to this many bytes are kept in the publish history as they are. Longer ones are kept as a CRC32.
+HISTORY_INLINE = 32
+
+
+def encode_payload(message):
+    """
+    Encode a message for publishing. Dicts become JSON. None becomes an empty payload.
+
+    :param message: Message to encode.
+    :type message: str, int, float, dict, None
+    :return: bytes
+    """
+    if isinstance(message, bytes):
+        return message
+    if isinstance(message, dict):
+        return json_dumps(message).encode('utf-8')
+    if message is None:
+        return b''
+    return str(message).encode('utf-8')
+
+
+def payload_digest(payload):
+    """
+    Digest of an encoded payload for the publish history. Short payloads are their own digest.
+
+    :param payload: Encoded payload.
+    :type payload: bytes
+    :return: bytes or int
+    """
+    if len(payload) <= HISTORY_INLINE or crc32 is None:
+        return payload
+    return crc32(payload)
+
+
 class BM2Network:
     """
     BrickMaster2 Networking class for Linux
     """
     def __init__(self, core, system_id, short_name, long_name, broker, mqtt_username, mqtt_password, mqtt_timeout=1,
                  mqtt_log=False, net_interface='wlan0', neton=None, netoff=None, port=1883, ha_discover=True,
-                 ha_base='homeassistant', ha_area=None, ha_meminfo='unified', wifi_obj=None, log_level=None):
+                 ha_base='homeassistant', ha_area=None, ha_meminfo='unified', wifi_obj=None, log_level=None,
+                 poll_interval=0.5, mqtt_queue=4096):
         """
         BrickMaster2 Network Class
 
@@ -55,6 +97,10 @@ class BM2Network:
         :param wifi_obj: Wifi Object for CircuitPython systems.
         :type wifi_obj: brickmaster.network.BM2WiFi
         :param log_level: Level to log at.
+        :param poll_interval: How often, in seconds, the network wants to be polled to publish changes.
+        :type poll_interval: float
+        :param mqtt_queue: Bytes to set aside for messages held while the broker is away or behind.
+        :type mqtt_queue: int
         """
 
         # Save parameters.
@@ -69,6 +115,8 @@ class BM2Network:
         self._mqtt_password = mqtt_password
         self._mqtt_timeout = mqtt_timeout
         self._net_interface = net_interface
+        self._poll_interval = poll_interval
+        self._last_poll = None
         # Dict for all the Home Assistant info.
         self._ha_info = {
             'discover': ha_discover,
@@ -93,7 +141,7 @@ class BM2Network:
             log_level = adafruit_logging.WARNING
 
         # Set up logger. Adafruit Logging doesn't support hierarchical logging.
-        self._logger = adafruit_logging.getLogger('BrickMaster2')
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
         self._logger.setLevel(log_level)
         self._logger.info(f"Network: System Name is '{self._long_name}'")
 
@@ -129,10 +177,31 @@ class BM2Network:
         self._mqtt_connected = False
         self._total_failures = 0
 
+        # Home Assistant discovery payloads, encoded, by topic. Built on first connect, then kept up to date as objects
+        # are added and removed. Payloads waiting to be sent are kept separately. An empty payload clears an entity.
+        self._discovery_cache = None
+        self._discovery_pending = {}
+        # Set when Home Assistant announces it's come online, so the next poll re-sends discovery.
+        self._ha_birth = False
+        # Set when the broker connects, so the next poll sends discovery. The connect callback runs on Paho's thread on
+        # Linux, so it leaves the discovery state to the main loop.
+        self._connected_discovery = False
+
         # List for commands received and to be passed upward.
         self._upward_commands = []
         # History of payloads, to determine if we need to repeat.
         self._topic_history = {}
+        # State topics checked every poll.
+        self._publish_plan = mqtt.BM2PublishPlan()
+        self._publish_plan.add('brickmaster2/' + self._short_name + '/connectivity', lambda: 'online')
+        self._publish_plan.add('brickmaster2/' + self._short_name + '/script/active', lambda: core.active_script)
+        # Controls aren't checked every poll. They add themselves to the dirty set when they change, and the heartbeat
+        # wheel adds each one back every publish time, staggered so they don't all republish at once.
+        self._dirty_controls = set()
+        self._control_topics = {}
+        self._heartbeat = mqtt.BM2HeartbeatWheel(tick=poll_interval)
+        # Messages that couldn't be sent, held until the broker can take them.
+        self._outbound = mqtt.BM2OutboundQueue(budget=mqtt_queue)
 
         # # Generate device info.
         # self._device_info = brickmaster2.network.ha._device_info(
@@ -194,6 +263,8 @@ class BM2Network:
         :return: dict
         """
 
+        self._last_poll = time.monotonic()
+
         # Set up the return dict.
         return_data = {
             'online': True,
@@ -223,6 +294,19 @@ class BM2Network:
                 else:
                     self._logger.debug("Network: MQTT reconnect successful.")
         elif self._mqtt_connected:
+            # Home Assistant has (re)started and needs discovery again.
+            if self._ha_birth:
+                self._ha_birth = False
+                self._connected_discovery = False
+                self._run_ha_discovery()
+            # Do Home Assistant Discovery the first time we connect. Discovery is retained, so after that only Home
+            # Assistant restarts and changes made while disconnected need sending.
+            if self._connected_discovery:
+                self._connected_discovery = False
+                if self._discovery_cache is None:
+                    self._run_ha_discovery()
+                else:
+                    self._send_discovery()
             # Send all the messages outbound.
             # For the first 15s after HA discovery, send everything. This makes sure data arrives after HA has
             # established entities. Otherwise, you wind up with entities with unknown status.
@@ -237,14 +321,23 @@ class BM2Network:
                     force_repeat = False
             else:
                 force_repeat = False
+            # Send anything held while the broker was away.
+            self._flush_outbound()
+            # Publish any state that's changed.
+            self._publish_plan.run(self._publish_state, force_repeat)
+            if force_repeat:
+                self._dirty_controls.update(self._object_register['controls'].values())
+            self._heartbeat.advance(time.monotonic(), self._dirty_controls)
+            self._publish_controls()
             # Collect messages.
-            ## The platform-independent messages. These should always work.
-            outbound_messages = brickmaster2.network.mqtt.messages(self._core, self._object_register, self._short_name,
-                                                                   force_repeat=force_repeat)
+            ## The performance summary, if it's due.
+            outbound_messages = mqtt.perf_messages(self._core, self._short_name, self)
             ## Extend with platform dependent messages.
+            perf_mark = self._core.perf.now()
             outbound_messages.extend(self._mc_platform_messages())
+            self._core.perf.record('platform', perf_mark)
             for message in outbound_messages:
-                self._logger.debug("Network: Publishing MQTT message - {}".format(message))
+                self._logger.debug("Network: Publishing MQTT message - {}", message)
                 self._pub_message(**message)
             # Check for any incoming commands.
             self._mc_loop()
@@ -258,6 +351,21 @@ class BM2Network:
         self._upward_commands = []
         return return_data
 
+    @property
+    def next_deadline(self):
+        """
+        Monotonic time the network next needs to be polled. Publishes go out every poll interval, while a disconnected
+        broker only needs attention when the reconnect interval is up.
+
+        :return: float
+        """
+        if self._last_poll is None:
+            return time.monotonic()
+        next_poll = self._last_poll + self._poll_interval
+        if not self._mqtt_connected and self._reconnect_timestamp is not None:
+            next_poll = max(next_poll, self._reconnect_timestamp + 30)
+        return next_poll
+
     def register_object(self, action_object):
         """
 
@@ -276,14 +384,109 @@ class BM2Network:
             if issubclass(type(action_object), brickmaster2.controls.Control):
                 self._logger.debug("Registering control '{}'".format(action_object.id))
                 self._object_register['controls'][action_object.id] = action_object
-            elif issubclass(type(action_object), brickmaster2.scripts.BM2Script):
+                self._control_topics[action_object.id] = mqtt.control_status_topic(self._short_name, action_object.id)
+                # Publish the initial state, then whenever it changes.
+                action_object.track_changes(self._dirty_controls)
+                self._dirty_controls.add(action_object)
+                self._heartbeat.add(action_object, action_object.publish_time)
+            elif self._is_script(action_object):
                 self._logger.debug("Registering script '{}'".format(action_object.id))
                 self._object_register['scripts'][action_object.id] = action_object
             else:
                 self._logger.error("Cannot determine class of object '{}' (type: {}). Cannot register.".
                                    format(action_object.id, type(action_object)))
 
+    @staticmethod
+    def _is_script(action_object):
+        # Scripts are only imported when there's something to check, so the network doesn't load the script engine.
+        # Anything registered as a script was made by it, so it's already loaded then.
+        import brickmaster2.scripts
+        return issubclass(type(action_object), brickmaster2.scripts.BM2Script)
+
+    def unregister_object(self, action_object):
+        """
+        Remove a previously registered object.
+
+        :param action_object: Object to remove. Control or script
+        :type action_object: BM2Script,  ControlGPIO
+        :return: None
+        """
+        if issubclass(type(action_object), brickmaster2.controls.Control):
+            registry = self._object_register['controls']
+        elif self._is_script(action_object):
+            registry = self._object_register['scripts']
+        else:
+            return
+        if registry.get(action_object.id) is action_object:
+            self._logger.debug("Unregistering object '{}'".format(action_object.id))
+            del registry[action_object.id]
+            if registry is self._object_register['controls']:
+                action_object.track_changes(None)
+                self._dirty_controls.discard(action_object)
+                self._heartbeat.remove(action_object)
+                del self._control_topics[action_object.id]
+
+    def add_control(self, control):
+        """
+        Add a control after startup. If connected, subscribes to its set topic and sends its discovery message.
+
+        :param control: Control to add.
+        :type control: brickmaster2.controls.Control
+        :return: None
+        """
+        self.register_object(control)
+        if self._ha_discover and self._discovery_cache is not None:
+            self._cache_discovery(mqtt.ha_discovery_control(self._short_name, self._system_id, self._device_info(),
+                                                            'brickmaster2/', self._ha_base, control))
+        if not self._mqtt_connected:
+            # Subscriptions and pending discovery get picked up when we connect.
+            return
+        self._subscribe_control(control)
+        self._send_discovery()
+
+    def remove_control(self, control):
+        """
+        Remove a control after startup. If connected, unsubscribes from its set topic and clears its discovery message,
+        which removes the entity from Home Assistant.
+
+        :param control: Control to remove.
+        :type control: brickmaster2.controls.Control
+        :return: None
+        """
+        self.unregister_object(control)
+        if self._ha_discover and self._discovery_cache is not None:
+            self._uncache_discovery(self._ha_base + '/switch/' + 'bm2_' + self._system_id + '/' + control.id + '/config')
+        if not self._mqtt_connected:
+            return
+        self._mc_unsubscribe('brickmaster2/' + self._short_name + '/controls/' + control.id + '/set')
+        self._send_discovery()
+
+    def update_script_discovery(self):
+        """
+        Re-send only the script selector discovery message, after scripts have been added, changed or removed.
+
+        :return: None
+        """
+        if not self._ha_discover or self._discovery_cache is None:
+            # Full discovery will pick up the current scripts when it's built.
+            return
+        self._logger.info("Network: Updating Home Assistant script discovery.")
+        discovery_messages = mqtt.ha_discovery_script(self._short_name, self._system_id, self._device_info(),
+                                                      'brickmaster2/', self._ha_base, self._object_register['scripts'])
+        if len(discovery_messages) == 0:
+            # No scripts left. Clear the selector.
+            self._uncache_discovery(self._ha_base + '/select/' + 'bm2_' + self._system_id + '/script/config')
+        self._cache_discovery(discovery_messages)
+        if self._mqtt_connected:
+            self._send_discovery()
+
     # Private methods
+    def _subscribe_control(self, control):
+        # Subscribe to the control's set topic and connect the callback.
+        topic = 'brickmaster2/' + self._short_name + '/controls/' + control.id + '/set'
+        self._mc_subscribe(topic)
+        self._mc_callback_add(topic, control.callback)
+
     def _connect_mqtt(self):
         """
         Connect to the MQTT broker.
@@ -320,7 +523,7 @@ class BM2Network:
 
     def _run_ha_discovery(self):
         """
-        Do Home Assistant discovery
+        Do Home Assistant discovery. Payloads are built the first time, and re-sent from the cache after that.
 
         :return: None
         """
@@ -329,24 +532,91 @@ class BM2Network:
         # although Paho does. As a general solution, making it a separate method and calling it directly from
         # connect now.
         if self._ha_discover:
+            if self._discovery_cache is None:
+                self._logger.info("Network: Building Home Assistant discovery...")
+                self._discovery_cache = {}
+                self._cache_discovery(mqtt.ha_discovery(
+                    self._short_name, self._system_id, self._device_info(), 'brickmaster2/', self._ha_base,
+                    self._ha_meminfo, self._object_register))
             self._logger.info("Network: Running Home Assistant discovery...")
-            # Create and stash device info for convenience.
-            device_info = mqtt.ha_device_info(self._system_id, self._long_name, self._ha_area, brickmaster2.__version__)
-            discovery_messages = mqtt.ha_discovery(
-                self._short_name, self._system_id, device_info, 'brickmaster2/', self._ha_base,
-                self._ha_meminfo, self._object_register)
-
-            self._logger.debug("Network: Will send discovery messages: {}".format(discovery_messages))
-            for discovery_message in discovery_messages:
-                self._pub_message(**discovery_message, force_repeat=True, retain=True)
+            for topic in self._discovery_cache:
+                self._discovery_pending[topic] = self._discovery_cache[topic]
+            self._send_discovery()
             # Reset the topic history so any newly discovered entities get sent to.
             self._topic_history = {}
+            self._publish_plan.reset()
             # Set the override stamp. This makes sure force repeat is set to send out data after discovery.
             self._ha_info['override'] = True
             self._ha_info['start'] = time.monotonic()
         else:
             self._logger.warning("Network: Home Assistant discovery disabled. Will not run.")
 
+    def _device_info(self):
+        return mqtt.ha_device_info(self._system_id, self._long_name, self._ha_area, brickmaster2.__version__)
+
+    def _cache_discovery(self, discovery_messages):
+        """
+        Encode discovery messages into the cache, and queue them to be sent.
+
+        :param discovery_messages: Discovery messages, as dicts of topic and message.
+        :type discovery_messages: list
+        :return: None
+        """
+        for discovery_message in discovery_messages:
+            payload = encode_payload(discovery_message['message'])
+            self._discovery_cache[discovery_message['topic']] = payload
+            self._discovery_pending[discovery_message['topic']] = payload
+
+    def _uncache_discovery(self, topic):
+        """
+        Drop a discovery topic from the cache, and queue an empty payload to remove the entity.
+
+        :param topic: Discovery topic.
+        :type topic: str
+        :return: None
+        """
+        if self._discovery_cache.pop(topic, None) is not None:
+            self._discovery_pending[topic] = b''
+
+    def _send_discovery(self):
+        """
+        Send any pending discovery payloads. Discovery messages are retained.
+
+        :return: None
+        """
+        if len(self._discovery_pending) == 0:
+            return
+        self._logger.debug("Network: Sending {} discovery messages.", len(self._discovery_pending))
+        pending = self._discovery_pending
+        self._discovery_pending = {}
+        failed = False
+        for topic in pending:
+            # Discovery is kept out of the outbound queue, since the cache already holds it. If a publish fails, put the
+            # rest back to go out on reconnect.
+            if failed or not self._mc_publish(topic, pending[topic], retain=True):
+                failed = True
+                self._discovery_pending[topic] = pending[topic]
+
+    def _ha_status_callback(self, client, topic, message):
+        """
+        Callback for Home Assistant's status topic. Home Assistant announces 'online' when it starts, and needs
+        discovery again.
+
+        :param client: Client instance for the callback.
+        :param topic: Topic the message was received on.
+        :param message: Message.
+        :return: None
+        """
+        if isinstance(message, str):
+            # MiniMQTT (Circuitpython) outputs a straight string.
+            message_text = message.lower()
+        else:
+            # Paho MQTT (linux) delivers a message object.
+            message_text = str(message.payload, 'utf-8').lower()
+        self._logger.info("Network: Home Assistant status is '{}'.", message_text)
+        if message_text == 'online':
+            self._ha_birth = True
+
     def _on_connect(self, userdata, flags, rc, properties=None):
         """
         MQTT Client connection callback.
@@ -361,27 +631,23 @@ class BM2Network:
         self._logger.debug("Network: Setting internal MQTT tracker True in '_on_connect' callback.")
         self._mqtt_connected = True
 
-        #TODO: Add monitoring of the homeassistant/status online/offline status to do logic. What logic? Not sure.
-
         # Subscribe to the script set topic.
         self._mc_subscribe('brickmaster2/' + self._short_name + '/script/set')
         self._mc_callback_add('brickmaster2/' + self._short_name + '/script/set',
                               self._core.callback_scr)
         # Subscribe to the Control topics.
-        for control_id in self._object_register['controls']:
-            # Subscribe to the topic.
-            self._mc_subscribe('brickmaster2/' + self._short_name + '/controls/' +
-                               self._object_register['controls'][control_id].id + '/set')
-            # Connect the callback.
-            self._mc_callback_add(
-                'brickmaster2/' + self._short_name + '/controls/' +
-                self._object_register['controls'][control_id].id + '/set',
-                self._object_register['controls'][control_id].callback)
+        # Take a copy, since controls can be registered from the main thread while this runs on Paho's.
+        for control in list(self._object_register['controls'].values()):
+            self._subscribe_control(control)
 
         # Send the online message.
         self._send_online()
-        # Do Home Assistant Discovery.
-        self._run_ha_discovery()
+        if self._ha_discover:
+            # Watch for Home Assistant starting up, which needs discovery re-sent.
+            self._mc_subscribe(self._ha_base + '/status')
+            self._mc_callback_add(self._ha_base + '/status', self._ha_status_callback)
+        # Have the next poll handle discovery.
+        self._connected_discovery = True
 
 
     def _on_disconnect(self, client, userdata, rc):
@@ -414,75 +680,126 @@ class BM2Network:
                 message.topic, message.payload
             ))
 
+    def _publish_controls(self):
+        """
+        Publish the status of every control that changed since the last poll. Controls can be set from the MQTT
+        client's thread, so the set is drained with pop() rather than iterated.
+
+        :return: None
+        """
+        dirty = self._dirty_controls
+        while dirty:
+            control = dirty.pop()
+            # Control statuses should be retained. This allows state to be preserved over HA restarts.
+            self._publish_state(self._control_topics[control.id], control.status, True)
+
+    def _publish_state(self, topic, value, retain):
+        """
+        Publish a changed value from the publish plan. The plan has already checked it against the last value sent.
+
+        :param topic: Topic to publish to.
+        :type topic: str
+        :param value: Value to publish.
+        :param retain: Should the message be retained by the broker?
+        :type retain: bool
+        :return: None
+        """
+        self._logger.debug("Network: Publishing '{}' to '{}'", value, topic)
+        self._publish(topic, encode_payload(value), retain)
+
     def _pub_message(self, topic, message, force_repeat=False, retain=False):
         """
         Publish a message to the MQTT broker. By default, will not publish a message if that message has previously been
         sent to that topic. This makes it safe to dump the same data in repeatedly without spamming the broker.
 
+        The message is encoded once. The history keeps a digest of the encoded payload per topic, so checking for a
+        repeat is a single comparison, and the encoded payload is what gets published.
+
         :param topic: Topic to publish to.
         :type topic: str
-        :param message: Message to publish
-        :type message: str
+        :param message: Message to publish. Dicts are sent as JSON.
+        :type message: str, int, float, dict
         :param force_repeat: Should the message be sent even if it was also the previous message sent.
         :type force_repeat: bool
         :param retain: Should the message be retained by the broker?
         :type retain: bool
         :return:
         """
-        self._logger.debug("Network: Processing message publication on topic '{}'".format(topic))
-        # Set the send flag initially. If we've never seen the topic before or if we're set to repeat, go ahead and send.
-        # This skips some extra logic.
-        if topic not in self._topic_history:
-            self._logger.debug("Network: Topic not in history, sending...")
-            send = True
-        elif force_repeat:
-            self._logger.debug("Network: Repeat explicitly enabled, sending...")
-            send = True
-        else:
-            send = False
-
-        # If we're not already sending, then we've seen the topic before and should check for changes.
-        if send is False:
-            previous_message = self._topic_history[topic]
-            # Both strings, compare and send if different
-            if (isinstance(message, str) and isinstance(previous_message, str)) or \
-                    (isinstance(message, (int, float)) and isinstance(previous_message, (int, float))):
-                if message != previous_message:
-                    self._logger.debug("Network: Message '{}' does not match previous message '{}'. Publishing.".
-                                       format(message, previous_message))
-                    send = True
-                else:
-                    self._logger.debug("Network: Message has not changed, will not publish")
-                    return
-            # For dictionaries, compare individual elements. This doesn't handle nested dicts, but those aren't used.
-            elif isinstance(message, dict) and isinstance(previous_message, dict):
-                for item in message:
-                    if item not in previous_message:
-                        self._logger.debug("Network: Message dict contains new key, publishing.")
-                        send = True
-                        break
-                    if message[item] != previous_message[item]:
-                        self._logger.debug("Network: Message dict key '{}' has changed value, publishing.".format(item))
-                        send = True
-                        break
-            # If type has changed, which is odd,  (and it shouldn't, usually), send it.
-            elif type(message) != type(previous_message):
-                self._logger.debug("Network: Message type has changed from '{}' to '{}'. Unusual, but publishing anyway.".
-                                   format(type(previous_message), type(message)))
-                send = True
-
-        # If we're sending do it.
-        if send:
-            self._logger.debug("Network: Publishing message...")
-            # New message becomes the previous message.
-            self._topic_history[topic] = message
-            # Convert the message to JSON if it's a dict, otherwise just send it.
-            if isinstance(message, dict):
-                outbound_message = json_dumps(message)
-            else:
-                outbound_message = message
-            # Make the client-specific call!
-            self._mc_publish(topic, outbound_message, retain=retain)
+        payload = encode_payload(message)
+        digest = payload_digest(payload)
+        if not force_repeat and self._topic_history.get(topic) == digest:
+            self._logger.debug("Network: Message on topic '{}' has not changed, will not publish", topic)
+            return
+        self._logger.debug("Network: Publishing message on topic '{}'", topic)
+        self._topic_history[topic] = digest
+        self._publish(topic, payload, retain)
+
+    def _publish(self, topic, payload, retain):
+        """
+        Publish an encoded payload, or queue it if it can't be sent now. Once anything is queued, later messages queue
+        behind it until the queue is flushed, so messages on a topic can't go out of order.
+
+        :param topic: Topic to publish to.
+        :type topic: str
+        :param payload: Encoded payload.
+        :type payload: bytes
+        :param retain: Should the message be retained by the broker?
+        :type retain: bool
+        :return: None
+        """
+        if len(self._outbound) == 0 and self._publish_now(topic, payload, retain):
+            return
+        self._outbound.put(topic, payload, retain)
+
+    def _publish_now(self, topic, payload, retain):
+        """
+        Hand a message to the client, if the broker is connected and the client isn't backed up.
+
+        :return: bool, True if the client took the message.
+        """
+        if not self._mqtt_connected or not self._mc_ready():
+            return False
+        # Make the client-specific call!
+        return self._mc_publish(topic, payload, retain=retain)
+
+    def _flush_outbound(self):
+        """
+        Send queued messages in bulk. If any were dropped while queued, the current state of everything is sent again
+        on this poll, since the dropped messages may have been the last for their topics.
+
+        :return: None
+        """
+        if len(self._outbound) == 0:
+            return
+        self._outbound.flush(self._publish_now)
+        if len(self._outbound) == 0 and self._outbound.lost:
+            self._logger.info("Network: Messages were dropped from the outbound queue. Resending current state.")
+            self._outbound.lost = False
+            self._topic_history = {}
+            self._publish_plan.reset()
+            self._dirty_controls.update(self._object_register['controls'].values())
+
+    @property
+    def outbound_stats(self):
+        """
+        Outbound queue metrics: depth, bytes held, drops, coalesced messages, and the last flush's time.
+
+        :return: dict
+        """
+        return self._outbound.stats
+
+    @property
+    def topic_history_stats(self):
+        """
+        Size of the publish history. Each topic holds at most HISTORY_INLINE bytes of digest, or a 4-byte CRC.
+
+        :return: dict with the number of topics and the bytes of digest held.
+        """
+        digest_bytes = 0
+        for topic in self._topic_history:
+            digest = self._topic_history[topic]
+            digest_bytes += len(digest) if isinstance(digest, bytes) else 4
+        return {'topics': len(self._topic_history), 'digest_bytes': digest_bytes}
 
     # Method studs to be overridden.
     def _mc_callback_add(self, topic, callback):
@@ -522,10 +839,19 @@ class BM2Network:
         :type qos: int
         :param retain: Should the message be retained by the broker?
         :type retain: bool
-        :return: None
+        :return: bool, True if the client took the message.
         """
         raise NotImplemented("Must be defined in subclass!")
 
+    def _mc_ready(self):
+        """
+        Can the client take more messages? Clients that buffer internally should return False when they're backed up,
+        so messages wait in the bounded outbound queue instead.
+
+        :return: bool
+        """
+        return True
+
     def _mc_loop(self):
         """
         Call the MQTT Client's looping/polling method.
@@ -561,6 +887,16 @@ class BM2Network:
         """
         raise NotImplemented("Must be defined in subclass!")
 
+    def _mc_unsubscribe(self, topic):
+        """
+        Unsubscribe the MQTT client from a given topic and remove its callback.
+
+        :param topic: The topic to unsubscribe from.
+        :type topic: str
+        :return:
+        """
+        raise NotImplemented("Must be defined in subclass!")
+
     def _mc_will_set(self, topic, payload, qos=0, retain=True):
         """
         Set the MQTT client's will.
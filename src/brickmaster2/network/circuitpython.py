@@ -123,7 +123,7 @@ class BM2NetworkCircuitPython(BM2Network):
         :type qos: int
         :param retain: Should the message be retained by the broker?
         :type retain: bool
-        :return: None
+        :return: bool, True if the message was sent.
         """
         try:
             self._mini_client.publish(topic, message, retain, qos)
@@ -140,6 +140,9 @@ class BM2NetworkCircuitPython(BM2Network):
                 self._mqtt_connected = False
             else:
                 raise e
+        else:
+            return True
+        return False
 
     def _mc_subscribe(self, topic):
         """
@@ -151,6 +154,17 @@ class BM2NetworkCircuitPython(BM2Network):
         """
         self._mini_client.subscribe(topic)
 
+    def _mc_unsubscribe(self, topic):
+        """
+        Unsubscribe the MQTT client from a given topic and remove its callback.
+
+        :param topic: The topic to unsubscribe from.
+        :type topic: str
+        :return:
+        """
+        self._mini_client.unsubscribe(topic)
+        self._mini_client.remove_topic_callback(topic)
+
     def _mc_will_set(self, topic, payload, qos=0, retain=True):
         """
         Set the MQTT client's will.
@@ -7,10 +7,38 @@ from brickmaster2.network.base import BM2Network
 import brickmaster2.util
 import brickmaster2.network.mqtt
 import psutil
-from paho.mqtt.client import Client
+from paho.mqtt.client import Client, MQTT_ERR_SUCCESS
+import socket
+import threading
 import time
 
+# Most messages to have waiting in Paho's own queue before holding them back.
+PAHO_WINDOW = 64
+
+
 class BM2NetworkLinux(BM2Network):
+    # Event loop, if running under asyncio. When set, Paho's socket is driven by the loop instead of a background thread.
+    _aio_loop = None
+    _aio_misc = None
+    # Messages handed to Paho and not yet written to the socket. Changed from both our thread and Paho's, so only under
+    # _paho_lock.
+    _paho_outstanding = 0
+
+    def attach_loop(self, loop):
+        """
+        Drive the MQTT client from an asyncio event loop instead of Paho's background thread. All MQTT callbacks will
+        then run on the loop's thread. Must be called before connecting.
+
+        :param loop: The running event loop.
+        :type loop: asyncio.AbstractEventLoop
+        :return: None
+        """
+        self._logger.info("Network: Attaching MQTT client to asyncio event loop.")
+        self._aio_loop = loop
+        self._paho_client.on_socket_open = self._aio_socket_open
+        self._paho_client.on_socket_close = self._aio_socket_close
+        self._paho_client.on_socket_register_write = self._aio_socket_register_write
+        self._paho_client.on_socket_unregister_write = self._aio_socket_unregister_write
 
     def poll(self):
         """
@@ -54,8 +82,9 @@ class BM2NetworkLinux(BM2Network):
             # These are the exceptions can happen. Wrap this as BM2RecoverableError.
             raise brickmaster2.exceptions.BM2RecoverableError from e
         else:
-            # Start the background thread.
-            self._paho_client.loop_start()
+            # Start the background thread, unless the event loop is handling the socket.
+            if self._aio_loop is None:
+                self._paho_client.loop_start()
             return True
 
     def _mc_disconnect(self):
@@ -64,7 +93,8 @@ class BM2NetworkLinux(BM2Network):
         :return:
         """
         # Stop the loop thread.
-        self._paho_client.loop_stop()
+        if self._aio_loop is None:
+            self._paho_client.loop_stop()
         # Disconnect.
         self._paho_client.disconnect()
 
@@ -76,6 +106,37 @@ class BM2NetworkLinux(BM2Network):
         # Looping not required since PAHO is running in a background thread.
         pass
 
+    # Asyncio socket handling. These follow Paho's external event loop interface.
+    def _aio_socket_open(self, client, userdata, sock):
+        self._logger.debug("Network: MQTT socket opened, registering with event loop.")
+        self._aio_loop.add_reader(sock, client.loop_read)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2048)
+        self._aio_misc = self._aio_loop.create_task(self._aio_misc_loop())
+
+    def _aio_socket_close(self, client, userdata, sock):
+        self._logger.debug("Network: MQTT socket closed, removing from event loop.")
+        self._aio_loop.remove_reader(sock)
+        if self._aio_misc is not None:
+            self._aio_misc.cancel()
+            self._aio_misc = None
+
+    def _aio_socket_register_write(self, client, userdata, sock):
+        self._aio_loop.add_writer(sock, client.loop_write)
+
+    def _aio_socket_unregister_write(self, client, userdata, sock):
+        self._aio_loop.remove_writer(sock)
+
+    async def _aio_misc_loop(self):
+        """
+        Periodic client housekeeping, ie: keepalive pings, that the background thread would otherwise do.
+        """
+        import asyncio
+        while self._paho_client.loop_misc() == MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
     def _mc_onmessage(self, callback):
         """
         General-purpose on_message callback.
@@ -117,10 +178,59 @@ class BM2NetworkLinux(BM2Network):
         :type qos: int
         :param retain: Should the message be retained by the broker?
         :type retain: bool
-        :return: None
+        :return: bool, True if Paho took the message.
         """
+        # Count the message before handing it over. Paho may write it, and call back, before publish() returns.
+        # The lock can't be held over the call, since the callback takes it.
+        with self._paho_lock:
+            self._paho_outstanding += 1
+        if self._paho_client.publish(topic, message, qos, retain).rc == MQTT_ERR_SUCCESS:
+            return True
+        # Never queued, so it'll never be reported as published.
+        self._paho_written()
+        return False
+
+    def _mc_ready(self):
+        """
+        Is Paho keeping up? Paho queues without limit, so stop handing it messages once too many are waiting to be
+        written to the socket. They'll wait in the outbound queue instead, where they're coalesced and bounded.
 
-        self._paho_client.publish(topic, message, qos, retain)
+        :return: bool
+        """
+        return self._paho_outstanding < PAHO_WINDOW
+
+    def _paho_on_publish(self, client, userdata, mid, *args):
+        """
+        Paho publish callback. For QoS 0, Paho calls this once the message has been written to the socket.
+        """
+        self._paho_written()
+
+    def _paho_written(self):
+        # One less message outstanding. Never below zero, in case a callback arrives for a message counted before a reset.
+        with self._paho_lock:
+            if self._paho_outstanding > 0:
+                self._paho_outstanding -= 1
+
+    def _paho_reset(self):
+        # Paho throws away anything unwritten when the connection drops, without calling back for it. That includes
+        # reconnects Paho's own loop thread makes, which don't go through _mc_connect, so this is done from the
+        # connection callbacks.
+        with self._paho_lock:
+            self._paho_outstanding = 0
+
+    def _on_connect(self, *args, **kwargs):
+        """
+        MQTT Client connection callback. Nothing is outstanding on a new connection.
+        """
+        self._paho_reset()
+        super()._on_connect(*args, **kwargs)
+
+    def _on_disconnect(self, *args, **kwargs):
+        """
+        MQTT Client disconnect callback. Anything outstanding has been thrown away.
+        """
+        self._paho_reset()
+        super()._on_disconnect(*args, **kwargs)
 
     def _mc_subscribe(self, topic):
         """
@@ -132,6 +242,17 @@ class BM2NetworkLinux(BM2Network):
         """
         self._paho_client.subscribe(topic)
 
+    def _mc_unsubscribe(self, topic):
+        """
+        Unsubscribe the MQTT client from a given topic and remove its callback.
+
+        :param topic: The topic to unsubscribe from.
+        :type topic: str
+        :return:
+        """
+        self._paho_client.unsubscribe(topic)
+        self._paho_client.message_callback_remove(topic)
+
     def _mc_will_set(self, topic, payload, qos=0, retain=True):
         """
         Set the MQTT client's will.
@@ -175,6 +296,8 @@ class BM2NetworkLinux(BM2Network):
         :return:
         """
 
+        self._paho_lock = threading.Lock()
+
         # Create the MQTT Client.
         self._paho_client = Client(
             client_id=self._system_id
@@ -191,4 +314,6 @@ class BM2NetworkLinux(BM2Network):
         # Connect callback.
         self._paho_client.on_connect = self._on_connect
         # Disconnect callback
-        self._paho_client.on_disconnect = self._on_disconnect
\ No newline at end of file
+        self._paho_client.on_disconnect = self._on_disconnect
+        # Publish callback, to track what's still waiting to be written.
+        self._paho_client.on_publish = self._paho_on_publish
\ No newline at end of file
@@ -5,53 +5,386 @@ These methods are meant to work with either the Linux or CircuitPython classes.
 classes to handle the actual publication!
 """
 
-import adafruit_logging
 import json
+import brickmaster2.log
+import brickmaster2.perf
 
-logger = adafruit_logging.getLogger('BrickMaster2')
-logger.setLevel(adafruit_logging.DEBUG)
+logger = brickmaster2.log.getLogger('BrickMaster2')
 
 
-def messages(core, object_register, short_name, force_repeat=False, topic_prefix='brickmaster2'):
+# Marks a plan entry that hasn't been published since the plan was created or reset.
+_UNSENT = object()
+
+
+class BM2PublishPlan:
+    """
+    Table of the state topics published on every poll. Each entry is built once, when its object is registered, and
+    holds the topic, a getter for the current value and the value last published. Walking the plan compares each value
+    to the last one sent, and allocates nothing when nothing has changed.
     """
-    Generate mqtt messages to send out.
+    def __init__(self):
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, topic, getter, retain=False):
+        """
+        Add a topic to the plan, replacing any existing entry for it.
+
+        :param topic: Topic to publish to.
+        :type topic: str
+        :param getter: Function taking no arguments that returns the value to publish.
+        :type getter: function
+        :param retain: Should the message be retained by the broker?
+        :type retain: bool
+        :return: None
+        """
+        self.remove(topic)
+        self._entries.append([topic, getter, retain, _UNSENT])
+
+    def remove(self, topic):
+        """
+        Remove a topic from the plan, if it's there.
+
+        :param topic: Topic to remove.
+        :type topic: str
+        :return: None
+        """
+        for i in range(len(self._entries)):
+            if self._entries[i][0] == topic:
+                del self._entries[i]
+                return
+
+    def reset(self):
+        """
+        Forget what was last published, so every topic is sent on the next run.
+
+        :return: None
+        """
+        for entry in self._entries:
+            entry[3] = _UNSENT
+
+    def run(self, publish, force_repeat=False):
+        """
+        Publish every topic whose value has changed since it was last published.
+
+        :param publish: Function to publish with, taking topic, value and retain.
+        :type publish: function
+        :param force_repeat: Publish every topic, changed or not.
+        :type force_repeat: bool
+        :return: int, number of topics published.
+        """
+        published = 0
+        for entry in self._entries:
+            value = entry[1]()
+            if force_repeat or value != entry[3]:
+                entry[3] = value
+                publish(entry[0], value, entry[2])
+                published += 1
+        return published
+
+
+class BM2HeartbeatWheel:
+    """
+    Timer wheel for periodic republishing. Items are spread across a ring of slots, one slot per tick. Advancing the
+    wheel only looks at the slots whose ticks have passed, so the cost of a poll depends on what's due, not on how many
+    items are scheduled. Intervals longer than the ring go around it more than once.
 
-    :param force_repeat: Should we send messages that haven't changed since previous send?
-    :type force_repeat: bool
-    :return: dict
+    New items are staggered. Each one gets a different starting offset within its interval, and keeps that phase from
+    then on, so many items with the same interval are spread evenly instead of coming due together.
     """
-    outbound_messages = [
-        {'topic': 'brickmaster2/' + short_name + '/connectivity',
-         'message': 'online'}
-    ]
+    def __init__(self, tick=0.5, slots=64):
+        """
+        :param tick: Width of each slot, in seconds.
+        :type tick: float
+        :param slots: Number of slots in the ring.
+        :type slots: int
+        """
+        self._tick = tick
+        self._slots = [[] for i in range(slots)]
+        # Entries by item. Each entry is [item, interval in ticks, slot, remaining trips around the ring].
+        self._entries = {}
+        self._cursor = 0
+        self._cursor_time = None
+        self._added = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, item, interval):
+        """
+        Schedule an item to come due every interval, replacing any existing schedule for it.
+
+        :param item: Item to schedule. Must be hashable.
+        :param interval: Interval, in seconds.
+        :type interval: float
+        :return: None
+        """
+        self.remove(item)
+        ticks = max(1, int(interval / self._tick + 0.5))
+        entry = [item, ticks, 0, 0]
+        self._entries[item] = entry
+        self._place(entry, 1 + self._added % ticks)
+        self._added += 1
+
+    def remove(self, item):
+        """
+        Unschedule an item, if it's scheduled.
+
+        :param item: Item to remove.
+        :return: None
+        """
+        entry = self._entries.pop(item, None)
+        if entry is not None:
+            self._slots[entry[2]].remove(entry)
+
+    def advance(self, now, due):
+        """
+        Move the wheel up to the current time. Items that come due are added to a set and rescheduled.
+
+        :param now: Current monotonic time.
+        :type now: float
+        :param due: Set to add due items to.
+        :type due: set
+        :return: None
+        """
+        if self._cursor_time is None:
+            self._cursor_time = now
+            return
+        # After a long stall, go around the ring at most once.
+        ticks = min(int((now - self._cursor_time) / self._tick), len(self._slots))
+        while ticks > 0:
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            self._cursor_time += self._tick
+            ticks -= 1
+            slot = self._slots[self._cursor]
+            if not slot:
+                continue
+            for entry in list(slot):
+                if entry[3] > 0:
+                    entry[3] -= 1
+                    continue
+                due.add(entry[0])
+                slot.remove(entry)
+                self._place(entry, entry[1])
+        if now - self._cursor_time >= self._tick:
+            # Skipped ticks from a stall. Don't try to catch them up.
+            self._cursor_time = now
+
+    def _place(self, entry, ticks):
+        # Put an entry in the slot the given number of ticks ahead of the cursor.
+        slot_count = len(self._slots)
+        entry[2] = (self._cursor + ticks) % slot_count
+        entry[3] = (ticks - 1) // slot_count
+        self._slots[entry[2]].append(entry)
+
+
+class BM2OutboundQueue:
+    """
+    Store-and-forward queue for messages that couldn't be published, because the broker is away or behind. Only the
+    latest payload for each topic is kept, so a topic that changes many times during an outage holds one entry.
 
-    # Controls
-    for item in object_register['controls']:
-        control_object = object_register['controls'][item]
-        # logger.debug("Generating messages for object '{}' (type: {})".
-        #              format(control_object.id, type(control_object)))
-        # Control statuses should be retained. This allows state to be preserved over HA restarts.
-        outbound_messages.append(
-            {'topic': 'brickmaster2/' + short_name + '/controls/' + control_object.id + '/status',
-             'message': control_object.status, 'force_repeat': force_repeat, 'retain': True}
-        )
-
-    # Displays aren't yet supported. Maybe some day.
-    # for item in object_register['displays']:
-        # display_object = object_register['displays'][item]
-        # logger.debug("Generating messages for object '{}' (type: {})".format(
-        #     display_object.id, type(display_object)))
-        # outbound_messages
-
-    ## Active script.
-    # logger.debug("Generating active script message...")
-    outbound_messages.append({
-        'topic': topic_prefix + '/' + short_name + '/script/active',
-        'message': core.active_script,
-        'force_repeat': force_repeat})
+    The queue has a fixed budget in bytes. When a new message won't fit, the oldest messages are dropped to make room,
+    non-retained ones first since they're only of interest when they're current.
+    """
+    # Bytes charged per entry on top of the topic and payload, for the entry's list and dict slot.
+    ENTRY_OVERHEAD = 16
+
+    def __init__(self, budget=4096):
+        """
+        :param budget: Most bytes to hold, counting topics, payloads and per-entry overhead.
+        :type budget: int
+        """
+        self._budget = budget
+        # Entries by topic. Each entry is [payload, retain, sequence number].
+        self._entries = {}
+        self._sequence = 0
+        self._bytes = 0
+        # Counters for the perf summary.
+        self.drops = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.flush_ms = None
+        # Set when anything is dropped. Cleared by whoever resends current state after a flush.
+        self.lost = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, topic, payload, retain):
+        """
+        Queue a message, replacing anything already queued for its topic.
+
+        :param topic: Topic to publish to.
+        :type topic: str
+        :param payload: Encoded payload.
+        :type payload: bytes
+        :param retain: Should the message be retained by the broker?
+        :type retain: bool
+        :return: bool, False if the message was too big to queue at all.
+        """
+        size = len(topic) + len(payload) + self.ENTRY_OVERHEAD
+        if size > self._budget:
+            self.drops += 1
+            self.lost = True
+            return False
+        entry = self._entries.pop(topic, None)
+        if entry is not None:
+            self._bytes -= self._size(topic, entry)
+            self.coalesced += 1
+        while self._bytes + size > self._budget:
+            self._drop_oldest()
+        self._entries[topic] = [payload, retain, self._sequence]
+        self._sequence += 1
+        self._bytes += size
+        return True
+
+    def flush(self, publish):
+        """
+        Send queued messages, oldest first, until they're all sent or one fails. Anything unsent stays queued.
+
+        :param publish: Function taking topic, payload and retain, returning True if the message was sent.
+        :type publish: function
+        :return: int, number of messages sent.
+        """
+        if not self._entries:
+            return 0
+        start = brickmaster2.perf.BM2Perf.now()
+        entries = self._entries
+        sent = 0
+        for topic in sorted(entries, key=lambda queued_topic: entries[queued_topic][2]):
+            entry = entries[topic]
+            if not publish(topic, entry[0], entry[1]):
+                break
+            del entries[topic]
+            self._bytes -= self._size(topic, entry)
+            sent += 1
+        self.flushed += sent
+        self.flush_ms = round((brickmaster2.perf.BM2Perf.now() - start) / 1000000, 3)
+        logger.debug("MQTT: Flushed {} queued messages in {}ms, {} remain.", sent, self.flush_ms, len(entries))
+        return sent
+
+    @property
+    def stats(self):
+        """
+        Queue metrics for the perf summary.
+
+        :return: dict
+        """
+        return {
+            'depth': len(self._entries),
+            'bytes': self._bytes,
+            'budget': self._budget,
+            'drops': self.drops,
+            'coalesced': self.coalesced,
+            'flushed': self.flushed,
+            'flush_ms': self.flush_ms
+        }
 
+    def _drop_oldest(self):
+        # Drop the oldest non-retained entry, or the oldest entry if they're all retained.
+        oldest = None
+        for topic in self._entries:
+            entry = self._entries[topic]
+            if oldest is None or (entry[1], entry[2]) < (self._entries[oldest][1], self._entries[oldest][2]):
+                oldest = topic
+        self._bytes -= self._size(oldest, self._entries.pop(oldest))
+        self.drops += 1
+        self.lost = True
+        logger.debug("MQTT: Outbound queue full, dropped message for '{}'.", oldest)
 
-    return outbound_messages
+    def _size(self, topic, entry):
+        return len(topic) + len(entry[0]) + self.ENTRY_OVERHEAD
+
+
+def control_status_topic(short_name, control_id, topic_prefix='brickmaster2'):
+    """
+    Topic a control's status is published on.
+    """
+    return topic_prefix + '/' + short_name + '/controls/' + control_id + '/status'
+
+
+def perf_messages(core, short_name, network=None, topic_prefix='brickmaster2'):
+    """
+    Run loop performance summary, once per publish interval.
+
+    :param network: Network object to include MQTT stats from, if any.
+    :type network: brickmaster2.network.base.BM2Network
+    :return: list
+    """
+    if not core.perf.publish_due():
+        return []
+    perf_summary = core.perf.summary()
+    # Include the I2C bus manager's stats, if there's a bus.
+    if core.i2c_bus is not None:
+        perf_summary['i2c'] = {'queue_depth': core.i2c_bus.queue_depth, 'latency': core.i2c_bus.latency}
+    if network is not None:
+        perf_summary['mqtt'] = {'history': network.topic_history_stats, 'queue': network.outbound_stats}
+    return [{
+        'topic': topic_prefix + '/' + short_name + '/perf',
+        'message': perf_summary}]
+
+
+def benchmark_plan(control_counts=(10, 100, 1000), iterations=200):
+    """
+    Measure the cost of a poll's publishing at different numbers of controls, the way BM2Network.poll does it: run the
+    publish plan, advance the heartbeat wheel, then publish the controls in the dirty set. Each poll is one tick of
+    the wheel, so heartbeat republishes are included. An idle poll has no control changes. A changed poll has one
+    control change. A forced poll publishes everything, as after Home Assistant discovery. Publishing goes to a
+    function that does nothing.
+
+    :param control_counts: Numbers of controls to measure at.
+    :type control_counts: tuple
+    :param iterations: Number of polls to time at each size.
+    :type iterations: int
+    :return: dict of (idle, changed, forced) microseconds per poll, by number of controls.
+    """
+    import time
+    import brickmaster2.controls
+
+    def publish(topic, value, retain):
+        pass
+
+    results = {}
+    for count in control_counts:
+        plan = BM2PublishPlan()
+        plan.add('brickmaster2/benchmark/connectivity', lambda: 'online')
+        plan.add('brickmaster2/benchmark/script/active', lambda: None)
+        dirty = set()
+        topics = {}
+        heartbeat = BM2HeartbeatWheel()
+        controls = []
+        for i in range(count):
+            control = brickmaster2.controls.CtrlNull('control' + str(i), 'Control ' + str(i))
+            control.track_changes(dirty)
+            topics[control.id] = control_status_topic('benchmark', control.id)
+            heartbeat.add(control, control.publish_time)
+            controls.append(control)
+        poll_time = [0]
+
+        def poll(force_repeat=False):
+            plan.run(publish, force_repeat)
+            if force_repeat:
+                dirty.update(controls)
+            heartbeat.advance(poll_time[0], dirty)
+            poll_time[0] += 0.5
+            # As BM2Network._publish_controls.
+            while dirty:
+                control = dirty.pop()
+                publish(topics[control.id], control.status, True)
+
+        poll()
+        timings = []
+        for mode in ('idle', 'changed', 'forced'):
+            start = time.monotonic()
+            for i in range(iterations):
+                if mode == 'changed':
+                    controls[i % count]._changed('ON' if i % 2 else 'OFF')
+                poll(force_repeat=mode == 'forced')
+            timings.append((time.monotonic() - start) / iterations * 1000000)
+        results[count] = tuple(timings)
+    return results
 
 
 # HA Device Info
@@ -115,6 +448,8 @@ def ha_discovery(short_name, system_id, device_info, topic_prefix, ha_base, memi
     # Set up the Memory Info entities.
     outbound_messages.extend(ha_discovery_meminfo(short_name, system_id, device_info, topic_prefix, ha_base,
                                                   meminfo_mode))
+    # Run loop performance entities.
+    outbound_messages.extend(ha_discovery_perf(short_name, system_id, device_info, topic_prefix, ha_base))
     # Current active script.
     #outbound_messages.extend(ha_discovery_activescript(short_name, system_id, device_info, topic_prefix, ha_base))
     # Script control
@@ -283,6 +618,47 @@ def ha_discovery_meminfo(short_name, system_id, device_info, topic_prefix, ha_ba
     #self._topics_outbound['meminfo']['discovery_time'] = time.monotonic()
 
 
+def ha_discovery_perf(short_name, system_id, device_info, topic_prefix, ha_base):
+    """
+    Create Home Assistant discovery messages for the key run loop performance numbers.
+
+    :param short_name: Short name of the system
+    :param system_id: ID of the system
+    :param device_info: Device info block.
+    :param topic_prefix: Topic prefix
+    :param ha_base: Home Assistant topic base
+    :return: list
+    """
+    # Entity key, name, value template and unit.
+    entities = [
+        ('loopp50', "Loop Latency p50", '{{ value_json.loop.p50 }}', 'ms'),
+        ('loopp95', "Loop Latency p95", '{{ value_json.loop.p95 }}', 'ms'),
+        ('loopp99', "Loop Latency p99", '{{ value_json.loop.p99 }}', 'ms'),
+        ('loopmax', "Loop Latency Max", '{{ value_json.loop.max }}', 'ms'),
+        ('networkp95', "Network Latency p95", '{{ value_json.network.p95 }}', 'ms'),
+        ('scriptp95', "Script Latency p95", '{{ value_json.script.p95 }}', 'ms'),
+        ('displayp95', "Display Latency p95", '{{ value_json.display.p95 }}', 'ms'),
+        ('dutycycle', "Loop Duty Cycle", '{{ value_json.duty_cycle }}', '%')
+    ]
+    return_list = []
+    for entity in entities:
+        discovery_dict = {
+            'name': entity[1],
+            'object_id': short_name + "_" + entity[0],
+            'device': device_info,
+            'unique_id': system_id + "_" + entity[0],
+            'state_topic': topic_prefix + short_name + '/perf',
+            'unit_of_measurement': entity[3],
+            'value_template': entity[2],
+            'entity_category': 'diagnostic',
+            'icon': 'mdi:timer-outline',
+            'availability': ha_availability(topic_prefix, short_name)
+        }
+        return_list.append({'topic': ha_base + '/sensor/' + 'bm2_' + system_id + '/' + entity[0] + '/config',
+                            'message': json.dumps(discovery_dict)})
+    return return_list
+
+
 def ha_discovery_control(short_name, system_id, device_info, topic_prefix, ha_base, control):
     """
     Discovery message for a GPIO control.
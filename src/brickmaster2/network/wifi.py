@@ -6,6 +6,9 @@ import adafruit_connection_manager
 import supervisor
 import time
 import brickmaster2
+import brickmaster2.exceptions
+import brickmaster2.log
+import brickmaster2.util
 
 
 class BM2WiFi:
@@ -32,7 +35,7 @@ class BM2WiFi:
         :param log_level:
         """
         # Create the logger and set the level to debug. This will get reset later.
-        self._logger = adafruit_logging.getLogger("BrickMaster2")
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
         self._logger.setLevel(log_level)
 
         self._hostname = hostname
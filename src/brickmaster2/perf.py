@@ -0,0 +1,168 @@
+"""
+BrickMaster2 Performance Instrumentation
+
+Fixed-memory latency histograms for the phases of the run loop. Bucket arrays are allocated once at creation, so
+recording a sample never allocates. This keeps the instrumentation safe to leave on with CircuitPython's heap.
+"""
+
+from array import array
+import time
+
+# Upper bounds of the histogram buckets, in microseconds. Roughly logarithmic from 50us to 5s. Anything slower than the
+# last bound lands in an overflow bucket.
+BUCKET_BOUNDS = (50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000, 500000, 1000000, 2000000,
+                 5000000)
+
+# Phases of the run loop that get instrumented.
+PHASES = ('loop', 'network', 'platform', 'script', 'display')
+
+try:
+    _monotonic_ns = time.monotonic_ns
+except AttributeError:
+    # Some CircuitPython boards lack monotonic_ns. Fall back to float seconds.
+    def _monotonic_ns():
+        return int(time.monotonic() * 1000000000)
+
+
+class BM2Histogram:
+    """
+    Latency histogram with preallocated buckets.
+    """
+    def __init__(self):
+        self._bounds = array('L', BUCKET_BOUNDS)
+        self._counts = array('L', [0] * (len(BUCKET_BOUNDS) + 1))
+        self._count = 0
+        self._max = 0
+
+    @property
+    def count(self):
+        """ Number of samples recorded since the last reset. """
+        return self._count
+
+    @property
+    def max(self):
+        """ Largest sample recorded since the last reset, in microseconds. """
+        return self._max
+
+    def record(self, value):
+        """
+        Record a sample.
+
+        :param value: Sample, in microseconds.
+        :type value: int
+        :return: None
+        """
+        i = 0
+        while i < len(self._bounds) and value > self._bounds[i]:
+            i += 1
+        self._counts[i] += 1
+        self._count += 1
+        if value > self._max:
+            self._max = value
+
+    def percentile(self, pct):
+        """
+        Estimate a percentile. This is the upper bound of the bucket the percentile falls into, capped at the maximum
+        seen.
+
+        :param pct: Percentile, 0-100.
+        :type pct: float
+        :return: int
+        """
+        if self._count == 0:
+            return 0
+        target = self._count * pct / 100
+        cumulative = 0
+        i = 0
+        while i < len(self._counts):
+            cumulative += self._counts[i]
+            if cumulative >= target:
+                if i < len(self._bounds):
+                    return min(self._bounds[i], self._max)
+                break
+            i += 1
+        return self._max
+
+    def reset(self):
+        """
+        Zero the histogram. Buckets are reused, not reallocated.
+        """
+        i = 0
+        while i < len(self._counts):
+            self._counts[i] = 0
+            i += 1
+        self._count = 0
+        self._max = 0
+
+
+class BM2Perf:
+    """
+    Collection of histograms, one per run loop phase.
+    """
+    def __init__(self, publish_interval=60):
+        """
+        :param publish_interval: How often, in seconds, to publish summaries.
+        :type publish_interval: int
+        """
+        self._histograms = {}
+        for phase in PHASES:
+            self._histograms[phase] = BM2Histogram()
+        self._publish_interval = publish_interval
+        self._last_publish = time.monotonic()
+        self.duty_cycle = None
+
+    @staticmethod
+    def now():
+        """
+        Timestamp to mark the start of a phase. Pass it back to record() when the phase ends.
+
+        :return: int
+        """
+        return _monotonic_ns()
+
+    def record(self, phase, mark):
+        """
+        Record the time elapsed since a mark.
+
+        :param phase: Phase to record against.
+        :type phase: str
+        :param mark: Timestamp from now().
+        :type mark: int
+        :return: None
+        """
+        self._histograms[phase].record((_monotonic_ns() - mark) // 1000)
+
+    def publish_due(self):
+        """
+        Has the publish interval elapsed?
+
+        :return: bool
+        """
+        return time.monotonic() - self._last_publish >= self._publish_interval
+
+    def summary(self, reset=True):
+        """
+        Summarize all phases, in milliseconds.
+
+        :param reset: Reset the histograms after summarizing, so each summary covers one publish interval.
+        :type reset: bool
+        :return: dict
+        """
+        summary = {}
+        for phase in self._histograms:
+            histogram = self._histograms[phase]
+            summary[phase] = {
+                'count': histogram.count,
+                'p50': round(histogram.percentile(50) / 1000, 3),
+                'p95': round(histogram.percentile(95) / 1000, 3),
+                'p99': round(histogram.percentile(99) / 1000, 3),
+                'max': round(histogram.max / 1000, 3)
+            }
+            if reset:
+                histogram.reset()
+        if self.duty_cycle is None:
+            summary['duty_cycle'] = None
+        else:
+            summary['duty_cycle'] = round(self.duty_cycle * 100, 2)
+        self._last_publish = time.monotonic()
+        return summary
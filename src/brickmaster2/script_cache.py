@@ -0,0 +1,144 @@
+"""
+BrickMaster2 Compiled Script Cache
+
+Stores compiled scripts on disk so unchanged scripts can be loaded without parsing their JSON, validating blocks or
+building flight plans. Each script file gets one cache entry, keyed by its path. An entry is valid when the file's
+content hash matches, and when it was compiled against the same set of controls, since block actions depend on which
+controls exist. The file's modification time and size are also saved, so an untouched file doesn't even need to be read.
+
+Linux only. Entries are pickled.
+"""
+
+import brickmaster2.log
+import hashlib
+import os
+import pickle
+from brickmaster2.scripts import COMPILED_VERSION
+
+
+class BM2ScriptCache:
+    """
+    On-disk cache of compiled scripts.
+    """
+    def __init__(self, cache_dir, control_ids):
+        """
+        :param cache_dir: Directory to keep cache entries in. Created if it doesn't exist.
+        :type cache_dir: str
+        :param control_ids: IDs of the configured controls.
+        :type control_ids: list
+        """
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
+        self._cache_dir = cache_dir
+        self._controls_key = tuple(sorted(control_ids))
+        self._hits = 0
+        self._misses = 0
+        self._writable = True
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+        except OSError as e:
+            self._logger.warning("Core: Cannot create script cache directory '{}' - {}. Scripts will not be cached.".
+                                 format(self._cache_dir, e))
+            self._writable = False
+
+    @property
+    def hits(self):
+        """ Number of scripts loaded from the cache. """
+        return self._hits
+
+    @property
+    def misses(self):
+        """ Number of scripts that had to be compiled. """
+        return self._misses
+
+    @property
+    def hit_ratio(self):
+        """
+        Fraction of lookups that were hits. None if there haven't been any.
+
+        :return: float
+        """
+        if self._hits + self._misses == 0:
+            return None
+        return self._hits / (self._hits + self._misses)
+
+    def load(self, path):
+        """
+        Look up a script file.
+
+        :param path: Path to the script file.
+        :type path: str
+        :return: tuple of the compiled script, or None on a miss, and the file's contents, or None if the file didn't
+        need to be read.
+        """
+        stat = os.stat(path)
+        entry = self._read_entry(path)
+        if entry is not None and (entry['mtime'], entry['size']) == (stat.st_mtime_ns, stat.st_size):
+            self._hits += 1
+            return entry['compiled'], None
+        with open(path, 'rb') as f:
+            source = f.read()
+        if entry is not None and entry['hash'] == self._hash(source):
+            # Touched, but not changed. Save the new modification time so the next load doesn't need to read it.
+            self._hits += 1
+            self._write_entry(path, source, entry['compiled'], stat)
+            return entry['compiled'], source
+        self._misses += 1
+        return None, source
+
+    def store(self, path, source, compiled):
+        """
+        Save a compiled script.
+
+        :param path: Path to the script file.
+        :type path: str
+        :param source: Contents of the script file the script was compiled from.
+        :type source: bytes
+        :param compiled: The compiled script.
+        :type compiled: dict
+        :return: None
+        """
+        self._write_entry(path, source, compiled, os.stat(path))
+
+    def _entry_path(self, path):
+        name = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self._cache_dir, name + '.bm2c')
+
+    @staticmethod
+    def _hash(source):
+        return hashlib.sha256(source).hexdigest()
+
+    def _read_entry(self, path):
+        try:
+            with open(self._entry_path(path), 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # Anything wrong with the entry just means it gets rebuilt.
+            self._logger.debug("Core: Could not read script cache entry for '{}' - {}".format(path, e))
+            return None
+        if (entry.get('version') != COMPILED_VERSION or entry.get('path') != os.path.abspath(path)
+                or entry.get('controls') != self._controls_key):
+            return None
+        return entry
+
+    def _write_entry(self, path, source, compiled, stat):
+        if not self._writable:
+            return
+        entry = {
+            'version': COMPILED_VERSION,
+            'path': os.path.abspath(path),
+            'controls': self._controls_key,
+            'hash': self._hash(source),
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'compiled': compiled
+        }
+        entry_path = self._entry_path(path)
+        # Write to a temporary file and move it into place, so a partial write never leaves a bad entry.
+        try:
+            with open(entry_path + '.tmp', 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(entry_path + '.tmp', entry_path)
+        except OSError as e:
+            self._logger.warning("Core: Could not write script cache entry for '{}' - {}".format(path, e))
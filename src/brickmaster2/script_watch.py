@@ -0,0 +1,118 @@
+"""
+BrickMaster2 Script Directory Watcher
+
+Watches the scripts directory for script files being added, changed or removed. Uses inotify through inotify_simple
+when it's installed, otherwise polls file modification times. Linux only.
+"""
+
+import brickmaster2.log
+import os
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+class BM2ScriptWatcher:
+    """
+    Watcher for a scripts directory.
+    """
+    def __init__(self, script_dir, poll_interval=2):
+        """
+        :param script_dir: Directory to watch.
+        :type script_dir: str
+        :param poll_interval: How often to check for changes, in seconds.
+        :type poll_interval: float
+        """
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
+        self._script_dir = script_dir
+        self._poll_interval = poll_interval
+        self._last_check = time.monotonic()
+        # Modification time and size of each script file, for polling.
+        self._files = self._scan()
+        self._inotify = None
+        if inotify_simple is not None:
+            try:
+                self._inotify = inotify_simple.INotify()
+                flags = inotify_simple.flags
+                self._inotify.add_watch(self._script_dir, flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM |
+                                        flags.DELETE)
+            except OSError as e:
+                self._logger.warning("Core: Could not set up inotify on '{}' - {}. Polling instead.".
+                                     format(self._script_dir, e))
+                self._inotify = None
+        if self._inotify is None:
+            self._logger.info("Core: Watching '{}' for script changes by polling.".format(self._script_dir))
+        else:
+            self._logger.info("Core: Watching '{}' for script changes with inotify.".format(self._script_dir))
+
+    @property
+    def method(self):
+        """
+        How the directory is being watched. 'inotify' or 'poll'.
+
+        :return: str
+        """
+        return 'poll' if self._inotify is None else 'inotify'
+
+    def changes(self):
+        """
+        Get the script files that have changed since the last call. Only checks once per poll interval.
+
+        :return: tuple of (changed paths, removed paths), or None if it isn't time to check yet.
+        """
+        if time.monotonic() - self._last_check < self._poll_interval:
+            return None
+        self._last_check = time.monotonic()
+        if self._inotify is not None:
+            return self._changes_inotify()
+        return self._changes_poll()
+
+    def _changes_inotify(self):
+        events = self._inotify.read(timeout=0)
+        if len(events) == 0:
+            return [], []
+        # Several events can arrive for the same file. Work out where each file ended up.
+        paths = set()
+        for event in events:
+            if event.name.endswith('.json'):
+                paths.add(os.path.join(self._script_dir, event.name))
+        changed = []
+        removed = []
+        for path in sorted(paths):
+            if os.path.exists(path):
+                changed.append(path)
+            else:
+                removed.append(path)
+        # Keep the poll state current, in case we ever need to fall back.
+        self._files = self._scan()
+        return changed, removed
+
+    def _changes_poll(self):
+        current = self._scan()
+        changed = []
+        removed = []
+        for path in current:
+            if self._files.get(path) != current[path]:
+                changed.append(path)
+        for path in self._files:
+            if path not in current:
+                removed.append(path)
+        self._files = current
+        return sorted(changed), sorted(removed)
+
+    def _scan(self):
+        files = {}
+        try:
+            entries = os.scandir(self._script_dir)
+        except OSError as e:
+            self._logger.warning("Core: Could not scan script directory '{}' - {}".format(self._script_dir, e))
+            return files
+        with entries:
+            for entry in entries:
+                if entry.name.endswith('.json') and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return files
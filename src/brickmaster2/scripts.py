@@ -1,19 +1,108 @@
 """ Brickmaster2 Script Handling """
 
-import adafruit_logging as logger
+import brickmaster2.log
+from array import array
 import time
 import math
+from brickmaster2.controls import ControlBatch
 from brickmaster2.segment_format import time_7s, number_7s
 
+try:
+    from bisect import bisect_right
+except ImportError:
+    # CircuitPython doesn't have bisect.
+    def bisect_right(a, x):
+        lo = 0
+        hi = len(a)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if x < a[mid]:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+# Version of the compiled script format. Bump when the format changes so cached scripts get rebuilt.
+COMPILED_VERSION = 1
+
+# Store block times as doubles where the platform supports them, otherwise as single-precision floats.
+try:
+    array('d', [0])
+    _TIME_TYPECODE = 'd'
+except (TypeError, ValueError):
+    _TIME_TYPECODE = 'f'
+
+
+class BM2Timeline:
+    """
+    Compiled timeline of script blocks. Block times are kept in arrays, so finding the block for an elapsed time is a
+    binary search, and per-block completion is one byte per block.
+    """
+    __slots__ = ('starts', 'ends', 'run_times', 'names', 'actions', 'flight', 'complete', 'loop_actions')
+
+    def __init__(self, size):
+        """
+        :param size: Number of blocks.
+        :type size: int
+        """
+        self.starts = array(_TIME_TYPECODE, [0] * size)
+        self.ends = array(_TIME_TYPECODE, [0] * size)
+        self.run_times = array(_TIME_TYPECODE, [0] * size)
+        self.names = [None] * size
+        # Control actions per block, as tuples of (control, value).
+        self.actions = [()] * size
+        # Flight data per block. Only used by flight scripts.
+        self.flight = None
+        self.complete = bytearray(size)
+        # Control actions to go from the last block back to the first, for repeating scripts.
+        self.loop_actions = ()
+
+    def __len__(self):
+        return len(self.ends)
+
+    @property
+    def run_time(self):
+        """ Total run time. The end of the last block. """
+        return self.ends[-1]
+
+    def block_at(self, elapsed):
+        """
+        Find the block that should be active at an elapsed time. A block stays active until its end time, after which
+        the next block takes over. Returns the number of blocks if the elapsed time is past the end.
+
+        :param elapsed: Seconds since the script started.
+        :type elapsed: float
+        :return: int
+        """
+        return bisect_right(self.ends, elapsed)
+
+    def reset(self):
+        """
+        Mark all blocks as pending.
+        """
+        i = 0
+        while i < len(self.complete):
+            self.complete[i] = 0
+            i += 1
+
 
 class BM2Script:
-    def __init__(self, script, controls):
+    def __init__(self, script, controls, compiled=None):
+        """
+        :param script: Script definition, as loaded from JSON.
+        :type script: dict
+        :param controls: Controls, by ID.
+        :type controls: dict
+        :param compiled: Previously compiled script, from the compiled property. If given, the script definition
+        isn't needed and validation is skipped.
+        :type compiled: dict
+        """
         # Create a logger.
-        self._logger = logger.getLogger('BrickMaster2')
+        self._logger = brickmaster2.log.getLogger('BrickMaster2')
         # Initialize variables
         self._run_count = 0  # Which run of the script are we on. Starts at zero!
         self._status = 'OFF'  # Status, start as idle.
-        self._blocks = []  # Blocks to execute.
+        self._timeline = None  # Compiled blocks to execute.
         self._start_time = None  # When we started.
         self._name = None
         self._type = None
@@ -23,13 +112,20 @@ class BM2Script:
         self._active_block = None
         self._pending_block = 0
         self._at_completion = "off"
+        # Lag metrics for the current, or most recent, run.
+        self._lag = {'run': 0, 'last': 0, 'max': 0, 'skipped': 0, 'catch_ups': 0}
         self._topics = None
         self._saved_state = None
         # Save the controls references.
         self._controls = controls
+        # Batch for writing control changes. Controls sharing an expander get written together.
+        self._batch = ControlBatch(controls.values())
 
-        # Validate and load the script.
-        self._validate(script)
+        # Validate and load the script, or load the already compiled version.
+        if compiled is None:
+            self._validate(script)
+        else:
+            self._load_compiled(compiled)
 
         # Create MQTT topics.
         self._create_topics()
@@ -90,6 +186,61 @@ class BM2Script:
     def topics(self):
         return self._topics
 
+    # How long the most recent block change spent writing out, or queueing writes to, expander ports.
+    @property
+    def block_write_time(self):
+        return self._batch.last_flush_time
+
+    @property
+    def lag(self):
+        """
+        Lag metrics for the current run, or the last one if the script isn't running. 'last' and 'max' are how late,
+        in seconds, blocks were applied after their start time. 'skipped' is how many blocks were passed over entirely
+        because the loop stalled, and 'catch_ups' is how many times that happened.
+
+        :return: dict
+        """
+        return self._lag
+
+    @property
+    def compiled(self):
+        """
+        The compiled script, as plain data that can be saved and passed back in to skip validation. Controls are
+        referenced by ID.
+
+        :return: dict
+        """
+        timeline = self._timeline
+        return {
+            'version': COMPILED_VERSION,
+            'id': self._id,
+            'name': self._name,
+            'type': self._type,
+            'run': self._run,
+            'loops': self._loops,
+            'at_completion': self._at_completion,
+            'run_time': self._run_time,
+            'starts': timeline.starts,
+            'ends': timeline.ends,
+            'run_times': timeline.run_times,
+            'names': timeline.names,
+            'actions': [self._export_actions(actions) for actions in timeline.actions],
+            'loop_actions': self._export_actions(timeline.loop_actions)
+        }
+
+    # When the script next needs to be executed. Used by the core scheduler.
+    @property
+    def next_event(self):
+        """
+        Monotonic time of the next block boundary. None if the script isn't running.
+        """
+        if self._status == 'OFF' or self._start_time is None:
+            return None
+        if self._active_block is None:
+            # Haven't started executing yet, do so now.
+            return time.monotonic()
+        return self._start_time + self._timeline.ends[self._active_block]
+
     # Set the running state. This is how the script gets started and stopped.
     def set(self, value):
         self._logger.info("Setting script '{}' to '{}'".format(self.name, value))
@@ -99,26 +250,43 @@ class BM2Script:
             self._current_loop = 1
             self._active_block = None
             self._pending_block = 0
+            self._run_count += 1
+            self._lag = {'run': self._run_count, 'last': 0, 'max': 0, 'skipped': 0, 'catch_ups': 0}
             if self._at_completion == 'restore':
                 self._logger.debug("Freezing system state.")
                 self._saved_state = self._system_status()
             self._start_time = time.monotonic()
         # Stopping...
         elif value == 'OFF':
+            if self._lag['skipped'] > 0:
+                self._logger.info("Script '{}' run {} caught up {} times, skipping {} blocks. Max lag {}s.".
+                                  format(self.name, self._lag['run'], self._lag['catch_ups'], self._lag['skipped'],
+                                         round(self._lag['max'], 3)))
             self._start_time = None
             self._status = 'OFF'
-            self._reset_blocks()
-            if self._at_completion == 'restore':
-                self._logger.debug("Restoring original system state.")
-                for control_state in self._saved_state:
-                    control_state[0].set(control_state[1])
-                self._saved_state = None
-            else:
-                for control in self._controls:
-                    control.set('off')
+            self._timeline.reset()
+            with self._batch:
+                if self._at_completion == 'restore':
+                    self._logger.debug("Restoring original system state.")
+                    for control_state in self._saved_state:
+                        control_state[0].set(control_state[1])
+                    self._saved_state = None
+                else:
+                    for control in self._controls:
+                        self._controls[control].set('off')
 
     # Executor. Called to take actions based on the internal time index.
-    def execute(self, implicit_start=False):
+    def execute(self, implicit_start=False, displays=True):
+        """
+        Execute the script for the current time.
+
+        :param implicit_start: Start the script if it isn't already running.
+        :type implicit_start: bool
+        :param displays: Also update any displays the script drives. When False, displays are left to a separate
+        call to update_displays().
+        :type displays: bool
+        :return: None
+        """
         # What to do if called when idle.
         if self._status == 'OFF':
             if implicit_start:
@@ -126,44 +294,122 @@ class BM2Script:
             else:
                 return
 
-        # Is the active block none? This means we're at the start of the script. Move to Block 0
+        timeline = self._timeline
+        # Find the block we should be in directly from the elapsed time, so a stalled loop doesn't leave the script
+        # running behind.
+        elapsed = time.monotonic() - self._start_time
+        target_block = timeline.block_at(elapsed)
+
+        # Is the active block none? This means we're at the start of the script. Run Block 0.
         if self._active_block is None:
-            self._active_block = 1
-        # Are we within a tenth of a second of the end time of the active block?
-        if (time.monotonic() - self._start_time) >= (self._blocks[self._active_block]['end_time']):
-            self._active_block += 1
+            self._active_block = 0
+            self._execute_block(0)
+            self._record_lag(0, elapsed)
+        # Move up to the target block, or the last block if we're past the end.
+        last_block = min(target_block, len(timeline) - 1)
+        if last_block == self._active_block + 1:
+            self._active_block = last_block
+            self._execute_block(last_block)
+            self._record_lag(last_block, elapsed)
+        elif last_block > self._active_block:
+            self._catch_up(last_block, elapsed)
 
         # Are we at the end of the script?
-        if self._active_block >= len(self._blocks) - 1:
+        if target_block >= len(timeline):
             # For repeating script. loop it.
             if self._run == 'repeat' and self._current_loop < self._loops:
                 self._logger.debug("Ending loop {}.".format(self._current_loop))
                 self._current_loop += 1
-                self._reset_blocks()
+                timeline.reset()
                 self._logger.debug("Script starting new cycle.")
                 # Set Active block back to 0
                 self._active_block = 0
                 self._start_time = time.monotonic()
+                # Controls are in the last block's state, so only apply what differs for the first block.
+                self._execute_block(0, timeline.loop_actions)
             else:
                 self._logger.debug("Script Complete.")
                 self.set('OFF')
-                return  # Return here to make sure we don't try to run a block we shouldn't.
 
-        self._execute_block(self._active_block)
+    def update_displays(self):
+        """
+        Update any displays driven by the script. Basic scripts don't drive displays, so this does nothing.
+        """
+        pass
+
+    def _execute_block(self, block_num, control_actions=None):
+        # Traverse the controls and pass the intended value. Block actions are deltas from the previous block, so only
+        # controls that change get set.
+        if control_actions is None:
+            control_actions = self._timeline.actions[block_num]
+        if not self._timeline.complete[block_num]:
+            if self._logger.isEnabledFor(brickmaster2.log.DEBUG):
+                self._logger.debug("Executing control actions for block {} at run time {}", block_num,
+                                   time.monotonic() - self._start_time)
+            with self._batch:
+                for control_action in control_actions:
+                    control_action[0].set(control_action[1])
+        self._timeline.complete[block_num] = 1
+
+    def _catch_up(self, target_block, elapsed):
+        # The loop fell behind by more than one block. Blocks hold deltas, so collapse everything from the active
+        # block up to the target into the net state and apply it in one go, rather than flashing through every
+        # intermediate state.
+        timeline = self._timeline
+        net_actions = {}
+        block_num = self._active_block + 1
+        while block_num <= target_block:
+            for control_action in timeline.actions[block_num]:
+                net_actions[control_action[0].id] = control_action
+            timeline.complete[block_num] = 1
+            block_num += 1
+        skipped = target_block - self._active_block - 1
+        self._logger.debug("Script '{}' behind by {} blocks, applying net state of blocks {} to {}.", self.name, skipped,
+                           self._active_block + 1, target_block)
+        with self._batch:
+            for control_id in net_actions:
+                net_actions[control_id][0].set(net_actions[control_id][1])
+        self._active_block = target_block
+        self._lag['skipped'] += skipped
+        self._lag['catch_ups'] += 1
+        self._record_lag(target_block, elapsed)
+
+    def _record_lag(self, block_num, elapsed):
+        # How late the block was applied, relative to when it should have started.
+        if block_num == 0:
+            lag = elapsed
+        else:
+            lag = elapsed - self._timeline.ends[block_num - 1]
+        self._lag['last'] = lag
+        if lag > self._lag['max']:
+            self._lag['max'] = lag
 
-    def _execute_block(self, block_num):
-        # Traverse the controls and pass the intended value.
-        if self._blocks[block_num]['status'] != 'complete':
-            self._logger.debug("Executing control actions for block {} at run time {}".
-                               format(block_num, time.monotonic() - self._start_time))
-            for control_action in self._blocks[block_num]['control_actions']:
-                control_action[0].set(control_action[1])
-        self._blocks[block_num]['status'] = 'complete'
+    @staticmethod
+    def _export_actions(actions):
+        return tuple((control_action[0].id, control_action[1]) for control_action in actions)
 
-    # Simple method to reset the blocks from run to pending. Used when the script ends, or to reset the loop.
-    def _reset_blocks(self):
-        for block in self._blocks:
-            block['status'] = 'pending'
+    def _import_actions(self, actions):
+        return tuple((self._controls[control_action[0]], control_action[1]) for control_action in actions)
+
+    def _load_compiled(self, compiled):
+        # Load a compiled script. Compiled data is trusted, it was validated when it was compiled.
+        if compiled['version'] != COMPILED_VERSION:
+            raise ValueError("Compiled script is version {}, expected {}.".format(compiled['version'],
+                                                                                 COMPILED_VERSION))
+        self._id = compiled['id']
+        self._name = compiled['name']
+        self._type = compiled['type']
+        self._run = compiled['run']
+        self._loops = compiled['loops']
+        self._at_completion = compiled['at_completion']
+        self._run_time = compiled['run_time']
+        self._timeline = BM2Timeline(len(compiled['ends']))
+        self._timeline.starts = compiled['starts']
+        self._timeline.ends = compiled['ends']
+        self._timeline.run_times = compiled['run_times']
+        self._timeline.names = list(compiled['names'])
+        self._timeline.actions = [self._import_actions(actions) for actions in compiled['actions']]
+        self._timeline.loop_actions = self._import_actions(compiled['loop_actions'])
 
     # Script validation.
     # Pull basic settings for the object out of the provided script.
@@ -212,25 +458,75 @@ class BM2Script:
                     raise ValueError("Script is repeating but no repeat count set.")
 
         # Check the blocks!
+        block_count = len(script['blocks'])
+        self._timeline = BM2Timeline(block_count)
+        if self._type == 'flight':
+            self._timeline.flight = [None] * block_count
         i = 0
-        while i < len(script['blocks']):
+        previous_actions = None
+        first_actions = None
+        end_time = 0
+        while i < block_count:
             self._logger.debug("Processing block number {}".format(i))
             try:
                 block_data = self._validate_block(script['blocks'][i])
             except:
                 raise ValueError("Could not validate block {} in script. Cannot continue.".format(i + 1))
+            # The first block sets every control, since we don't know what state things are in when the script starts.
+            # Every block after that only needs to change what differs from the block before it.
+            block_actions = block_data['control_actions']
+            if previous_actions is None:
+                first_actions = block_actions
+                self._timeline.actions[i] = tuple(block_actions)
+            else:
+                self._timeline.actions[i] = tuple(self._delta_actions(previous_actions, block_actions))
+            previous_actions = block_actions
             # Calculate the start and end time.
             if i == 0:
-                block_data['start_time'] = 0
+                start_time = 0
             else:
                 # This block starts one second after the previous block.
-                previous_end_time = self._blocks[i - 1]['end_time']
-                block_data['start_time'] = previous_end_time + 1
-            block_data['end_time'] = block_data['start_time'] + block_data['run_time']
+                start_time = end_time + 1
+            end_time = start_time + block_data['run_time']
+            self._timeline.starts[i] = start_time
+            self._timeline.ends[i] = end_time
+            self._timeline.run_times[i] = block_data['run_time']
+            self._timeline.names[i] = block_data['name']
+            if self._timeline.flight is not None and 'flight' in block_data:
+                self._timeline.flight[i] = block_data['flight']
             # Last block end time becomes the total run time, since we go from 0 to the end time of the last block.
-            self._run_time = block_data['end_time']
-            self._blocks.append(block_data)
+            self._run_time = end_time
             i += 1
+        # When a repeating script loops, go from the last block's state to the first.
+        self._timeline.loop_actions = tuple(self._delta_actions(previous_actions, first_actions))
+
+    @staticmethod
+    def _delta_actions(previous_actions, target_actions):
+        """
+        Find the control actions needed to go from one block's control state to another's.
+
+        :param previous_actions: Complete control actions of the previous block.
+        :type previous_actions: list
+        :param target_actions: Complete control actions of the target block.
+        :type target_actions: list
+        :return: list
+        """
+        previous_state = {}
+        for control_action in previous_actions:
+            previous_state[control_action[0].id] = BM2Script._action_value(control_action)
+        delta = []
+        for control_action in target_actions:
+            if previous_state.get(control_action[0].id) != BM2Script._action_value(control_action):
+                delta.append(control_action)
+        return delta
+
+    @staticmethod
+    def _action_value(control_action):
+        # Controls are set with strings, ie: 'on' or 'off'. Anything else in a script, such as a JSON true, is an error.
+        if not isinstance(control_action[1], str):
+            raise ValueError("Action '{}' for control '{}' is not a string.".format(
+                control_action[1], control_action[0].id))
+        return control_action[1].lower()
 
     # Create the blocks and pre-fill various items.
     def _validate_block(self, block):
@@ -244,9 +540,6 @@ class BM2Script:
         block_data = {
             'name': None,
             'run_time': block['run_time'],
-            'status': "pending",
-            'start_time': None,
-            'end_time': None,
             'control_actions': [],
         }
         if 'name' in block:
@@ -296,156 +589,501 @@ class BM2Script:
         ]
 
 
+# How a flight value changes each second within a segment.
+FLIGHT_SET = 0  # Absolute value from the block.
+FLIGHT_ADD = 1  # Add the per-second change. Used for glide and freeze.
+FLIGHT_ROUND = 2  # Add the per-second change, rounded to three places. Altitude with no instruction.
+
+# Flight plan builder backend. None picks NumPy if it's available, otherwise pure Python, the first time a segment is
+# long enough to use it. Can be set to 'python' to force the fallback.
+FLIGHT_BACKEND = None
+# Segments shorter than this are quicker to step through in Python than to hand off to NumPy.
+NUMPY_MIN_STEPS = 32
+# NumPy, once loaded. It's only imported when a flight plan needs it, so systems without flight scripts don't pay for it.
+numpy = None
+
+
+def _flight_backend():
+    # Resolve the backend, importing NumPy the first time it's wanted.
+    global FLIGHT_BACKEND, numpy
+    if FLIGHT_BACKEND != 'python' and numpy is None:
+        try:
+            import numpy as numpy_module
+        except ImportError:
+            # Not on CircuitPython, and optional on Linux. Flight plans get built in pure Python.
+            FLIGHT_BACKEND = 'python'
+        else:
+            numpy = numpy_module
+            FLIGHT_BACKEND = 'numpy'
+    return FLIGHT_BACKEND
+
+
+def _accumulate(start, change, steps):
+    # Add a change to a start value a number of times. Integers are exact, so can just be multiplied. Floats have to
+    # be added in order to round the same way as stepping, which NumPy's accumulate does.
+    if isinstance(start, int) and isinstance(change, int):
+        return start + change * steps
+    series = numpy.full(steps + 1, change, dtype=numpy.float64)
+    series[0] = start
+    return float(numpy.add.accumulate(series)[-1])
+
+
+class BM2FlightSegment:
+    """
+    One block of a flight plan. Holds the state at the second before the segment starts and how each value changes
+    every second, so any second in the segment can be calculated without storing it.
+    """
+    __slots__ = ('first', 'met', 'met_set', 'met_running', 'alt', 'alt_mode', 'alt_set', 'da', 'vel', 'vel_mode',
+                 'vel_set', 'dv')
+
+    def __init__(self, first, met, alt, vel):
+        """
+        :param first: First second of the plan covered by this segment.
+        :type first: int
+        :param met: Mission elapsed time before the segment starts.
+        :param alt: Altitude before the segment starts.
+        :param vel: Velocity before the segment starts.
+        """
+        self.first = first
+        self.met = met
+        self.met_set = None
+        self.met_running = False
+        self.alt = alt
+        self.alt_mode = FLIGHT_ROUND
+        self.alt_set = None
+        self.da = 0
+        self.vel = vel
+        self.vel_mode = FLIGHT_ADD
+        self.vel_set = None
+        self.dv = 0
+
+    def step(self, met, alt, vel):
+        """
+        Advance the flight values by one second.
+
+        :return: tuple
+        """
+        if self.met_set is not None:
+            met = self.met_set
+        elif self.met_running:
+            met += 1
+        if self.alt_mode == FLIGHT_SET:
+            alt = self.alt_set
+        elif self.alt_mode == FLIGHT_ADD:
+            alt = alt + self.da
+        else:
+            alt = round(alt + self.da, 3)
+        if self.vel_mode == FLIGHT_SET:
+            vel = self.vel_set
+        else:
+            vel = vel + self.dv
+        return met, alt, vel
+
+    def constants(self):
+        """
+        Values that hold for the whole segment. Values that change from second to second are None.
+
+        :return: tuple of met, altitude, velocity
+        """
+        met, alt, vel = self.step(self.met, self.alt, self.vel)
+        if self.met_set is None and self.met_running:
+            met = None
+        if self.alt_mode != FLIGHT_SET and self.da != 0:
+            alt = None
+        if self.vel_mode != FLIGHT_SET and self.dv != 0:
+            vel = None
+        return met, alt, vel
+
+    def advance(self, met, alt, vel, steps):
+        """
+        Advance the flight values by a number of seconds.
+
+        :return: tuple
+        """
+        while steps > 0:
+            met, alt, vel = self.step(met, alt, vel)
+            steps -= 1
+        return met, alt, vel
+
+    def advance_bulk(self, met, alt, vel, steps):
+        """
+        Advance the flight values by a number of seconds, using NumPy to add up runs of changes. Results are the same
+        as advance(). Rounded altitude can't be added up, since each second's rounding depends on the last and NumPy
+        rounds differently from round(), so it steps in Python. The builder doesn't use this for segments where that
+        applies, as there'd be nothing gained.
+
+        :return: tuple
+        """
+        if self.met_set is not None:
+            met = self.met_set
+        elif self.met_running:
+            met = _accumulate(met, 1, steps)
+        if self.alt_mode == FLIGHT_SET:
+            alt = self.alt_set
+        elif self.alt_mode == FLIGHT_ADD:
+            alt = _accumulate(alt, self.da, steps)
+        elif self.da == 0:
+            alt = round(alt, 3)
+        else:
+            i = 0
+            while i < steps:
+                alt = round(alt + self.da, 3)
+                i += 1
+        if self.vel_mode == FLIGHT_SET:
+            vel = self.vel_set
+        else:
+            vel = _accumulate(vel, self.dv, steps)
+        return met, alt, vel
+
+
+class BM2FlightModel:
+    """
+    Piecewise flight plan. One segment per block, with values calculated on demand. Values accumulate second by
+    second exactly as a pre-calculated plan would, so results are identical. Reading forward in time picks up from the
+    last second read, so normal playback only does one step per second.
+    """
+    def __init__(self, segments, length):
+        """
+        :param segments: Segments, in time order.
+        :type segments: list
+        :param length: Number of seconds in the plan.
+        :type length: int
+        """
+        self._segments = segments
+        self._firsts = array('L', [segment.first for segment in segments])
+        self._length = length
+        # Last second read. [second, segment index, met, alt, vel]
+        self._cursor = None
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def segments(self):
+        return self._segments
+
+    def segment_at(self, second):
+        """
+        Index of the segment covering a second of the plan.
+
+        :param second: Second of the plan.
+        :type second: int
+        :return: int
+        """
+        return bisect_right(self._firsts, second) - 1
+
+    @property
+    def compiled(self):
+        """
+        The model as plain data. Each segment is a tuple of its slot values.
+
+        :return: dict
+        """
+        return {
+            'length': self._length,
+            'segments': [tuple(getattr(segment, slot) for slot in BM2FlightSegment.__slots__)
+                         for segment in self._segments]
+        }
+
+    @staticmethod
+    def from_compiled(compiled):
+        """
+        Recreate a model from its compiled data.
+
+        :param compiled: Data from the compiled property.
+        :type compiled: dict
+        :return: BM2FlightModel
+        """
+        segments = []
+        for values in compiled['segments']:
+            segment = BM2FlightSegment(0, 0, 0, 0)
+            for slot, value in zip(BM2FlightSegment.__slots__, values):
+                setattr(segment, slot, value)
+            segments.append(segment)
+        return BM2FlightModel(segments, compiled['length'])
+
+    def at(self, second):
+        """
+        Get flight values for a second of the plan.
+
+        :param second: Second of the plan.
+        :type second: int
+        :return: tuple of met, altitude, velocity
+        """
+        if second < 0 or second >= self._length:
+            raise IndexError("Flight plan second {} out of range.".format(second))
+        index = bisect_right(self._firsts, second) - 1
+        segment = self._segments[index]
+        cursor = self._cursor
+        if cursor is not None and cursor[1] == index and cursor[0] <= second:
+            # Continue on from the last read.
+            current = cursor[0]
+            met, alt, vel = cursor[2], cursor[3], cursor[4]
+        else:
+            # Start from the top of the segment.
+            current = segment.first - 1
+            met, alt, vel = segment.met, segment.alt, segment.vel
+        met, alt, vel = segment.advance(met, alt, vel, second - current)
+        self._cursor = [second, index, met, alt, vel]
+        return met, alt, vel
+
+
 class BM2FlightScript(BM2Script):
-    def __init__(self, script, controls, displays):
+    def __init__(self, script, controls, displays, compiled=None):
         # Call the superclass init
-        super().__init__(script, controls)
+        super().__init__(script, controls, compiled=compiled)
         self._logger.debug("Flight script init...")
-        # Build the flight plan.
-        self._flight_plan = []
-        self._build_flight_plan(script)
+        if compiled is None:
+            # Build the flight plan.
+            build_start = time.monotonic()
+            self._flight_model = self._build_flight_plan(script)
+            self._build_time = time.monotonic() - build_start
+            self._logger.debug("Built {}s flight plan in {}ms using {} backend.".
+                               format(len(self._flight_model), round(self._build_time * 1000, 3), FLIGHT_BACKEND or 'python'))
+            # Flight data from the blocks is only needed for building.
+            self._timeline.flight = None
+            display_map = script.get('display_map')
+        else:
+            self._flight_model = BM2FlightModel.from_compiled(compiled['flight_model'])
+            self._build_time = 0
+            display_map = compiled['display_map']
+        # Pre-render the display content for each segment.
+        self._render_segments()
+        # What's currently been sent to the displays.
+        self._shown_second = None
+        self._shown = {'met': None, 'alt': None, 'vel': None}
         # Convert the display map.
+        self._display_map_config = display_map
         self._display_map = {}
-        self._map_displays(script, displays)
+        self._map_displays(display_map, displays)
+
+    @property
+    def compiled(self):
+        compiled = super().compiled
+        compiled['flight_model'] = self._flight_model.compiled
+        compiled['display_map'] = self._display_map_config
+        return compiled
 
-    def execute(self, implicit_start=False):
+    @property
+    def build_time(self):
+        """
+        Time taken to build the flight plan, in seconds.
+
+        :return: float
+        """
+        return self._build_time
+
+    def set(self, value):
+        # Starting or stopping means the displays were showing something else, so force a refresh.
+        super().set(value)
+        self._shown_second = None
+        for item in self._shown:
+            self._shown[item] = None
+
+    def execute(self, implicit_start=False, displays=True):
         # Call the parent class execute. This will handle all the controls.
         super().execute(implicit_start=implicit_start)
-        # IF the parent class decided to set the script idle, exit immediately.
-        if self._status == 'OFF':
+        if displays:
+            self.update_displays()
+
+    def update_displays(self):
+        """
+        Send the flight plan data for the current time to the displays. Content only changes on the second, and
+        displays are only written when their content changes.
+        """
+        # If the script isn't running, there's nothing to show.
+        if self._status == 'OFF' or self._start_time is None:
             return
 
-        # Now do the flight-specific items.
         # Make our run time an integer.
-        run_time = math.ceil(time.monotonic() - self._start_time)
-        flight_data = self._flight_plan[run_time]
-        # Send flight plan data to the displays.
-        # Mission Elapsed Time goes through the time string processor.
-        self._display_map['met'].show(time_7s(flight_data['met']))
-        # Velocity and Altitude go through the general number preprocessor.
-        for item in ('vel', 'alt'):
-            self._display_map[item].show(number_7s(flight_data[item]))
-
-    # Create the flight plan. This is second-by-second data pre-calculated.
-    def _build_flight_plan(self, script):
-        # Wipe the flight plan, make sure we don't have competing data.
-        self._flight_plan = []
+        run_time = min(math.ceil(time.monotonic() - self._start_time), len(self._flight_model) - 1)
+        if run_time == self._shown_second:
+            return
+        self._shown_second = run_time
+        values = self._flight_model.at(run_time)
+        rendered = self._segment_content[self._flight_model.segment_at(run_time)]
+        i = 0
+        for item in ('met', 'alt', 'vel'):
+            # Values that hold for the segment were rendered up front. The rest are rendered when they change.
+            content = rendered[i]
+            if content is None:
+                content = self._render(item, values[i])
+            if content != self._shown[item]:
+                self._shown[item] = content
+                self._display_map[item].show(content)
+            i += 1
 
-        run_time = 0
+    def _render_segments(self):
+        # Pre-render the values that hold for a whole segment, so most seconds need no formatting at all. Mission
+        # Elapsed Time goes through the time string processor, velocity and altitude through the general number
+        # preprocessor.
+        self._segment_content = []
+        for segment in self._flight_model.segments:
+            met, alt, vel = segment.constants()
+            self._segment_content.append((
+                None if met is None else time_7s(met),
+                None if alt is None else number_7s(alt),
+                None if vel is None else number_7s(vel)
+            ))
+        # Last value rendered for each item that changes within a segment, and its content.
+        self._rendered = {'met': [None, None], 'alt': [None, None], 'vel': [None, None]}
+
+    def _render(self, item, value):
+        # Render a changing value, reusing the last content if the value hasn't moved.
+        last = self._rendered[item]
+        if value != last[0] or last[1] is None:
+            last[0] = value
+            last[1] = time_7s(value) if item == 'met' else number_7s(value)
+        return last[1]
+
+    # Create the flight plan. Each block becomes a segment, holding the values at its start and how they change.
+    def _build_flight_plan(self, script):
         met_state = 'hold'
         met = 0  # Mission elapsed time.
         alt = 0  # Altitude
         vel = 0  # Velocity
         da = 0  # The per-second change in altitude
         dv = 0  # Per-second change in velocity
-        active_block = 0
 
-        # Find the end time, which is the end time of the total
-        end_time = self._blocks[-1]['end_time']
+        timeline = self._timeline
+        end_time = timeline.run_time
+        # The plan covers every whole second from zero to the end time.
+        length = int(math.floor(end_time)) + 1
 
-        self._logger.debug("Flight script blocks: {}".format(len(self._blocks)))
+        self._logger.debug("Flight script blocks: {}".format(len(timeline)))
         self._logger.debug("Flight end time: {}".format(end_time))
 
-        # Pre-create empty values for the list. That way we can direct assign it makes it easier to check for gaps.
-        i = 0
-        while i <= end_time:
-            self._flight_plan.append(None)
-            i += 1
-        # Pre-calculate each second to figure out what's what.
-        while run_time <= end_time:
-            self._logger.debug("\tProcessing run time: {}".format(run_time))
-            # If time has advanced past the end of the current block, move to the next one.
-            if run_time > self._blocks[active_block]['end_time']:
-                active_block += 1
+        segments = []
+        run_time = 0
+        active_block = 0
+        while active_block < len(timeline):
+            flight = timeline.flight[active_block]
+            if not isinstance(flight, dict):
+                raise ValueError("Flight script block {} has no flight data.".format(active_block))
+            if active_block > 0:
                 # Calculate the altitude and velocity steps needed.
-                self._logger.debug("\t\tCurrent Values:\n\t\t\tAlt: {}\n\t\t\tdA: {}\n\t\t\tVel: {}\n\t\t\tdV: {}".
-                                   format(alt, da, vel, dv))
                 try:
-                    da = ((float(self._blocks[active_block]['flight']['final_altitude']) - alt) /
-                          self._blocks[active_block]['run_time'])
+                    da = (float(flight['final_altitude']) - alt) / timeline.run_times[active_block]
                 except (KeyError, TypeError):
-                    try:
-                        if self._blocks[active_block]['flight']['alt'] == 'glide':
-                            self._logger.debug("\t\tAltitude is gliding. Keeping previous dA.")
-                        elif self._blocks[active_block]['flight']['alt'] == 'freeze':
-                            self._logger.debug("\t\tFreezing Altitude.")
-                    except KeyError:
+                    # Glide and freeze both keep the previous dA.
+                    if 'alt' not in flight:
                         self._logger.debug("Script: Cannot determine action for block {} altitude. Needs correction!".
                                            format(active_block))
                         raise
                 try:
-                    dv = ((float(self._blocks[active_block]['flight']['final_velocity']) - vel) /
-                          self._blocks[active_block]['run_time'])
+                    dv = (float(flight['final_velocity']) - vel) / timeline.run_times[active_block]
                 except (KeyError, TypeError):
-                    try:
-                        if self._blocks[active_block]['flight']['vel'] == 'glide':
-                            self._logger.debug("\t\tVelocity is gliding. Keeping previous dV.")
-                        elif self._blocks[active_block]['flight']['vel'] == 'freeze':
-                            self._logger.debug("\t\tFreezing Velocity.")
-                    except KeyError:
-                        self._logger.debug("Script: Cannot determine action for block {} altitude. Needs correction!".
+                    if 'vel' not in flight:
+                        self._logger.debug("Script: Cannot determine action for block {} velocity. Needs correction!".
                                            format(active_block))
                         raise
-                self._logger.debug("\t\tNew dA: {}\n\t\tNew dV: {}".format(da, dv))
-
-            # Update state based on instructions in this block.
-            try:
-                met_state = self._blocks[active_block]['flight']['met_state']
-            except KeyError:
-                pass
-            self._logger.debug("\t\tMET Clock State: {}".format(met_state))
-            # If an absolute time is defined for MET, use that.
-            if 'met' in self._blocks[active_block]['flight']:
-                met = self._blocks[active_block]['flight']['met']
-                self._logger.debug("Set absolute MET: {}".format(met))
-            elif met_state != 'hold':
-                # If clock is set to run, advance that.
-                met += 1
-            self._logger.debug("\t\tMET Clock Time: {}".format(met))
-
-            # Calculate a new altitude.
-            # If there's an absolute value for altitude, set it.
-            if 'alt' in self._blocks[active_block]['flight']:
-                # Don't put string values in.
-                if not isinstance(self._blocks[active_block]['flight']['alt'], str):
-                    alt = self._blocks[active_block]['flight']['alt']
-                    self._logger.debug("\t\tSetting absolute altitude.")
+            segment = BM2FlightSegment(run_time, met, alt, vel)
+            # MET clock state carries over from previous blocks unless this block sets it.
+            if 'met_state' in flight:
+                met_state = flight['met_state']
+            segment.met_running = met_state != 'hold'
+            if 'met' in flight:
+                segment.met_set = flight['met']
+            # Absolute values are set directly. String values, ie: glide or freeze, keep adding the previous change.
+            if 'alt' in flight:
+                if isinstance(flight['alt'], str):
+                    segment.alt_mode = FLIGHT_ADD
                 else:
-                    alt = alt + da
+                    segment.alt_mode = FLIGHT_SET
+                    segment.alt_set = flight['alt']
+            segment.da = da
+            if 'vel' in flight and not isinstance(flight['vel'], str):
+                segment.vel_mode = FLIGHT_SET
+                segment.vel_set = flight['vel']
+            segment.dv = dv
+            self._logger.debug("\tBlock {} from {}s: MET {} ({}), Alt {} dA {}, Vel {} dV {}".
+                               format(active_block, run_time, met, met_state, alt, da, vel, dv))
+            segments.append(segment)
+            # Run through the block's seconds to get the values the next block starts with. Always at least one
+            # second, even for a block shorter than that.
+            steps = 1 + max(0, min(length - 1, int(math.floor(timeline.ends[active_block]))) - run_time)
+            # Bulk advancing only helps long segments, and not ones with rounded altitude, ie: burns to a final
+            # altitude, which have to step every second anyway.
+            if (steps >= NUMPY_MIN_STEPS and (segment.alt_mode != FLIGHT_ROUND or segment.da == 0)
+                    and _flight_backend() == 'numpy'):
+                met, alt, vel = segment.advance_bulk(met, alt, vel, steps)
             else:
-                # Otherwise, increment based on the target velocity.
-                alt = round(alt + da, 3)
-            self._logger.debug("\t\tAltitude: {}".format(alt))
-
-            # Calculate velocity
-            # If there's an absolute value for velocity, set it.
-            if 'vel' in self._blocks[active_block]['flight']:
-                if not isinstance(self._blocks[active_block]['flight']['vel'], str):
-                    vel = self._blocks[active_block]['flight']['vel']
-                    self._logger.debug("\t\tSetting absolute velocity")
-                else:
-                    vel = vel + dv
-            else:
-                # Otherwise, increment based on the target velocity.
-                vel = vel + dv
-            self._logger.debug("\t\tVelocity: {}".format(vel))
-
-            # Assemble it all into a nice dict.
-            flight_data = {
-                'met': met,
-                'alt': alt,
-                'vel': vel
-            }
+                met, alt, vel = segment.advance(met, alt, vel, steps)
+            run_time += steps
+            active_block += 1
+            if run_time >= length:
+                break
+        return BM2FlightModel(segments, length)
 
-            self._flight_plan[run_time] = flight_data
-
-            run_time += 1
-
-    def _map_displays(self, script, displays):
-        if 'display_map' not in script:
+    def _map_displays(self, display_map, displays):
+        if display_map is None:
             raise ValueError("Script does not have display map.")
         for val in ('met', 'alt', 'vel'):
-            if val not in script['display_map']:
+            if val not in display_map:
                 raise ValueError("Display map does not map '{}'!".format(val))
-        for md in script['display_map']:
-            self._display_map[md] = displays[script['display_map'][md]]
+        for md in display_map:
+            self._display_map[md] = displays[display_map[md]]
+
+    @property
+    def next_event(self):
+        """
+        Monotonic time of the next block boundary or display update, whichever is sooner.
+        """
+        next_event = super().next_event
+        if next_event is None:
+            return None
+        # Displays update once a second.
+        next_second = self._start_time + math.floor(time.monotonic() - self._start_time) + 1
+        return min(next_event, next_second)
+
+
+def benchmark_flight(hours=(1, 10), block_time=60, iterations=3):
+    """
+    Measure flight plan build time with each backend, for synthetic scripts of different lengths. The 'burn' profile
+    alternates burns to a final altitude with glides, like a real launch. Burns have rounded altitude, which always
+    steps in Python. The 'glide' profile only has blocks that can be advanced in bulk.
+
+    :param hours: Script lengths to measure, in hours.
+    :type hours: tuple
+    :param block_time: Length of each block, in seconds.
+    :type block_time: int
+    :param iterations: Builds to average over for each measurement.
+    :type iterations: int
+    :return: dict of (python, numpy) milliseconds by (profile, hours). NumPy is None if it isn't available.
+    """
+    global FLIGHT_BACKEND
+    saved_backend = FLIGHT_BACKEND
+    FLIGHT_BACKEND = None
+    numpy_available = _flight_backend() == 'numpy'
+    display_map = {'met': 'met', 'alt': 'alt', 'vel': 'vel'}
+    displays = {'met': None, 'alt': None, 'vel': None}
+    results = {}
+    try:
+        for profile in ('burn', 'glide'):
+            for length in hours:
+                blocks = [{'run_time': block_time, 'controls': {},
+                           'flight': {'met': 0, 'met_state': 'run', 'alt': 0, 'vel': 0}}]
+                for i in range(1, int(length * 3600 / block_time)):
+                    if profile == 'burn' and i % 2 == 1:
+                        flight = {'final_altitude': i * 10, 'final_velocity': i * 100}
+                    elif profile == 'burn':
+                        flight = {'alt': 'glide', 'vel': 'glide'}
+                    else:
+                        flight = {'alt': 'glide', 'final_velocity': i * 100}
+                    blocks.append({'run_time': block_time, 'controls': {}, 'flight': flight})
+                script = {'id': 'benchmark', 'name': 'Benchmark', 'type': 'flight', 'run': 'once',
+                          'display_map': display_map, 'blocks': blocks}
+                timings = []
+                for backend in ('python', 'numpy'):
+                    if backend == 'numpy' and not numpy_available:
+                        timings.append(None)
+                        continue
+                    FLIGHT_BACKEND = backend
+                    total = 0
+                    for i in range(iterations):
+                        total += BM2FlightScript(script, {}, displays).build_time
+                    timings.append(total / iterations * 1000)
+                results[(profile, length)] = tuple(timings)
+    finally:
+        FLIGHT_BACKEND = saved_backend
+    return results
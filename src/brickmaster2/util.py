@@ -3,10 +3,6 @@ import os
 import sys
 
 
-if sys.implementation.name == 'cpython':
-    import netifaces
-
-
 def fetch_config(base_url):
     """
     Fetch a configuration json from a remote URL.
@@ -39,6 +35,7 @@ def mac_id(wifihw='wlan0'):
     :return:
     """
     # #TODO: Replace this with actually checking against the default route. May be too many edge cases.
+    import netifaces
     mac = netifaces.ifaddresses(wifihw)[netifaces.AF_PACKET][0]['addr']
     return mac.replace(':', '')
 
@@ -72,5 +69,6 @@ def interface_status(interface):
     :return: bool
     """
     # If the interface has an IP, it's up.
+    import netifaces
     addr = netifaces.ifaddresses(interface)
     return netifaces.AF_INET in addr
\ No newline at end of file